@@ -1,106 +1,227 @@
 import os
+import sys
 import random
 import numpy as np
-import onnxruntime as ort
+
+# Shared helpers (featurizer, ...) live at the repo root next to agent.py
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+
+from featurizer import StateFeaturizer
+from ort_session import create_session, resolve_session_config, warm_up
+from inference_pool import InferencePool
+from q_cache import QValueCache
+from metrics import timed
 
 class Agent:
     """
     An agent for the DEADLOCK NETWORK that uses an ONNX Q-network model to make decisions.
     """
-    def __init__(self, model_path=None):
+    def __init__(self, model_path=None, session_config=None, inference_workers=None, q_cache_size=None, load_model=True):
         """
         Initializes the Agent and loads the ONNX Q-network model.
         Model path is taken from the `model_path` argument or the `AGENT_MODEL_PATH`
         environment variable. If neither is provided, falls back to the relative
         path `Q_Layered_Network/dqn_node_model.onnx` inside the repo.
+
+        `session_config` tunes the ONNX Runtime session (thread counts, execution mode,
+        graph optimization level, optimized-model cache, memory arena, warm-up batch size);
+        unset keys fall back to the AGENT_ORT_* environment variables (see ort_session.py).
+
+        With `inference_workers` (or `AGENT_INFERENCE_WORKERS`) above 0, the model is loaded
+        in that many worker processes instead (see inference_pool.py) and batches are
+        dispatched to them; `choose_action`/`choose_actions` behave the same either way.
+
+        With `q_cache_size` (or `AGENT_Q_CACHE_SIZE`) above 0, Q-values are memoized per
+        featurized state in an LRU cache of that many entries (see q_cache.py).
+
+        With `load_model=False`, nothing is loaded and the agent picks random actions
+        (a stand-in while the real model loads in the background).
         """
         self.q_network = None
+        self.model_path = None
         self.input_name = None
         self.output_name = None
+        self.fixed_batch_size = None
+        self.session_config = {}
+        self.pool = None
+        self.q_cache = None
         self.state_size = 128  # Based on analysis of the training script
+        self.featurizer = StateFeaturizer(self.state_size)
 
         # Resolve model path: explicit arg -> env var -> default relative path
         if model_path is None:
-            model_path = ('C:/Users/deads/OneDrive/Documents/AGI/DEADLOCK-LANDING-PAGE/Q_Layered_Network/dqn_node_model.onnx')
+            model_path = os.getenv('AGENT_MODEL_PATH', 'Q_Layered_Network/dqn_node_model.onnx')
 
-        # Expand user and make absolute if relative
+        # Expand user and make absolute if relative (to the repo root, as in agent.py)
         model_path = os.path.expanduser(model_path)
         if not os.path.isabs(model_path):
-            repo_root = os.path.dirname(__file__)
-            model_path = os.path.join(repo_root, model_path)
+            model_path = os.path.join(_REPO_ROOT, model_path)
+        self.model_path = model_path
+        if not load_model:
+            return
 
         try:
             print(f"Attempting to load ONNX Q-network from: {model_path}")
-            self.q_network = ort.InferenceSession(model_path)
+            self.session_config = resolve_session_config(session_config)
+            if q_cache_size is None:
+                q_cache_size = int(os.getenv('AGENT_Q_CACHE_SIZE', '0'))
+            if q_cache_size > 0:
+                self.q_cache = QValueCache(q_cache_size)
+            if inference_workers is None:
+                inference_workers = int(os.getenv('AGENT_INFERENCE_WORKERS', '0'))
+            if inference_workers > 0:
+                # Each worker process loads and warms up its own session
+                self.pool = InferencePool(model_path, inference_workers, self.session_config, self.state_size)
+                print(f"Agent initialized with {inference_workers} ONNX inference workers for {model_path}.")
+                return
+            self.q_network = create_session(model_path, self.session_config)
             self.input_name = self.q_network.get_inputs()[0].name
             self.output_name = self.q_network.get_outputs()[0].name
+            # Models exported with a fixed batch dimension have to be fed in chunks of that size
+            batch_dim = self.q_network.get_inputs()[0].shape[0]
+            self.fixed_batch_size = batch_dim if isinstance(batch_dim, int) and batch_dim > 0 else None
             print(f"Agent initialized with ONNX Q-network from {model_path}.")
+            self.warm_up()
         except FileNotFoundError:
             print(f"Model file not found at {model_path}. Agent will use random action selection.")
         except Exception as e:
             print(f"Error loading ONNX Q-network: {e}. Agent will use random action selection.")
 
+    def warm_up(self):
+        """
+        Runs a dummy (1, 128) batch and a max-size batch through the Q-network so the
+        first real request doesn't pay ONNX Runtime's lazy initialization cost.
+        """
+        max_batch = self.session_config.get("warmup_batch_size", 64)
+        if not self.q_network or max_batch <= 0:
+            return
+        batch_sizes = [1] if max_batch == 1 else [1, max_batch]
+        elapsed = warm_up(self._run_q_network, self.state_size, batch_sizes)
+        print(f"Agent Q-network warmed up with batch sizes {batch_sizes} in {elapsed * 1000:.1f} ms.")
+
     def choose_action(self, state):
         """
         Chooses an action based on the current state of the network using the ONNX model.
         """
-        available_actions = self.get_available_actions(state)
-        
-        if not available_actions:
-            return {"action": "idle", "details": "No actions available."}
+        return self.choose_actions([state])[0]
 
-        # If the model isn't loaded, fall back to random action selection
-        if not self.q_network:
-            return random.choice(available_actions)
+    def choose_actions(self, states):
+        """
+        Chooses one action for each state in `states` using a single batched ONNX call.
+        The pre-processed states are stacked into an (N, 128) batch, and the best
+        available action per state is picked with a masked argmax over the Q-values.
+        """
+        return self.choose_prepared(*self.prepare(states))
+
+    def has_model(self):
+        """True when a Q-network is loaded (in-process or in the worker pool)."""
+        return self.q_network is not None or self.pool is not None
+
+    def prepare(self, states):
+        """
+        Computes the available actions of every state, and the (N, 128) feature batch
+        of the states that have any (None if none do), for `choose_prepared`.
+        The batch is a reused buffer; copy it to keep it across calls.
+        """
+        with timed("actions"):
+            action_lists = [self.get_available_actions(state) for state in states]
+        pending = [states[i] for i, available_actions in enumerate(action_lists) if available_actions]
+        if not pending or not self.has_model():
+            return action_lists, None
+        with timed("featurize"):
+            return action_lists, self.featurizer.transform_batch(pending)
+
+    def choose_prepared(self, action_lists, batch):
+        """
+        Picks the actions for states already run through `prepare` (possibly by another
+        agent with the same featurizer), so several models can score the same batch.
+        """
+        chosen = [None] * len(action_lists)
+
+        # States without actions go idle and never reach the Q-network
+        pending = []
+        for i, available_actions in enumerate(action_lists):
+            if available_actions:
+                pending.append(i)
+            else:
+                chosen[i] = {"action": "idle", "details": "No actions available."}
+
+        if not pending:
+            return chosen
+
+        # If the model isn't loaded (or the states weren't featurized), fall back to random action selection
+        if not self.has_model() or batch is None:
+            for i in pending:
+                chosen[i] = random.choice(action_lists[i])
+            return chosen
 
         # --- Q-Network Logic ---
-        # 1. Pre-process state
-        processed_state = self.preprocess_state(state)
-        
-        # 2. Get Q-values from the ONNX model
-        q_values = self.q_network.run([self.output_name], {self.input_name: processed_state})[0][0]
-        
-        # 3. Choose the best available action based on Q-values
-        # We map the available actions to the first N q-values.
-        best_action = None
-        max_q_value = -np.inf
-        
-        for i, action in enumerate(available_actions):
-            if i < len(q_values) and q_values[i] > max_q_value:
-                max_q_value = q_values[i]
-                best_action = action
-        
-        return best_action if best_action else random.choice(available_actions)
+        # 1. Get Q-values for the whole (N, 128) batch from the ONNX model
+        q_values = self._q_values(batch)
+
+        # 2. Choose the best available action per state based on Q-values.
+        # Available actions map to the first N q-values, so every slot past a
+        # state's action count (and any NaN output) is masked out.
+        counts = np.fromiter((len(action_lists[i]) for i in pending), dtype=np.intp, count=len(pending))
+        valid = (np.arange(q_values.shape[1]) < counts[:, None]) & ~np.isnan(q_values)
+        masked = np.where(valid, q_values, -np.inf)
+        best = masked.argmax(axis=1)
+        best_q = masked[np.arange(len(pending)), best]
+
+        for row, i in enumerate(pending):
+            if best_q[row] > -np.inf:
+                chosen[i] = action_lists[i][best[row]]
+            else:
+                chosen[i] = random.choice(action_lists[i])
+
+        return chosen
+
+    def _q_values(self, batch):
+        """
+        Returns the (N, K) Q-values for an (N, 128) batch, from the Q-value cache when
+        enabled (only the uncached rows reach the model) or straight from the model.
+        """
+        if self.q_cache is not None:
+            return self.q_cache.lookup(batch, self._run_q_network, self.pool or self.q_network)
+        return self._run_q_network(batch)
+
+    def _run_q_network(self, batch):
+        """
+        Runs the ONNX Q-network over an (N, 128) batch and returns the (N, K) Q-values.
+        """
+        with timed("onnx_run"):
+            return self._run_model(batch)
+
+    def _run_model(self, batch):
+        if self.pool is not None:
+            return self.pool.run(batch)
+
+        if self.fixed_batch_size is None or len(batch) == self.fixed_batch_size:
+            return self.q_network.run([self.output_name], {self.input_name: batch})[0]
+
+        # Fixed-batch models: run in chunks, padding the last chunk with zero rows
+        size = self.fixed_batch_size
+        chunks = []
+        for start in range(0, len(batch), size):
+            chunk = batch[start:start + size]
+            rows = len(chunk)
+            if rows < size:
+                chunk = np.vstack([chunk, np.zeros((size - rows, batch.shape[1]), dtype=batch.dtype)])
+            chunks.append(self.q_network.run([self.output_name], {self.input_name: chunk})[0][:rows])
+        return np.vstack(chunks)
 
 
     def preprocess_state(self, state):
         """
         Converts the state dictionary into a NumPy array for the ONNX model.
         The model expects a 1D array of size 128.
+        The returned (1, 128) array is a reused buffer; copy it to keep it across calls.
         """
-        # Create a numerical representation of the state
-        # This is a simplified representation. A more complex one could include more features.
-        text_representation = ""
-        
-        # Add mission titles
-        for mission in state.get("missions", []):
-            if mission["status"] == "available" or mission["status"] == "in_progress":
-                text_representation += mission["title"] + " "
-
-        # Add data haven names
-        for data in state.get("data_havens", []):
-            if not data["analyzed"]:
-                text_representation += data["name"] + " "
-
-        # Convert text to ordinal values
-        ord_values = [ord(char) for char in text_representation]
-        
-        # Pad or truncate to the required state size
-        padded_values = np.zeros(self.state_size, dtype=np.float32)
-        length = min(len(ord_values), self.state_size)
-        padded_values[:length] = ord_values[:length]
-        
-        return padded_values.reshape(1, -1)
+        # Mission titles and unanalyzed data haven names as ordinal values,
+        # padded or truncated to the required state size (see featurizer.py).
+        return self.featurizer.transform(state)
 
 
     def get_available_actions(self, state):
@@ -108,6 +229,10 @@ class Agent:
         Determines the list of possible actions based on the current state.
         The order of actions here is important as it maps to the Q-network output.
         """
+        # Indexed stores (state_store.NetworkState) keep an incrementally updated action index
+        if hasattr(state, "available_actions"):
+            return state.available_actions()
+
         actions = []
 
         # Action: Complete a mission
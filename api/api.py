@@ -1,14 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import uvicorn
 import os
 import random
-import numpy as np
-import onnxruntime as ort
 
 # Import the Agent class from agent.py
 from agents import Agent
+from batcher import AgentMicroBatcher
+# Importing agents puts the repo root on sys.path for the shared modules below
+from state_cache import EncodedStateCache
+from model_registry import ModelRegistry
+import metrics
+from metrics import MetricsMiddleware, timed
+from startup import StartupReport
+
+# Boot phases for GET /readyz (created after the imports above, which put startup.py on sys.path)
+startup_report = StartupReport()
 
 app = FastAPI()
 
@@ -24,9 +33,13 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency histograms for /metrics (see metrics.py)
+app.add_middleware(MetricsMiddleware)
 
-# Global agent instance
-agent_instance: Agent = None
+# Global agent instance: a ModelRegistry of loaded Q-networks, used like an Agent
+agent_instance: ModelRegistry = None
+# Micro-batcher that groups concurrent agent cycles into one ONNX call
+agent_batcher: AgentMicroBatcher = None
 
 # Request models
 class ChatRequest(BaseModel):
@@ -48,43 +61,63 @@ class AgentCycleResponse(BaseModel):
 
 @app.on_event("startup")
 async def startup_event():
-    global agent_instance
+    global agent_instance, agent_batcher
     print("Loading agent...")
     try:
         # Assuming the model path is relative to the project root or handled by Agent
-        agent_instance = Agent() 
-        print("Agent loaded successfully.")
+        # The Q-network loads in the background; until then the agent picks random actions
+        agent_instance = ModelRegistry.from_env(Agent)
+        if not agent_instance.ready.is_set():
+            startup_report.expect("model_load")
+        agent_instance.start(startup_report)
+        print("Agent registry created.")
     except Exception as e:
         print(f"Error loading agent: {e}. Agent will be None, potentially leading to errors.")
         agent_instance = None
 
+    if agent_instance:
+        agent_batcher = AgentMicroBatcher(agent_instance)
+        await agent_batcher.start()
+        print(f"Agent micro-batcher started (window: {agent_batcher.window * 1000:.1f} ms, max batch: {agent_batcher.max_batch_size}).")
+    startup_report.serving()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if agent_batcher:
+        await agent_batcher.stop()
+    if agent_instance:
+        agent_instance.close()
+
 
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to the Deadlock Landing Page API"}
 
+# This is a dummy state similar to what the frontend expects for initialization.
+# In a real application, this would come from a game state manager or database.
+DUMMY_STATE = {
+    "resources": 10000,
+    "log": ["System initialized.", "Waiting for commands."],
+    "missions": [
+        {"id": "m1", "title": "Corporate Espionage", "status": "available", "reward": 5000, "cost": 1000},
+        {"id": "m2", "title": "Data Heist", "status": "in_progress", "reward": 2000, "cost": 500},
+    ],
+    "data_havens": [
+        {"id": "d1", "name": "corp_intel_q3.zip", "analyzed": False, "value": 750},
+        {"id": "d2", "name": "agent_profiles.db", "analyzed": True, "value": 1200},
+    ],
+    "agents": [
+        {"id": "a1", "name": "Zero", "status": "available"},
+        {"id": "a2", "name": "Ghost", "status": "deployed"}
+    ]
+}
+# The dummy state never changes, so it is encoded once and served as version 0
+state_cache = EncodedStateCache()
+
 # New endpoint for /api/state
 @app.get("/api/state")
-async def get_state():
-    # This is a dummy state similar to what the frontend expects for initialization.
-    # In a real application, this would come from a game state manager or database.
-    dummy_state = {
-        "resources": 10000,
-        "log": ["System initialized.", "Waiting for commands."],
-        "missions": [
-            {"id": "m1", "title": "Corporate Espionage", "status": "available", "reward": 5000, "cost": 1000},
-            {"id": "m2", "title": "Data Heist", "status": "in_progress", "reward": 2000, "cost": 500},
-        ],
-        "data_havens": [
-            {"id": "d1", "name": "corp_intel_q3.zip", "analyzed": False, "value": 750},
-            {"id": "d2", "name": "agent_profiles.db", "analyzed": True, "value": 1200},
-        ],
-        "agents": [
-            {"id": "a1", "name": "Zero", "status": "available"},
-            {"id": "a2", "name": "Ghost", "status": "deployed"}
-        ]
-    }
-    return dummy_state
+async def get_state(request: Request):
+    return state_cache.response(request, 0, lambda: DUMMY_STATE)
 
 
 @app.post("/api/chat", response_model=ChatResponse)
@@ -117,7 +150,7 @@ async def chat_endpoint(request: ChatRequest):
     
     response_message = f"Acknowledged: '{request.prompt}'. Agent chose action: {chosen_action.get('action', 'unknown')}."
     
-    return ChatResponse(response=response_message, session_id="default_session", action=chosen_action) # session_id remains default for now
+    return ChatResponse(response=response_message, session_id=request.wallet or "default_session", action=chosen_action) # the wallet keys the operator's world on server.py
 
 @app.post("/api/run_agent_cycle", response_model=AgentCycleResponse)
 async def run_agent_cycle_endpoint(request: AgentCycleRequest):
@@ -127,11 +160,58 @@ async def run_agent_cycle_endpoint(request: AgentCycleRequest):
     print(f"Received agent cycle request with payload: {request.payload}")
     
     try:
-        # The payload is expected to be the state for the agent to choose an action
-        chosen_action = agent_instance.choose_action(request.payload)
+        # The payload is expected to be the state for the agent to choose an action.
+        # Concurrent cycles are batched into one ONNX call off the event loop.
+        with timed("agent_batch"):
+            chosen_action = await agent_batcher.choose_action(request.payload)
         return AgentCycleResponse(status="success", result={"action": chosen_action})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during agent cycle: {e}")
 
+@app.get("/api/batcher/stats")
+async def batcher_stats():
+    """Queue depth, batch-size histogram and wait times of the agent micro-batcher."""
+    if not agent_batcher:
+        raise HTTPException(status_code=500, detail="Agent not loaded.")
+    return agent_batcher.stats()
+
+@app.get("/api/models")
+async def list_models():
+    """Loaded Q-networks, the active one and the candidate, with per-model latency stats."""
+    if not agent_instance:
+        raise HTTPException(status_code=500, detail="Agent not loaded.")
+    return agent_instance.stats()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 once the Q-network has loaded, 503 while the agent still runs on random
+    actions (status "no_model" if none could be loaded, unless AGENT_READY_WITHOUT_MODEL=1).
+    """
+    model_status = agent_instance.model_status() if agent_instance else "no_model"
+    ready = startup_report.ready.is_set() and model_status == "ready"
+    body = {
+        "ready": ready,
+        "status": "ready" if ready else ("no_model" if model_status == "no_model" else "starting"),
+        "model": agent_instance.active.name if agent_instance else None,
+        "startup": startup_report.summary(),
+    }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage and route latency histograms in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/slow")
+async def slow_requests():
+    """The slowest requests with their stage breakdown (set DEADLOCK_SLOW_REQUESTS=N to collect them)."""
+    return metrics.slow_requests()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8002)
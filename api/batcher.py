@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AgentMicroBatcher:
+    """
+    Collects concurrent agent-cycle requests and runs them through one batched
+    `Agent.choose_actions` call, off the event loop.
+
+    A batch is closed when `max_batch_size` requests are pending or `window_ms`
+    has passed since the first request of the batch arrived, whichever comes first.
+    Both default to the `AGENT_BATCH_WINDOW_MS` / `AGENT_BATCH_MAX_SIZE` environment variables.
+    A request that makes the batched call fail fails alone: the rest of its batch is
+    then run one state at a time.
+    """
+    def __init__(self, agent, window_ms=None, max_batch_size=None, wait_samples=1024):
+        self.agent = agent
+        if window_ms is None:
+            window_ms = float(os.getenv('AGENT_BATCH_WINDOW_MS', '2'))
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv('AGENT_BATCH_MAX_SIZE', '64'))
+        self.window = max(window_ms, 0.0) / 1000.0
+        self.max_batch_size = max(int(max_batch_size), 1)
+
+        self._queue = None
+        self._task = None
+        # A single inference thread keeps the agent from being called concurrently
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-batcher")
+
+        # --- Stats ---
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0  # failed requests
+        self.fallbacks = 0  # batches retried state by state after the batched call failed
+        self.batch_size_histogram = {}
+        self._wait_times = deque(maxlen=wait_samples)
+        self._wait_total = 0.0
+
+    async def start(self):
+        """Starts the background batching loop on the running event loop."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stops the batching loop and fails any request still waiting in the queue."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Agent batcher stopped."))
+        self._executor.shutdown(wait=False)
+
+    async def choose_action(self, state):
+        """Queues `state` for the next batch and waits for its chosen action."""
+        if self._task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((state, future, time.perf_counter()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Requests whose callers went away are dropped before inference
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self._wait_times.append(started - enqueued)
+                self._wait_total += started - enqueued
+            self.requests += len(batch)
+            self.batches += 1
+            bucket = self._bucket(len(batch))
+            self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+
+            results = await loop.run_in_executor(self._executor, self._choose, [state for state, _, _ in batch])
+            for (_, future, _), (action, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    self.errors += 1
+                    future.set_exception(error)
+                else:
+                    future.set_result(action)
+
+    def _choose(self, states):
+        """
+        [(action, exception or None)] per state. When the batched call fails (e.g. one
+        malformed payload), the states are retried one by one, so only the bad ones fail.
+        """
+        try:
+            return [(action, None) for action in self.agent.choose_actions(states)]
+        except Exception as e:
+            if len(states) == 1:
+                return [(None, e)]
+        self.fallbacks += 1
+        results = []
+        for state in states:
+            try:
+                results.append((self.agent.choose_actions([state])[0], None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def _bucket(self, size):
+        """Upper bound of the power-of-two histogram bucket that `size` falls into."""
+        bound = 1
+        while bound < size:
+            bound *= 2
+        return min(bound, self.max_batch_size)
+
+    def stats(self):
+        """Returns queue depth, batch-size histogram and queue wait-time statistics."""
+        waits = sorted(self._wait_times)
+
+        def percentile(p):
+            if not waits:
+                return 0.0
+            return waits[min(int(p * len(waits)), len(waits) - 1)] * 1000.0
+
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+            "wait_ms": {
+                "mean": self._wait_total / self.requests * 1000.0 if self.requests else 0.0,
+                "p50": percentile(0.50),
+                "p99": percentile(0.99),
+                "max": waits[-1] * 1000.0 if waits else 0.0,
+            },
+        }
@@ -0,0 +1,366 @@
+"""
+Benchmark suite for the agent and API hot paths.
+
+Micro-benchmarks time featurization, action enumeration and ONNX inference (batch sizes
+1..1024, on a generated test model); load tests drive `server.py`, `api/api.py` and
+`chat_server.py` (with the fake LLM) in-process over ASGI at several world sizes and
+report throughput and p50/p95/p99 latency. Results are written as JSON, and a previous
+run can be used as the baseline to flag regressions:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --compare baseline.json            # exits 1 on regressions
+    python benchmark.py --suite micro --quick
+    python benchmark.py --suite load --apps chat --sizes 10,100000
+
+Worlds are generated from a fixed seed, so runs on the same machine are comparable.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+WORLD_SIZES = (10, 1000, 100_000, 1_000_000)
+QUICK_WORLD_SIZES = (10, 1000)
+BATCH_SIZES = (1, 4, 16, 64, 256, 1024)
+QUICK_BATCH_SIZES = (1, 64, 1024)
+APPS = ("server", "api", "chat")
+WORDS = ["Corporate", "Espionage", "Data", "Heist", "Asset", "Extraction", "Ghost", "Protocol", "Null", "Vector"]
+
+
+def log(message):
+    # Progress goes to stderr: stdout carries the JSON report, and the servers' own prints are silenced
+    print(message, file=sys.stderr, flush=True)
+
+
+# --- Worlds ---
+def make_world(size, seed=0):
+    """A `network_state`-shaped world with `size` entities, about two missions per data haven."""
+    rng = random.Random(seed)
+    n_missions = max(size * 2 // 3, 1)
+    missions = [
+        {"id": f"m{i}", "title": f"{rng.choice(WORDS)} {rng.choice(WORDS)} {i}",
+         "status": rng.choice(("available", "available", "in_progress", "completed")),
+         "reward": rng.randint(100, 9000), "cost": rng.randint(0, 5000)}
+        for i in range(n_missions)
+    ]
+    havens = [
+        {"id": f"d{i}", "name": f"{rng.choice(WORDS).lower()}_{i}.db",
+         "analyzed": rng.random() < 0.4, "value": rng.randint(100, 3000)}
+        for i in range(max(size - n_missions, 0))
+    ]
+    return {
+        "missions": missions,
+        "data_havens": havens,
+        "agents": [{"id": "a1", "name": "Zero", "status": "available"}],
+        "log": ["System initialized. Welcome, operator."],
+        "resources": 10000,
+    }
+
+
+# --- Measurement ---
+def summarize(seconds, items=1):
+    """Latency percentiles (ms) and throughput of a list of per-call durations."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    total = float(seconds.sum())
+    return {
+        "runs": int(len(seconds)),
+        "mean_ms": float(seconds.mean()) * 1000,
+        "p50_ms": float(np.percentile(seconds, 50)) * 1000,
+        "p95_ms": float(np.percentile(seconds, 95)) * 1000,
+        "p99_ms": float(np.percentile(seconds, 99)) * 1000,
+        "ops_per_sec": len(seconds) / total if total else None,
+        "items_per_sec": len(seconds) * items / total if total else None,
+    }
+
+
+def measure(fn, items=1, min_time=0.5, min_runs=5, max_runs=100_000):
+    """Calls `fn` (after one warm-up call) until `min_time` has passed and at least `min_runs` runs."""
+    fn()
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < max_runs and (len(timings) < min_runs or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings, items)
+
+
+# --- Micro-benchmarks ---
+def micro_benchmarks(args, workdir):
+    from agent import Agent
+    from featurizer import StateFeaturizer
+    from model_parity import make_test_model, random_world
+    from ort_session import create_session, resolve_session_config
+    from state_store import NetworkState
+
+    results = {}
+    featurizer = StateFeaturizer()
+    # An Agent without a model: get_available_actions only needs the class
+    bare_agent = Agent.__new__(Agent)
+
+    for size in args.sizes:
+        log(f"micro: world size {size}")
+        world = make_world(size, args.seed)
+        store = NetworkState.from_dict(world)
+        results[f"micro.featurize.dict.size_{size}"] = measure(lambda: featurizer.transform(world), min_time=args.min_time)
+        results[f"micro.featurize.store.size_{size}"] = measure(lambda: featurizer.transform(store), min_time=args.min_time)
+        results[f"micro.actions.dict.size_{size}"] = measure(
+            lambda: bare_agent.get_available_actions(world), min_time=args.min_time)
+
+        # One transition per call, as in an agent cycle: flip a mission, then enumerate
+        cursor = [0]
+
+        def transition_and_enumerate():
+            i = cursor[0] % len(store.mission_ids)
+            cursor[0] += 1
+            store.set_mission_status(i, "completed" if store.mission_status_of(i) == "available" else "available")
+            store.available_actions()
+
+        results[f"micro.actions.store.size_{size}"] = measure(transition_and_enumerate, min_time=args.min_time)
+
+    rng = random.Random(args.seed)
+    worlds = [NetworkState.from_dict(random_world(rng)) for _ in range(max(args.batch_sizes))]
+    model_path = make_test_model(os.path.join(workdir, "dqn_benchmark_model.onnx"), seed=args.seed)
+    session = create_session(model_path, resolve_session_config())
+    input_name, output_name = session.get_inputs()[0].name, session.get_outputs()[0].name
+    for batch_size in args.batch_sizes:
+        log(f"micro: batch size {batch_size}")
+        states = worlds[:batch_size]
+        results[f"micro.featurize.batch_{batch_size}"] = measure(
+            lambda: featurizer.transform_batch(states), items=batch_size, min_time=args.min_time)
+        batch = featurizer.transform_batch(states).copy()
+        results[f"micro.inference.batch_{batch_size}"] = measure(
+            lambda: session.run([output_name], {input_name: batch}), items=batch_size, min_time=args.min_time)
+    return results, model_path
+
+
+# --- ASGI load tests ---
+def load_app(name):
+    """Imports one of the servers with benchmark-safe settings and returns the module."""
+    # Never touch a real state database, model directory or OpenAI account
+    for var in ("DEADLOCK_STATE_DB", "AGENT_MODEL_WATCH_DIR", "AGENT_CANDIDATE_MODEL_PATH"):
+        os.environ.pop(var, None)
+    os.environ["DEADLOCK_FAKE_LLM"] = "1"
+    os.environ.setdefault("DEADLOCK_FAKE_LLM_DELAY", "0")
+    # server.py mounts ./static, so the servers are imported from the repo root
+    os.chdir(ROOT)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    if name == "server":
+        import server
+        return server
+    if name == "chat":
+        import chat_server
+        return chat_server
+    # api/api.py imports its siblings (agents, batcher) as top-level modules
+    api_dir = os.path.join(ROOT, "api")
+    if api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+    spec = importlib.util.spec_from_file_location("api_server", os.path.join(api_dir, "api.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def use_model(registry, model_path):
+    """Loads the benchmark model into a server's model registry and makes it active."""
+    registry.set_active(registry.load(model_path).name)
+
+
+async def drive(client, make_request, concurrency, duration, min_requests):
+    """Runs `concurrency` request loops for `duration` seconds (and `min_requests` in total)."""
+    timings, errors, issued = [], 0, 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors, issued
+        while time.perf_counter() < deadline or issued < min_requests:
+            n = issued
+            issued += 1
+            started = time.perf_counter()
+            response = await make_request(client, n)
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = summarize(timings)
+    result.update(requests=len(timings), errors=errors, concurrency=concurrency,
+                  throughput_rps=len(timings) / elapsed if elapsed else None)
+    return result
+
+
+def scenarios(name, module, world, size):
+    """(label, request function) pairs to load-test `module` with a world of `size` entities."""
+    from state_store import NetworkState
+
+    if name == "server":
+        from state_cache import EncodedStateCache
+        from state_stream import StateBroadcaster
+
+        state = NetworkState.from_dict(world)
+        module.network_state = state
+        module.state_stream = StateBroadcaster(state)
+        module.state_cache = EncodedStateCache()
+        return [
+            ("state", lambda client, n: client.get("/api/state")),
+            ("run_agent_cycle", lambda client, n: client.post("/api/run_agent_cycle")),
+        ]
+    if name == "chat":
+        module.local_state = NetworkState.from_dict(world)
+        # Distinct prompts on an empty cache, so every request reaches the LLM
+        module.chat_cache.clear()
+        return [("chat", lambda client, n: client.post("/api/chat", json={"prompt": f"Status report {n}"}))]
+
+    body = json.dumps({"payload": world}).encode()
+    headers = {"content-type": "application/json"}
+    return [("run_agent_cycle", lambda client, n: client.post("/api/run_agent_cycle", content=body, headers=headers))]
+
+
+async def load_test(name, args, model_path):
+    import httpx
+
+    results = {}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        module = load_app(name)
+        app = module.app
+        async with app.router.lifespan_context(app):
+            registry = getattr(module, "models", None) or getattr(module, "agent_instance", None)
+            if registry is not None:
+                use_model(registry, model_path)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+                for size in args.sizes:
+                    log(f"load: {name} world size {size}")
+                    world = make_world(size, args.seed)
+                    for label, make_request in scenarios(name, module, world, size):
+                        results[f"load.{name}.{label}.size_{size}"] = await drive(
+                            client, make_request, args.concurrency, args.duration, args.min_requests)
+    return results
+
+
+# --- Reporting ---
+def environment():
+    import onnxruntime
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "onnxruntime": onnxruntime.__version__,
+    }
+
+
+def compare(baseline, current, tolerance, metric="p50_ms"):
+    """
+    Compares `metric` (a latency, lower is better) of every benchmark present in both
+    reports. Returns (rows, regressions): a benchmark regresses when it got slower than
+    the baseline by more than `tolerance` (0.2 = 20%).
+    """
+    rows, regressions = [], []
+    for name in sorted(set(baseline["results"]) & set(current["results"])):
+        before = baseline["results"][name].get(metric)
+        after = current["results"][name].get(metric)
+        if not before or after is None:
+            continue
+        ratio = after / before
+        rows.append({"name": name, "baseline": before, "current": after, "ratio": ratio})
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_comparison(rows, regressions, metric):
+    log(f"{'benchmark':<52} {'baseline ' + metric:>18} {'current':>10} {'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["name"] in regressions else ""
+        log(f"{row['name']:<52} {row['baseline']:>18.3f} {row['current']:>10.3f} {row['ratio'] - 1:>+8.1%}{flag}")
+    log(f"{len(regressions)} regression(s) out of {len(rows)} compared benchmarks.")
+
+
+def parse_sizes(text):
+    return tuple(int(size) for size in text.split(",") if size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agent and API hot paths.")
+    parser.add_argument("--suite", default="all", choices=("all", "micro", "load"))
+    parser.add_argument("--apps", default=",".join(APPS), help=f"load-test targets (comma-separated: {', '.join(APPS)})")
+    parser.add_argument("--sizes", type=parse_sizes, default=None, help="world sizes in entities (comma-separated)")
+    parser.add_argument("--batch-sizes", type=parse_sizes, default=None, help="inference / featurization batch sizes")
+    parser.add_argument("--quick", action="store_true", help="small worlds and batches, shorter runs (smoke test)")
+    parser.add_argument("--min-time", type=float, default=None, help="seconds per micro-benchmark")
+    parser.add_argument("--duration", type=float, default=None, help="seconds per load-test scenario")
+    parser.add_argument("--min-requests", type=int, default=3, help="requests per load-test scenario at least")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per load-test scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a previous report; exit 1 on regressions")
+    parser.add_argument("--current", metavar="REPORT", help="with --compare, compare this report instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    parser.add_argument("--metric", default="p50_ms", help="latency field to compare (p50_ms, p95_ms, p99_ms, mean_ms)")
+    args = parser.parse_args(argv)
+    for name in ("output", "compare", "current"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    args.sizes = args.sizes or (QUICK_WORLD_SIZES if args.quick else WORLD_SIZES)
+    args.batch_sizes = args.batch_sizes or (QUICK_BATCH_SIZES if args.quick else BATCH_SIZES)
+    args.min_time = args.min_time if args.min_time is not None else (0.1 if args.quick else 0.5)
+    args.duration = args.duration if args.duration is not None else (0.5 if args.quick else 3.0)
+
+    if args.current:
+        with open(args.current) as f:
+            report = json.load(f)
+    else:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "environment": environment(),
+            "settings": {key: value for key, value in vars(args).items()
+                         if key not in ("output", "compare", "current", "tolerance", "metric")},
+            "results": {},
+        }
+        with tempfile.TemporaryDirectory() as workdir:
+            if args.suite in ("all", "micro"):
+                micro, model_path = micro_benchmarks(args, workdir)
+                report["results"].update(micro)
+            else:
+                from model_parity import make_test_model
+                model_path = make_test_model(os.path.join(workdir, "dqn_benchmark_model.onnx"), seed=args.seed)
+            if args.suite in ("all", "load"):
+                for name in args.apps.split(","):
+                    report["results"].update(asyncio.run(load_test(name, args, model_path)))
+
+        encoded = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(encoded + "\n")
+            log(f"Wrote {len(report['results'])} benchmark results to {args.output}")
+        else:
+            print(encoded)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(baseline, report, args.tolerance, args.metric)
+        print_comparison(rows, regressions, args.metric)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,28 @@
+# Created before the other imports, so the startup report (GET /readyz) includes their cost
+from startup import StartupReport
+startup_report = StartupReport()
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from langchain_openai import OpenAI
 import os
 import json
-import re
+import time
 from fastapi import FastAPI, Request # Added Request here
+from state_store import NetworkState
+from shared_state import SharedStateReader
+from llm_cache import LLMResponseCache
+from fake_llm import FakeLLM
+from llm_runner import LLMRunner, LLMOverloaded, LLMTimeout
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from prompt_context import PromptContextBuilder
+from webhook_ingest import WebhookPipeline, WebhookQueueFull, webhook_updates
+from simulation import apply_updates
+from tx_parser import TxExtractor, extract_tx
+from state_stream import format_sse
+import metrics
+from metrics import MetricsMiddleware, timed, observe
+startup_report.mark("imports")
 
 # --- App Setup ---
 app = FastAPI()
@@ -15,22 +32,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# --- Webhook Endpoint ---
-@app.post("/webhook")
-async def receive_webhook(request: Request):
-    """
-    Accepts and logs incoming webhook payloads.
-    """
-    payload = await request.json()
-    print("--- INCOMING WEBHOOK ---")
-    print(payload)
-    print("------------------------")
-    return {"status": "success", "received_data": payload}
+# Per-route latency histograms for /metrics (see metrics.py)
+app.add_middleware(MetricsMiddleware)
 
 # --- Network State (for context) ---
-# This is a simplified copy for the chat server's context.
-# In a real-world scenario, this might be shared via a database or Redis.
+# This is a simplified copy for the chat server's context. When DEADLOCK_STATE_DB points
+# at the database server.py persists to, the chat server follows that shared state instead.
 network_state = {
     "missions": [
         {"id": "m1", "title": "Corporate Espionage", "status": "available", "reward": 5000, "cost": 1000},
@@ -50,44 +57,167 @@ network_state = {
     "resources": 10000,
 }
 
+shared_state = None
+local_state = NetworkState.from_dict(network_state)
+if os.getenv("DEADLOCK_STATE_DB"):
+    shared_state = SharedStateReader(os.getenv("DEADLOCK_STATE_DB"), network_state)
+    shared_state.refresh()
+
+def current_state():
+    """The latest network state: the shared one when attached, else the local copy."""
+    return shared_state.state if shared_state else local_state
+
+# Network-state section of the prompt: a token-budgeted summary, rebuilt only when the state version moves
+prompt_context = PromptContextBuilder(
+    budget_tokens=int(os.getenv("CHAT_CONTEXT_BUDGET", "600")),
+    top_k=int(os.getenv("CHAT_CONTEXT_TOP_K", "5")),
+)
+
+def state_context():
+    return prompt_context.context(current_state())
+
+# --- Webhook Endpoint ---
+def apply_webhooks(payloads):
+    """
+    Applies a batch of webhook payloads to the local state. When following server.py's
+    shared state, server.py owns the state, so updates should be sent to its /webhook instead.
+    """
+    updates = webhook_updates(payloads)
+    if not updates:
+        return
+    if shared_state:
+        print(f"Ignoring webhook updates for {len(payloads)} payloads: the network state is owned by server.py.")
+        return
+    log_message = apply_updates(local_state, updates)
+    if log_message is not None:
+        print(log_message)
+
+# Webhooks are acknowledged right away and applied in batches by a background task
+webhooks = WebhookPipeline(
+    apply_webhooks,
+    max_queue=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", "256")),
+)
+
+@app.post("/webhook")
+async def receive_webhook(request: Request):
+    """
+    Accepts incoming webhook payloads. The body is queued for batch processing and
+    acknowledged with 202; a repeated `Idempotency-Key` is acknowledged without being
+    queued again, and a full queue answers 429.
+    """
+    body = await request.body()
+    try:
+        queued = webhooks.submit(body, request.headers.get("idempotency-key"))
+    except WebhookQueueFull as e:
+        return JSONResponse(status_code=429, content={"status": "rejected", "detail": str(e)}, headers={"Retry-After": "1"})
+    if not queued:
+        return {"status": "duplicate"}
+    return JSONResponse(status_code=202, content={"status": "accepted"})
+
+@app.get("/webhook/stats")
+async def webhook_stats():
+    """Queue depth, throughput and dedupe counters of the webhook pipeline."""
+    return webhooks.stats()
+
+if shared_state:
+    # Rebuild the cached prompt context as soon as server.py commits a new version
+    # (refresh() doesn't count the rebuild as a prompt sent)
+    shared_state.subscribe(lambda version: prompt_context.refresh(shared_state.state))
+
+@app.on_event("startup")
+async def startup_event():
+    webhooks.start()
+    # The LLM client (langchain_openai takes over a second to import) is built off the startup path
+    startup_report.expect("llm_client")
+    startup_report.run_in_background("llm_client", load_llm)
+    startup_report.serving()
+    if shared_state:
+        shared_state.start()
+        print(f"Following shared network state from {shared_state.path} (version {shared_state.state.version}).")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await webhooks.stop()
+    if shared_state:
+        await shared_state.stop()
+    llm_runner.close()
+
 # --- AI/LLM Setup ---
 # Note: This requires an OPENAI_API_KEY environment variable to be set.
-try:
-    llm = OpenAI(temperature=0.7)
-except Exception as e:
-    print(f"Could not initialize OpenAI LLM: {e}")
-    llm = None
+# DEADLOCK_FAKE_LLM=1 swaps in a local fake LLM for tests and benchmarks.
+# The client is created by `load_llm` in the background after startup; until then chat
+# requests get a 503 with Retry-After.
+llm = None
+llm_loaded = False
+
+def load_llm():
+    global llm, llm_loaded
+    if os.getenv("DEADLOCK_FAKE_LLM"):
+        llm = FakeLLM(delay=float(os.getenv("DEADLOCK_FAKE_LLM_DELAY", "0")))
+    else:
+        try:
+            from langchain_openai import OpenAI
+            llm = OpenAI(temperature=0.7)
+        except Exception as e:
+            print(f"Could not initialize OpenAI LLM: {e}")
+            llm = None
+    llm_runner.llm = llm
+    llm_loaded = True
+
+def llm_unavailable(query):
+    """The response for chat requests that can't reach an LLM, or None if one is available."""
+    if not llm_loaded:
+        return JSONResponse(
+            status_code=503,
+            content={"response": "The LLM client is starting. Please retry shortly.", "tx": None, "balance": query.balance},
+            headers={"Retry-After": "1"},
+        )
+    if not llm:
+        return {"response": "LLM not configured. Please set the OPENAI_API_KEY.", "tx": None, "balance": query.balance}
+    return None
+
+# Cache of chat responses keyed on the normalized prompt, wallet, balance and state version.
+# CHAT_CACHE_SIZE=0 disables it; CHAT_CACHE_SIMILARITY (0..1) enables near-duplicate matching.
+chat_cache = LLMResponseCache(
+    max_entries=int(os.getenv("CHAT_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL", "300")),
+    similarity=float(os.getenv("CHAT_CACHE_SIMILARITY")) if os.getenv("CHAT_CACHE_SIMILARITY") else None,
+)
+
+# Completions run on a bounded thread pool, off the event loop. Past CHAT_LLM_CONCURRENCY
+# running calls, requests wait in a queue of CHAT_LLM_QUEUE; beyond that they get a 429.
+# Its LLM is set by `load_llm`.
+llm_runner = LLMRunner(
+    None,
+    max_concurrency=int(os.getenv("CHAT_LLM_CONCURRENCY", "4")),
+    max_waiting=int(os.getenv("CHAT_LLM_QUEUE", "32")),
+    queue_timeout=float(os.getenv("CHAT_LLM_QUEUE_TIMEOUT", "5")),
+    timeout=float(os.getenv("CHAT_LLM_TIMEOUT", "60")),
+)
+startup_report.mark("setup")
 
 class Query(BaseModel):
     prompt: str
     wallet: str = None
     balance: float = None
 
-@app.post("/api/chat")
-async def chat(query: Query):
-    try:
-        if not llm:
-            return {"response": "LLM not configured. Please set the OPENAI_API_KEY.", "tx": None, "balance": query.balance}
+def build_prompt(query):
+    wallet_info = (
+        f"Connected wallet: {query.wallet}" if query.wallet
+        else "No wallet connected."
+    )
 
-        wallet_info = (
-            f"Connected wallet: {query.wallet}" if query.wallet
-            else "No wallet connected."
-        )
+    balance_info = (
+        f"Wallet balance: {query.balance} SOL" if query.balance is not None
+        else "Wallet balance unknown."
+    )
 
-        balance_info = (
-            f"Wallet balance: {query.balance} SOL" if query.balance is not None
-            else "Wallet balance unknown."
-        )
-
-        full_prompt = f"""
+    return f"""
         You are the central command AI for the DEADLOCK NETWORK. Your primary function is to communicate with the operator, provide information about the network's state, and report on the status and activities of the agents. You can also interpret commands related to agent operations, missions, and data analysis.
 
         Current Network State:
-        - Resources: {network_state.get("resources")}
-        - Missions: {json.dumps(network_state.get("missions"))}
-        - Data Havens: {json.dumps(network_state.get("data_havens"))}
-        - Agents: {json.dumps(network_state.get("agents"))}
-        - Recent Log: {json.dumps(network_state.get("log"))}
+        {state_context()}
 
         User query: {query.prompt}
 
@@ -101,16 +231,36 @@ async def chat(query: Query):
         Respond normally otherwise.
         """
 
-        response = llm.invoke(full_prompt)
+@app.post("/api/chat")
+async def chat(query: Query):
+    try:
+        unavailable = llm_unavailable(query)
+        if unavailable is not None:
+            return unavailable
+
+        # Same question, same wallet and an unchanged network state: answer from the cache
+        cache_context = (query.wallet, query.balance, current_state().version)
+        cached = chat_cache.get(query.prompt, cache_context)
+        if cached is not None:
+            return {"response": cached["response"], "tx": cached["tx"], "balance": query.balance}
 
-        tx_match = re.search(r'({.*"tx".*})', response)
-        tx_data = None
+        try:
+            with timed("prompt_build"):
+                prompt = build_prompt(query)
+            with timed("llm_invoke"):
+                response = await llm_runner.invoke(prompt)
+        except LLMOverloaded as e:
+            return JSONResponse(
+                status_code=e.status_code,
+                content={"response": str(e), "tx": None, "balance": query.balance},
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        except LLMTimeout as e:
+            return JSONResponse(status_code=504, content={"response": str(e), "tx": None, "balance": query.balance})
 
-        if tx_match:
-            try:
-                tx_data = json.loads(tx_match.group(1))
-            except:
-                tx_data = None
+        tx_data = extract_tx(response)
+
+        chat_cache.put(query.prompt, cache_context, {"response": response, "tx": tx_data})
 
         return {
             "response": response,
@@ -122,6 +272,120 @@ async def chat(query: Query):
         traceback.print_exc() # Print full traceback to console
         return {"response": f"Internal server error in chat: {e}", "tx": None, "balance": query.balance, "status_code": 500}
 
+async def chat_events(query):
+    """
+    Server-Sent Events for one streamed chat reply: a `token` event per chunk as the
+    LLM produces it, a `tx` event as soon as the transaction JSON is complete, then
+    `done` with the full reply (the same fields as `/api/chat`), or a single `error`.
+    """
+    cache_context = (query.wallet, query.balance, current_state().version)
+    cached = chat_cache.get(query.prompt, cache_context)
+    if cached is not None:
+        yield format_sse("token", json.dumps({"text": cached["response"]}))
+        if cached["tx"] is not None:
+            yield format_sse("tx", json.dumps(cached["tx"]))
+        yield format_sse("done", json.dumps({"response": cached["response"], "tx": cached["tx"], "balance": query.balance}))
+        return
+
+    tx_parser = TxExtractor()
+    chunks = []
+    try:
+        with timed("prompt_build"):
+            prompt = build_prompt(query)
+        started = time.perf_counter()
+        async for chunk in llm_runner.stream(prompt):
+            if not chunks:
+                observe("llm_first_token", time.perf_counter() - started)
+            chunks.append(chunk)
+            yield format_sse("token", json.dumps({"text": chunk}))
+            tx_data = tx_parser.feed(chunk)
+            if tx_data is not None:
+                yield format_sse("tx", json.dumps(tx_data))
+    except LLMOverloaded as e:
+        yield format_sse("error", json.dumps({"response": str(e), "status_code": e.status_code, "retry_after": e.retry_after}))
+        return
+    except LLMTimeout as e:
+        yield format_sse("error", json.dumps({"response": str(e), "status_code": 504}))
+        return
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield format_sse("error", json.dumps({"response": f"Internal server error in chat: {e}", "status_code": 500}))
+        return
+
+    observe("llm_stream", time.perf_counter() - started)
+    response = "".join(chunks)
+    chat_cache.put(query.prompt, cache_context, {"response": response, "tx": tx_parser.tx})
+    yield format_sse("done", json.dumps({"response": response, "tx": tx_parser.tx, "balance": query.balance}))
+
+@app.post("/api/chat/stream")
+async def chat_stream(query: Query):
+    """
+    Streaming variant of `/api/chat` (Server-Sent Events, see `chat_events`).
+    The response starts with the first token; a request shed before then gets a plain 429/503.
+    """
+    unavailable = llm_unavailable(query)
+    if unavailable is not None:
+        return unavailable
+
+    events = chat_events(query)
+    first = await events.__anext__()
+    if first.startswith("event: error"):
+        error = json.loads(first.split("data: ", 1)[1])
+        if error["status_code"] in (429, 503):
+            return JSONResponse(
+                status_code=error["status_code"],
+                content={"response": error["response"], "tx": None, "balance": query.balance},
+                headers={"Retry-After": str(error["retry_after"])},
+            )
+
+    async def replay():
+        yield first
+        async for event in events:
+            yield event
+
+    return StreamingResponse(
+        replay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/chat/cache/stats")
+async def chat_cache_stats():
+    """Hit, miss and eviction counters of the chat response cache."""
+    return chat_cache.stats()
+
+@app.get("/api/chat/context/stats")
+async def chat_context_stats():
+    """Size of the prompt's state summary and the tokens saved versus inlining the full state."""
+    return prompt_context.stats()
+
+@app.get("/api/chat/llm/stats")
+async def chat_llm_stats():
+    """Concurrency, queue and timeout counters of the LLM runner."""
+    return llm_runner.stats()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once the LLM client has been created, 503 before."""
+    body = {"ready": startup_report.ready.is_set(), "llm_configured": llm is not None, "startup": startup_report.summary()}
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage and route latency histograms in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/slow")
+async def slow_requests():
+    """The slowest requests with their stage breakdown (set DEADLOCK_SLOW_REQUESTS=N to collect them)."""
+    return metrics.slow_requests()
+
 # --- Server Entry Point ---
 if __name__ == "__main__":
     import uvicorn
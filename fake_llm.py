@@ -0,0 +1,35 @@
+import time
+
+
+class FakeLLM:
+    """
+    Local stand-in for the LangChain LLM used by chat_server.py, for tests and
+    benchmarks without an OPENAI_API_KEY. Enable it with `DEADLOCK_FAKE_LLM=1`;
+    `DEADLOCK_FAKE_LLM_DELAY` adds a per-call delay in seconds to mimic a slow completion;
+    `stream()` spreads it over the reply's words, like a model emitting tokens.
+
+    Replies are deterministic. Prompts asking to "send" SOL get a reply with a `tx` JSON object.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def _reply(self, prompt):
+        query = prompt.split("User query:", 1)[-1].split("\n", 1)[0].strip()
+        if "send" in query.lower():
+            return f'Transfer prepared for "{query}". {{"tx": {{"to": "FakeRecipient1111111111111111111111111111", "amount": 0.01}}}}'
+        return f'Network status nominal. You asked: "{query}".'
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self._reply(prompt)
+
+    def stream(self, prompt):
+        self.calls += 1
+        words = self._reply(prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.delay:
+                time.sleep(self.delay / len(words))
+            yield word if i == 0 else " " + word
@@ -0,0 +1,97 @@
+import threading
+import numpy as np
+
+
+class StateFeaturizer:
+    """
+    Encodes network states into the fixed-size float32 vectors the Q-network expects.
+
+    The encoding is the code point of every character of the available/in-progress
+    mission titles followed by the unanalyzed data-haven names (each followed by a
+    space), zero-padded or truncated to `state_size`. Encoded entity names are cached,
+    so between cycles only new or renamed entities are re-encoded, and the output is
+    written into preallocated buffers instead of fresh arrays.
+    """
+    def __init__(self, state_size=128, cache_size=65536):
+        self.state_size = state_size
+        self.cache_size = cache_size
+        self._cache = {}
+        # Output buffers are per thread, so concurrent callers don't overwrite each other
+        self._local = threading.local()
+
+    def _buffers(self):
+        local = self._local
+        if not hasattr(local, "buffer"):
+            local.buffer = np.zeros((1, self.state_size), dtype=np.float32)
+            local.batch_buffer = np.zeros((0, self.state_size), dtype=np.float32)
+        return local
+
+    def encode(self, text):
+        """
+        Returns the code points of `text` plus a trailing space as float32,
+        truncated to `state_size`. Results are cached per string.
+        """
+        codes = self._cache.get(text)
+        if codes is None:
+            raw = (text + " ").encode("utf-32-le", "surrogatepass")
+            codes = np.frombuffer(raw, dtype=np.uint32)[:self.state_size].astype(np.float32)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[text] = codes
+        return codes
+
+    def iter_texts(self, state):
+        """
+        Yields the entity names that make up the state's text representation, in order.
+        """
+        # Indexed stores (state_store.NetworkState) enumerate these from their columns
+        if hasattr(state, "feature_texts"):
+            yield from state.feature_texts()
+            return
+
+        for mission in state.get("missions", []):
+            if mission["status"] == "available" or mission["status"] == "in_progress":
+                yield mission["title"]
+
+        for data in state.get("data_havens", []):
+            if not data["analyzed"]:
+                yield data["name"]
+
+    def fill(self, state, out):
+        """
+        Writes the encoding of `state` into the 1D array `out` of length `state_size`.
+        Stops walking the state as soon as the vector is full.
+        """
+        position = 0
+        for text in self.iter_texts(state):
+            codes = self.encode(text)
+            length = min(len(codes), self.state_size - position)
+            out[position:position + length] = codes[:length]
+            position += length
+            if position >= self.state_size:
+                return out
+        out[position:] = 0.0
+        return out
+
+    def transform(self, state):
+        """
+        Returns the (1, state_size) encoding of a single state.
+        The returned array is reused by the next call on this thread; copy it to keep it.
+        """
+        buffer = self._buffers().buffer
+        self.fill(state, buffer[0])
+        return buffer
+
+    def transform_batch(self, states):
+        """
+        Returns the (N, state_size) encoding of `states`, one row per state.
+        The returned array is reused by the next call on this thread; copy it to keep it.
+        """
+        local = self._buffers()
+        count = len(states)
+        if len(local.batch_buffer) < count:
+            local.batch_buffer = np.zeros((max(count, 2 * len(local.batch_buffer)), self.state_size), dtype=np.float32)
+        batch = local.batch_buffer[:count]
+        for row, state in zip(batch, states):
+            self.fill(state, row)
+        return batch
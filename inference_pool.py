@@ -0,0 +1,324 @@
+import atexit
+import multiprocessing as mp
+import queue
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+
+def _worker_main(conn, model_path, session_config, state_size, max_batch, input_name):
+    """
+    Worker process: loads its own Agent (one InferenceSession, warmed up once),
+    then serves batches written by the parent into shared memory.
+    """
+    from agent import Agent
+
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = None
+    try:
+        # Q-values are cached in the parent (AGENT_Q_CACHE_SIZE); workers only run batches
+        agent = Agent(model_path, session_config=session_config, inference_workers=0, q_cache_size=0)
+        if not agent.q_network:
+            conn.send(("error", f"Could not load ONNX Q-network from {model_path}"))
+            return
+        inputs = np.ndarray((max_batch, state_size), dtype=np.float32, buffer=input_shm.buf)
+        out_width = int(agent._run_q_network(inputs[:1]).shape[1])
+        conn.send(("ready", out_width))
+
+        message, output_name = conn.recv()
+        output_shm = shared_memory.SharedMemory(name=output_name)
+        outputs = np.ndarray((max_batch, out_width), dtype=np.float32, buffer=output_shm.buf)
+
+        while True:
+            message = conn.recv()
+            command = message[0]
+            if command == "run":
+                rows = message[1]
+                try:
+                    outputs[:rows] = agent._run_q_network(inputs[:rows])
+                    conn.send(("done", rows))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+            elif command == "ping":
+                conn.send(("pong",))
+            elif command == "stop":
+                return
+    except (EOFError, KeyboardInterrupt):
+        return
+    finally:
+        # Drop the array views before closing the mappings
+        inputs = outputs = None
+        input_shm.close()
+        if output_shm is not None:
+            output_shm.close()
+
+
+class _Worker:
+    """Parent-side handle of one worker process and its shared-memory buffers."""
+    def __init__(self, slot):
+        self.slot = slot
+        self.process = None
+        self.conn = None
+        self.input_shm = None
+        self.output_shm = None
+        self.inputs = None
+        self.outputs = None
+        self.restarts = 0
+        self.batches = 0
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class InferencePool:
+    """
+    Pool of worker processes, each with its own ONNX InferenceSession loaded once at start.
+
+    Featurized batches are copied into a per-worker shared-memory input buffer and the
+    Q-values are read back from a shared-memory output buffer; only tiny control messages
+    go over the pipes. Large batches are split across idle workers and run in parallel.
+    Dead or unresponsive workers are restarted, both by a background health check and
+    when a dispatch to them fails.
+    """
+    def __init__(self, model_path, n_workers, session_config=None, state_size=128, max_batch=1024,
+                 start_timeout=60.0, request_timeout=30.0, health_interval=5.0):
+        self.model_path = model_path
+        self.n_workers = n_workers
+        self.session_config = dict(session_config or {})
+        # One intra-op thread per worker unless told otherwise, so N workers don't oversubscribe the cores
+        self.session_config.setdefault("intra_op_threads", 1)
+        self.state_size = state_size
+        self.max_batch = max_batch
+        self.start_timeout = start_timeout
+        self.request_timeout = request_timeout
+        self.out_width = None
+
+        self._context = mp.get_context("spawn")
+        self._workers = [_Worker(slot) for slot in range(n_workers)]
+        self._idle = queue.Queue()
+        self._closed = False
+
+        try:
+            for worker in self._workers:
+                self._start(worker)
+                self._idle.put(worker)
+        except Exception:
+            self.close()
+            raise
+
+        self._health_thread = None
+        if health_interval:
+            self._health_thread = threading.Thread(target=self._health_loop, args=(health_interval,),
+                                                   name="inference-pool-health", daemon=True)
+            self._health_thread.start()
+        atexit.register(self.close)
+
+    # --- Worker lifecycle ---
+    def _start(self, worker):
+        if worker.input_shm is None:
+            worker.input_shm = shared_memory.SharedMemory(create=True, size=self.max_batch * self.state_size * 4)
+            worker.inputs = np.ndarray((self.max_batch, self.state_size), dtype=np.float32, buffer=worker.input_shm.buf)
+
+        parent_conn, child_conn = self._context.Pipe()
+        worker.conn = parent_conn
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.model_path, self.session_config, self.state_size,
+                  self.max_batch, worker.input_shm.name),
+            name=f"inference-worker-{worker.slot}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+
+        if not parent_conn.poll(self.start_timeout):
+            self._kill(worker)
+            raise RuntimeError(f"Inference worker {worker.slot} did not start within {self.start_timeout}s")
+        message = parent_conn.recv()
+        if message[0] != "ready":
+            self._kill(worker)
+            raise RuntimeError(f"Inference worker {worker.slot} failed to start: {message[1]}")
+
+        out_width = message[1]
+        if self.out_width is None:
+            self.out_width = out_width
+        if worker.output_shm is None:
+            worker.output_shm = shared_memory.SharedMemory(create=True, size=max(self.max_batch * out_width * 4, 1))
+            worker.outputs = np.ndarray((self.max_batch, out_width), dtype=np.float32, buffer=worker.output_shm.buf)
+        parent_conn.send(("output", worker.output_shm.name))
+
+    def _kill(self, worker):
+        if worker.process is not None:
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.process.join(timeout=5)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = None
+        worker.conn = None
+
+    def _restart(self, worker):
+        print(f"Restarting inference worker {worker.slot}.")
+        self._kill(worker)
+        worker.restarts += 1
+        self._start(worker)
+
+    def _health_loop(self, interval):
+        while not self._closed:
+            time.sleep(interval)
+            self.check_health()
+
+    def check_health(self):
+        """
+        Pings every idle worker and restarts the ones that are dead or don't answer.
+        Busy workers are checked by their in-flight request instead.
+        """
+        checked = []
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            checked.append(worker)
+        try:
+            for worker in checked:
+                if self._closed:
+                    break
+                healthy = False
+                try:
+                    if worker.alive():
+                        worker.conn.send(("ping",))
+                        healthy = worker.conn.poll(self.request_timeout) and worker.conn.recv()[0] == "pong"
+                except (EOFError, OSError):
+                    healthy = False
+                if not healthy:
+                    try:
+                        self._restart(worker)
+                    except RuntimeError as e:
+                        print(f"Inference worker {worker.slot} could not be restarted: {e}")
+        finally:
+            for worker in checked:
+                self._idle.put(worker)
+
+    # --- Dispatch ---
+    def _submit(self, worker, chunk):
+        if worker.conn is None:
+            raise OSError(f"Inference worker {worker.slot} is not running")
+        rows = len(chunk)
+        worker.inputs[:rows] = chunk
+        worker.conn.send(("run", rows))
+
+    def _collect(self, worker):
+        if worker.conn is None:
+            raise OSError(f"Inference worker {worker.slot} is not running")
+        if not worker.conn.poll(self.request_timeout):
+            raise TimeoutError(f"Inference worker {worker.slot} timed out")
+        message = worker.conn.recv()
+        if message[0] != "done":
+            raise RuntimeError(f"Inference worker {worker.slot} failed: {message[1]}")
+        worker.batches += 1
+        return worker.outputs[:message[1]].copy()
+
+    def _run_chunk(self, worker, chunk):
+        """Runs one chunk on `worker`, restarting it and retrying once if it died."""
+        try:
+            self._submit(worker, chunk)
+            return self._collect(worker)
+        except (EOFError, OSError, TimeoutError):
+            self._restart(worker)
+            self._submit(worker, chunk)
+            return self._collect(worker)
+
+    def run(self, batch):
+        """
+        Returns the (N, K) Q-values for an (N, state_size) float32 batch.
+        Safe to call from several threads; each call holds the workers it is using.
+        """
+        if self._closed:
+            raise RuntimeError("Inference pool is closed.")
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        if len(batch) == 0:
+            return np.zeros((0, self.out_width), dtype=np.float32)
+
+        # Spread the batch over the workers, never exceeding a worker's buffer
+        chunk_size = min(self.max_batch, -(-len(batch) // self.n_workers))
+        chunks = [batch[start:start + chunk_size] for start in range(0, len(batch), chunk_size)]
+        results = [None] * len(chunks)
+        in_flight = []  # (chunk index, worker), oldest first
+
+        try:
+            for index, chunk in enumerate(chunks):
+                try:
+                    worker = self._idle.get(block=not in_flight)
+                except queue.Empty:
+                    # Every worker is busy: wait for our oldest chunk, then reuse its worker
+                    done_index, worker = in_flight[0]
+                    results[done_index] = self._finish(worker, chunks[done_index])
+                    in_flight.pop(0)
+                in_flight.append((index, worker))
+                try:
+                    self._submit(worker, chunk)
+                except (EOFError, OSError):
+                    results[index] = self._run_chunk(worker, chunk)
+                    in_flight.pop()
+                    self._idle.put(worker)
+
+            while in_flight:
+                done_index, worker = in_flight[0]
+                results[done_index] = self._finish(worker, chunks[done_index])
+                in_flight.pop(0)
+                self._idle.put(worker)
+        finally:
+            # On errors, drain or restart the workers we still hold so none is left
+            # with a stale reply, and return them so a failed call can't shrink the pool
+            for _, worker in in_flight:
+                try:
+                    self._collect(worker)
+                except Exception:
+                    try:
+                        self._restart(worker)
+                    except RuntimeError as e:
+                        print(f"Inference worker {worker.slot} could not be restarted: {e}")
+                self._idle.put(worker)
+
+        return results[0] if len(results) == 1 else np.vstack(results)
+
+    def _finish(self, worker, chunk):
+        """Collects the in-flight result of `worker`, re-running `chunk` if the worker died."""
+        try:
+            return self._collect(worker)
+        except (EOFError, OSError, TimeoutError):
+            self._restart(worker)
+            return self._run_chunk(worker, chunk)
+
+    def stats(self):
+        """Returns per-worker liveness, restart and batch counters."""
+        return {
+            "workers": [
+                {"slot": w.slot, "pid": w.process.pid if w.process else None, "alive": w.alive(),
+                 "restarts": w.restarts, "batches": w.batches}
+                for w in self._workers
+            ],
+            "idle": self._idle.qsize(),
+            "max_batch": self.max_batch,
+        }
+
+    def close(self):
+        """Stops all workers and releases the shared-memory buffers."""
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            try:
+                if worker.alive():
+                    worker.conn.send(("stop",))
+            except (EOFError, OSError):
+                pass
+            self._kill(worker)
+            worker.inputs = worker.outputs = None
+            for shm in (worker.input_shm, worker.output_shm):
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+            worker.input_shm = worker.output_shm = None
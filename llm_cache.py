@@ -0,0 +1,134 @@
+import re
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r"\s+")
+_TOKEN = re.compile(r"[\w.]+")
+# Base58 wallet addresses are case-sensitive; words this long keep their case
+_CASEFOLD_MAX_LENGTH = 20
+
+
+def normalize_prompt(prompt):
+    """
+    Normalizes a user prompt for cache lookups: collapses whitespace, drops trailing
+    punctuation and lowercases ordinary words, so "What's the status?" and
+    "what's the status" share an entry. Long tokens such as wallet addresses keep their case.
+    """
+    text = _WHITESPACE.sub(" ", prompt).strip().rstrip("?!. ")
+    return " ".join(word.casefold() if len(word) < _CASEFOLD_MAX_LENGTH else word for word in text.split(" "))
+
+
+def _tokens(normalized):
+    return frozenset(_TOKEN.findall(normalized))
+
+
+class LLMResponseCache:
+    """
+    Bounded LRU cache with TTL expiry for chat responses.
+
+    Entries are keyed on the normalized prompt plus a context tuple (wallet, balance and
+    network-state version), so a new state version never serves an answer built from an
+    older one. With `similarity` set (0..1), a miss falls back to the most similar prompt
+    in the same context by token Jaccard similarity. Tokens containing digits (amounts,
+    addresses) must match exactly, so "send 0.01" never matches "send 0.02".
+    """
+    def __init__(self, max_entries=512, ttl=300.0, similarity=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.clock = clock
+        self._entries = OrderedDict()  # (normalized prompt, context) -> (expires, tokens, value)
+        self._by_context = {}  # context -> set of keys, for near-duplicate lookups
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_context.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[1]]
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def _near_duplicate(self, tokens, context, now):
+        numeric = {token for token in tokens if any(ch.isdigit() for ch in token)}
+        best_key, best_score = None, self.similarity
+        for key in list(self._by_context.get(context, ())):
+            entry = self._live(key, now)
+            if entry is None:
+                continue
+            other = entry[1]
+            if {token for token in other if any(ch.isdigit() for ch in token)} != numeric:
+                continue
+            score = len(tokens & other) / len(tokens | other) if tokens | other else 1.0
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def get(self, prompt, context=()):
+        """Returns the cached value for `prompt` in `context`, or None."""
+        if not self.max_entries:
+            return None
+        now = self.clock()
+        normalized = normalize_prompt(prompt)
+        key = (normalized, context)
+        entry = self._live(key, now)
+        if entry is None and self.similarity is not None:
+            near_key = self._near_duplicate(_tokens(normalized), context, now)
+            if near_key is not None:
+                self.near_hits += 1
+                self._entries.move_to_end(near_key)
+                return self._entries[near_key][2]
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, prompt, context, value):
+        """Stores `value` for `prompt` in `context`, evicting the least recently used entry if full."""
+        if not self.max_entries:
+            return
+        normalized = normalize_prompt(prompt)
+        key = (normalized, context)
+        self._remove(key)
+        while len(self._entries) >= self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+        self._entries[key] = (self.clock() + self.ttl, _tokens(normalized), value)
+        self._by_context.setdefault(context, set()).add(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_context.clear()
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "similarity": self.similarity,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LLMOverloaded(Exception):
+    """Raised when a completion is shed instead of queued. `status_code` is 429 or 503."""
+    def __init__(self, message, status_code=429, retry_after=1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMTimeout(Exception):
+    """Raised when a completion takes longer than the runner's `timeout`."""
+
+
+class LLMRunner:
+    """
+    Runs the blocking `llm.invoke` off the event loop, on a thread pool of
+    `max_concurrency` workers, so a slow completion never stalls other requests.
+
+    Callers past the concurrency limit wait in a queue of at most `max_waiting`.
+    When the queue is full a call fails at once with `LLMOverloaded` (429), and a
+    call that waits longer than `queue_timeout` seconds fails with `LLMOverloaded`
+    (503). A call that doesn't complete within `timeout` seconds raises `LLMTimeout`.
+    Identical prompts already in flight share a single completion. `stream()` runs
+    under the same limits and yields the completion chunk by chunk.
+    """
+    def __init__(self, llm, max_concurrency=4, max_waiting=32, queue_timeout=5.0, timeout=60.0):
+        self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+        self._slots = None  # asyncio.Semaphore, created on the serving event loop
+        self._in_flight = {}  # prompt -> task running its completion
+        self._streaming = 0
+        self.waiting = 0
+        self.active = 0
+
+        self.calls = 0
+        self.streams = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+
+    async def invoke(self, prompt):
+        """Returns the completion for `prompt`, sharing it with identical prompts in flight."""
+        task = self._in_flight.get(prompt)
+        if task is None:
+            self._admit()
+            task = asyncio.ensure_future(self._run(prompt))
+            self._in_flight[prompt] = task
+            task.add_done_callback(lambda done: self._finished(prompt, done))
+        else:
+            self.coalesced += 1
+        self.calls += 1
+
+        try:
+            # Shielded, so one caller timing out doesn't cancel the call the others share
+            return await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeout(f"LLM did not respond within {self.timeout:g}s.")
+
+    def _admit(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+        # Counted synchronously: every distinct prompt and stream in flight is running or waiting
+        if len(self._in_flight) + self._streaming >= self.max_concurrency + self.max_waiting:
+            self.rejected += 1
+            raise LLMOverloaded("Chat is at capacity, try again shortly.", 429)
+
+    async def _acquire(self):
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise LLMOverloaded("Chat is busy, try again shortly.", 503)
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return time.perf_counter()
+
+    def _release(self, started):
+        self.active -= 1
+        self.completed += 1
+        self.total_seconds += time.perf_counter() - started
+        self._slots.release()
+
+    def _finished(self, prompt, task):
+        if self._in_flight.get(prompt) is task:
+            del self._in_flight[prompt]
+        # Read the outcome here, in case every caller has already timed out
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), LLMOverloaded):
+            self.errors += 1
+
+    async def _run(self, prompt):
+        started = await self._acquire()
+        # The slot is held until the worker thread finishes, even after a timeout,
+        # so abandoned completions still count against the concurrency limit
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self.llm.invoke, prompt)
+        finally:
+            self._release(started)
+
+    async def stream(self, prompt):
+        """
+        Async generator of completion chunks for `prompt`, read from `llm.stream` on a
+        worker thread as they arrive. Falls back to one chunk when the LLM can't stream.
+        Raises `LLMOverloaded` or `LLMTimeout` like `invoke()`; never coalesced.
+        """
+        self._admit()
+        self._streaming += 1
+        self.calls += 1
+        self.streams += 1
+        try:
+            started = await self._acquire()
+            loop = asyncio.get_running_loop()
+            chunks = asyncio.Queue()
+            stop = threading.Event()
+
+            def send(chunk, error=None):
+                try:
+                    loop.call_soon_threadsafe(chunks.put_nowait, (chunk, error))
+                except RuntimeError:
+                    pass  # the event loop has closed
+
+            def produce():
+                try:
+                    if hasattr(self.llm, "stream"):
+                        for chunk in self.llm.stream(prompt):
+                            if stop.is_set():
+                                break
+                            send(chunk)
+                    else:
+                        send(self.llm.invoke(prompt))
+                except Exception as e:
+                    # Including RuntimeErrors from the LLM client: they reach the consumer as an error
+                    send(None, e)
+                    return
+                send(None)
+
+            worker = loop.run_in_executor(self._executor, produce)
+            # As with invoke(), the slot is released only when the worker thread is done
+            worker.add_done_callback(lambda done: self._release(started))
+            deadline = loop.time() + self.timeout
+            try:
+                while True:
+                    try:
+                        chunk, error = await asyncio.wait_for(chunks.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        self.timeouts += 1
+                        raise LLMTimeout(f"LLM did not respond within {self.timeout:g}s.")
+                    if error is not None:
+                        self.errors += 1
+                        raise error
+                    if chunk is None:
+                        return
+                    yield chunk
+            finally:
+                # Also reached when the client goes away mid-stream
+                stop.set()
+        finally:
+            self._streaming -= 1
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_waiting": self.max_waiting,
+            "active": self.active,
+            "waiting": self.waiting,
+            "in_flight_prompts": len(self._in_flight),
+            "in_flight_streams": self._streaming,
+            "calls": self.calls,
+            "streams": self.streams,
+            "completed": self.completed,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "mean_llm_seconds": self.total_seconds / self.completed if self.completed else 0.0,
+        }
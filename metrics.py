@@ -0,0 +1,198 @@
+"""
+Stage timings for the agent and chat pipelines, exposed in the Prometheus text format.
+
+Code wraps the parts of a request it wants timed in `timed("stage")`; the durations go
+into one histogram per stage, and `MetricsMiddleware` adds a histogram per route.
+`render()` produces the `/metrics` body. With DEADLOCK_METRICS=0, `timed()` returns a
+shared no-op context manager and the middleware passes requests straight through.
+
+With DEADLOCK_SLOW_REQUESTS=N, the N slowest requests are kept together with the
+stages they went through (`slow_requests()`, served as `/metrics/slow`), for finding
+out where the time of an outlier went. DEADLOCK_TRACE_SAMPLE (default 1) traces only
+that fraction of requests.
+"""
+import contextvars
+import heapq
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+
+ENABLED = os.getenv("DEADLOCK_METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+SLOW_REQUESTS = int(os.getenv("DEADLOCK_SLOW_REQUESTS", "0"))
+TRACE_SAMPLE = float(os.getenv("DEADLOCK_TRACE_SAMPLE", "1"))
+
+# Seconds; spans sub-millisecond model runs up to slow LLM calls
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stages of the request being handled, when it is traced: [(stage, seconds), ...]
+_trace = contextvars.ContextVar("deadlock_trace", default=None)
+
+
+class Histogram:
+    """A Prometheus-style histogram family: cumulative bucket counts, sum and count per label value."""
+    def __init__(self, name, help_text, label, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((value, list(counts), total) for value, (counts, total) in self._series.items())
+        for value, counts, total in series:
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+STAGES = Histogram("deadlock_stage_seconds", "Time spent in each pipeline stage.", "stage")
+REQUESTS = Histogram("deadlock_request_seconds", "Request latency by route.", "route")
+
+
+class _Timer:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def timed(stage):
+    """Context manager that records the time spent in the block under `stage`."""
+    return _Timer(stage) if ENABLED else _NO_TIMER
+
+
+def observe(stage, seconds):
+    """Records an already measured stage duration."""
+    if not ENABLED:
+        return
+    STAGES.observe(stage, seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+# --- Slow request sampler ---
+class SlowRequests:
+    """The `size` slowest traced requests with their stage breakdown (a min-heap on duration)."""
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+        self._counter = 0  # tie-breaker, so equal durations never compare the records
+        self._lock = threading.Lock()
+
+    def offer(self, seconds, record):
+        with self._lock:
+            self._counter += 1
+            item = (seconds, self._counter, record)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            elif seconds > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def slowest(self):
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [record for _, _, record in items]
+
+
+slow = SlowRequests(SLOW_REQUESTS) if SLOW_REQUESTS > 0 else None
+
+
+def slow_requests():
+    """The slowest requests seen so far, slowest first (empty unless DEADLOCK_SLOW_REQUESTS is set)."""
+    return slow.slowest() if slow is not None else []
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request into `deadlock_request_seconds` by route
+    template (so ids in paths don't create new series), and tracing the stages of the
+    sampled requests for the slow request sampler.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = None
+        if slow is not None and (TRACE_SAMPLE >= 1 or random.random() < TRACE_SAMPLE):
+            trace = []
+        token = _trace.set(trace)
+        status = []
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            seconds = time.perf_counter() - started
+            _trace.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUESTS.observe(f"{scope['method']} {path}", seconds)
+            if trace is not None:
+                slow.offer(seconds, {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status[0] if status else None,
+                    "seconds": seconds,
+                    "time": time.time(),
+                    "stages": [{"stage": stage, "seconds": duration} for stage, duration in trace],
+                    "untracked_seconds": seconds - sum(duration for _, duration in trace),
+                })
+
+
+def render():
+    """The `/metrics` body in the Prometheus text exposition format."""
+    return "\n".join((STAGES.render(), REQUESTS.render())) + "\n"
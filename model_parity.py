@@ -0,0 +1,194 @@
+"""
+Parity harness for reduced-precision Q-networks (see quantize.py).
+
+Runs the float32 model and its int8 / fp16 variant over a corpus of featurized states
+and reports how often they pick the same action, the Q-value error, and the latency
+and memory difference:
+
+    python model_parity.py                      # generated test model, both modes
+    python model_parity.py --model Q_Layered_Network/dqn_node_model.onnx --mode int8
+
+Without --model, a small MLP with the agent's input shape is generated, so the harness
+runs offline without the real model.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import onnxruntime as ort
+from featurizer import StateFeaturizer
+from ort_session import create_session, resolve_session_config
+from quantize import QUANTIZE_MODES, quantize_model
+from state_store import NetworkState
+
+
+def make_test_model(path, state_size=128, hidden=256, n_actions=16, seed=0):
+    """Writes a small random two-layer MLP Q-network: (N, state_size) -> (N, n_actions)."""
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    # Featurized inputs are raw code points (tens to thousands), so keep the weights small
+    w1 = (rng.standard_normal((state_size, hidden)) / (state_size * 10)).astype(np.float32)
+    b1 = (rng.standard_normal(hidden) * 0.1).astype(np.float32)
+    w2 = (rng.standard_normal((hidden, n_actions)) / np.sqrt(hidden)).astype(np.float32)
+    b2 = (rng.standard_normal(n_actions) * 0.1).astype(np.float32)
+    graph = helper.make_graph(
+        [
+            helper.make_node("MatMul", ["state", "w1"], ["h1"]),
+            helper.make_node("Add", ["h1", "b1"], ["h2"]),
+            helper.make_node("Relu", ["h2"], ["h3"]),
+            helper.make_node("MatMul", ["h3", "w2"], ["h4"]),
+            helper.make_node("Add", ["h4", "b2"], ["q_values"]),
+        ],
+        "dqn_test_model",
+        [helper.make_tensor_value_info("state", TensorProto.FLOAT, ["batch", state_size])],
+        [helper.make_tensor_value_info("q_values", TensorProto.FLOAT, ["batch", n_actions])],
+        [numpy_helper.from_array(w, name) for w, name in ((w1, "w1"), (b1, "b1"), (w2, "w2"), (b2, "b2"))],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return path
+
+
+def random_world(rng):
+    """A random `network_state`-shaped world with a handful of missions and data havens."""
+    words = ["Corporate", "Espionage", "Data", "Heist", "Asset", "Extraction", "Ghost", "Protocol", "Null", "Vector"]
+    missions = [
+        {"id": f"m{i}", "title": " ".join(rng.sample(words, rng.randint(1, 3))),
+         "status": rng.choice(["available", "in_progress", "completed"]),
+         "reward": rng.randint(100, 9000), "cost": rng.randint(0, 5000)}
+        for i in range(rng.randint(0, 8))
+    ]
+    havens = [
+        {"id": f"d{i}", "name": f"{rng.choice(words).lower()}_{rng.randint(0, 999)}.{rng.choice(['zip', 'db', 'csv'])}",
+         "analyzed": rng.random() < 0.4, "value": rng.randint(100, 3000)}
+        for i in range(rng.randint(0, 6))
+    ]
+    return {"missions": missions, "data_havens": havens, "agents": [], "log": [], "resources": rng.randint(0, 10000)}
+
+
+def featurized_corpus(n_states, seed=0, state_size=128):
+    """Returns an (n_states, state_size) feature batch of random worlds and each world's action count."""
+    rng = random.Random(seed)
+    worlds = [NetworkState.from_dict(random_world(rng)) for _ in range(n_states)]
+    batch = StateFeaturizer(state_size).transform_batch(worlds).copy()
+    counts = np.array([len(world.available_actions()) for world in worlds], dtype=np.intp)
+    return batch, counts
+
+
+def _rss():
+    """Resident memory of this process in bytes, or None where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def load_session(path, config):
+    """Creates a session and returns (session, resident memory it added in bytes or None)."""
+    before = _rss()
+    session = create_session(path, config)
+    after = _rss()
+    return session, (after - before if before is not None and after is not None else None)
+
+
+def run(session, batch):
+    return session.run([session.get_outputs()[0].name], {session.get_inputs()[0].name: batch})[0]
+
+
+def median_latency(session, batch, repeats):
+    run(session, batch)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run(session, batch)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def greedy_actions(q_values, counts):
+    """Masked argmax like `Agent.choose_prepared`: only the first `count` slots of each row are valid."""
+    valid = np.arange(q_values.shape[1]) < counts[:, None]
+    return np.where(valid, q_values, -np.inf).argmax(axis=1)
+
+
+def compare(float_path, variant_path, batch, counts, repeats=50, config=None):
+    """Scores `batch` with both models and returns the agreement, error, latency and memory report."""
+    float_session, float_memory = load_session(float_path, config)
+    variant_session, variant_memory = load_session(variant_path, config)
+    q_float = run(float_session, batch)
+    q_variant = run(variant_session, batch)
+
+    scored = counts > 0
+    agreement = greedy_actions(q_float[scored], counts[scored]) == greedy_actions(q_variant[scored], counts[scored])
+    error = np.abs(q_float - q_variant)
+    scale = float(np.abs(q_float).max()) or 1.0
+
+    latency = {}
+    for label, rows in (("batch_1", batch[:1]), (f"batch_{len(batch)}", batch)):
+        float_seconds = median_latency(float_session, rows, repeats)
+        variant_seconds = median_latency(variant_session, rows, repeats)
+        latency[label] = {
+            "float32_ms": float_seconds * 1000,
+            "variant_ms": variant_seconds * 1000,
+            "speedup": float_seconds / variant_seconds if variant_seconds else None,
+        }
+
+    return {
+        "states": int(len(batch)),
+        "scored_states": int(scored.sum()),
+        "action_agreement": float(agreement.mean()) if len(agreement) else None,
+        "q_max_abs_error": float(error.max()),
+        "q_mean_abs_error": float(error.mean()),
+        "q_max_relative_error": float(error.max()) / scale,
+        "latency": latency,
+        "file_bytes": {"float32": os.path.getsize(float_path), "variant": os.path.getsize(variant_path)},
+        "session_rss_bytes": {"float32": float_memory, "variant": variant_memory},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare a quantized Q-network against the float32 model.")
+    parser.add_argument("--model", help="float32 ONNX model (default: a generated test model)")
+    parser.add_argument("--mode", default="all", choices=QUANTIZE_MODES + ("all",))
+    parser.add_argument("--states", type=int, default=2000, help="corpus size")
+    parser.add_argument("--repeats", type=int, default=50, help="timed runs per latency measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-agreement", type=float, default=None,
+                        help="exit with status 1 if any mode agrees on fewer actions than this (0..1)")
+    args = parser.parse_args(argv)
+
+    # The harness decides what to quantize; ignore AGENT_QUANTIZE for the sessions themselves
+    config = resolve_session_config()
+    config.pop("quantize", None)
+    config.pop("optimized_model_path", None)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = args.model or make_test_model(os.path.join(workdir, "dqn_test_model.onnx"), seed=args.seed)
+        state_size = ort.InferenceSession(model_path).get_inputs()[0].shape[1]
+        batch, counts = featurized_corpus(args.states, args.seed, state_size if isinstance(state_size, int) else 128)
+
+        report = {"model": args.model or "generated test model", "modes": {}}
+        modes = QUANTIZE_MODES if args.mode == "all" else (args.mode,)
+        for mode in modes:
+            variant_path = quantize_model(model_path, os.path.join(workdir, f"variant.{mode}.onnx"), mode)
+            report["modes"][mode] = compare(model_path, variant_path, batch, counts, args.repeats, config)
+
+    print(json.dumps(report, indent=2))
+    if args.min_agreement is not None:
+        failing = [mode for mode, result in report["modes"].items()
+                   if result["action_agreement"] is not None and result["action_agreement"] < args.min_agreement]
+        if failing:
+            print(f"Action agreement below {args.min_agreement} for: {', '.join(failing)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
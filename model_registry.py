@@ -0,0 +1,393 @@
+import glob
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from quantize import QUANTIZED_SUFFIXES
+from ort_session import OPTIMIZED_SUFFIX
+
+
+class LatencyStats:
+    """Call count and latency of one model, with percentiles over the last `window` calls."""
+    def __init__(self, window=1024):
+        self.calls = 0
+        self.states = 0
+        self.total_seconds = 0.0
+        self.recent = deque(maxlen=window)
+
+    def record(self, seconds, states):
+        self.calls += 1
+        self.states += states
+        self.total_seconds += seconds
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = np.array(self.recent) * 1000 if self.recent else np.zeros(1)
+        return {
+            "calls": self.calls,
+            "states": self.states,
+            "mean_ms": self.total_seconds * 1000 / self.calls if self.calls else 0.0,
+            "p50_ms": float(np.percentile(recent, 50)),
+            "p99_ms": float(np.percentile(recent, 99)),
+        }
+
+
+class ModelEntry:
+    """A loaded, warmed-up model: its `Agent`, the file it came from and its stats."""
+    def __init__(self, name, path, agent, signature, window):
+        self.name = name
+        self.path = path
+        self.agent = agent
+        self.signature = signature  # (mtime_ns, size) of the file when loaded
+        self.loaded_at = time.time()
+        self.latency = LatencyStats(window)
+        self.shadow_latency = LatencyStats(window)
+        self.shadow_compared = 0
+        self.shadow_agreed = 0
+
+    def summary(self):
+        return {
+            "path": self.path,
+            "loaded": self.agent.has_model(),
+            "loaded_at": self.loaded_at,
+            "latency": self.latency.summary(),
+            "shadow_latency": self.shadow_latency.summary(),
+            "shadow_agreement": self.shadow_agreed / self.shadow_compared if self.shadow_compared else None,
+            "q_cache": self.agent.q_cache.stats() if getattr(self.agent, "q_cache", None) else None,
+        }
+
+
+def _signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ModelRegistry:
+    """
+    Keeps several ONNX Q-network `Agent`s loaded and warmed up side by side, and routes
+    agent cycles to them. It can be used anywhere an `Agent` is (`choose_action` /
+    `choose_actions`).
+
+    One model is active. A candidate model can take `candidate_percent` of the traffic
+    ("ab" mode: its actions are used), or score the same batches in the background
+    without affecting the result ("shadow" mode: agreement with the active model is
+    recorded). Every model keeps its own latency stats.
+
+    With `watch_dir` set, a background thread looks for new or changed `*.onnx` files
+    there every `watch_interval` seconds. A file is loaded once it has stopped changing
+    between two scans, and then swapped in (as the active model, or as the candidate with
+    `promote="candidate"`). Loading and warm-up happen on the watcher thread and the swap
+    is a single reference assignment, so requests are never blocked or dropped; calls
+    already running finish on the model they started with. Files that fail to load are skipped.
+
+    With `background_load`, the initial model (and candidate) are loaded by `start()` on a
+    background thread instead of in the constructor. Until then the active model is a
+    stand-in agent without a Q-network, which picks random actions, and `ready` is unset.
+    """
+    def __init__(self, agent_factory, model_path=None, candidate_path=None, candidate_mode="ab",
+                 candidate_percent=10.0, watch_dir=None, watch_interval=2.0, promote="active",
+                 max_models=4, stats_window=1024, max_shadow_backlog=64, background_load=False,
+                 ready_without_model=False):
+        self.agent_factory = agent_factory
+        self.model_path = model_path
+        self.candidate_path = candidate_path
+        self.watch_dir = os.path.abspath(os.path.expanduser(watch_dir)) if watch_dir else None
+        self.watch_interval = watch_interval
+        self.promote = promote
+        self.max_models = max_models
+        self.stats_window = stats_window
+        self.max_shadow_backlog = max_shadow_backlog
+        self.ready_without_model = ready_without_model
+
+        self.models = {}  # name -> ModelEntry
+        self.active = None
+        self.candidate = None
+        self.candidate_mode = candidate_mode
+        self.candidate_percent = candidate_percent
+        self.swaps = 0
+        self.failed_loads = 0
+        self.shadow_dropped = 0
+        self.shadow_submitted = 0
+        self.shadow_finished = 0
+        self._requests = itertools.count()
+        self._lock = threading.Lock()  # serializes loads and swaps; never taken on the request path
+        self._shadow = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-model")
+        self._retired = []  # (time, entry) of replaced models whose worker pools are closed later
+        self._watcher = None
+        self._loader = None
+        self._stop = threading.Event()
+        self.ready = threading.Event()
+
+        if background_load:
+            self.active = self.fallback = ModelEntry("random", None, agent_factory(load_model=False), None, stats_window)
+        else:
+            self.fallback = None
+            self.load_initial()
+
+    def load_initial(self):
+        """Loads the configured model and candidate, then sets `ready`."""
+        entry = self.load(self.model_path)
+        with self._lock:
+            # A model activated meanwhile (e.g. by the watcher or an operator) stays active
+            if self.active is None or self.active is self.fallback:
+                self.active = entry
+        if self.candidate_path:
+            self.set_candidate(self.load(self.candidate_path).name, self.candidate_mode, self.candidate_percent)
+        self.ready.set()
+        return entry
+
+    @classmethod
+    def from_env(cls, agent_factory, model_path=None):
+        """
+        Builds a registry configured by the AGENT_CANDIDATE_*, AGENT_MODEL_WATCH_*,
+        AGENT_BACKGROUND_LOAD (default on) and AGENT_READY_WITHOUT_MODEL (default off)
+        environment variables.
+        """
+        return cls(
+            agent_factory,
+            model_path=model_path,
+            candidate_path=os.getenv("AGENT_CANDIDATE_MODEL_PATH") or None,
+            candidate_mode=os.getenv("AGENT_CANDIDATE_MODE", "ab"),
+            candidate_percent=float(os.getenv("AGENT_CANDIDATE_PERCENT", "10")),
+            watch_dir=os.getenv("AGENT_MODEL_WATCH_DIR") or None,
+            watch_interval=float(os.getenv("AGENT_MODEL_WATCH_INTERVAL", "2")),
+            promote=os.getenv("AGENT_MODEL_PROMOTE", "active"),
+            max_models=int(os.getenv("AGENT_MAX_MODELS", "4")),
+            background_load=os.getenv("AGENT_BACKGROUND_LOAD", "1").strip().lower() not in ("0", "false", "no", "off"),
+            ready_without_model=os.getenv("AGENT_READY_WITHOUT_MODEL", "0").strip().lower() in ("1", "true", "yes", "on"),
+        )
+
+    # --- Loading and swapping ---
+    def load(self, model_path=None, require_model=False):
+        """
+        Loads (and warms up) a model and registers it under its file name, replacing an
+        entry of the same name. With no path, the agent factory's default model is loaded.
+        With `require_model`, a file that fails to load returns None and isn't registered
+        (otherwise its agent falls back to random actions, like a bare `Agent`).
+        """
+        agent = self.agent_factory() if model_path is None else self.agent_factory(model_path=model_path)
+        if require_model and not agent.has_model():
+            return None
+        path = agent.model_path or model_path
+        name = os.path.basename(path)
+        existing = self.models.get(name)
+        if existing is not None and existing.path != path:
+            # Same file name in another directory: qualify it with the directory name
+            name = os.path.join(os.path.basename(os.path.dirname(path)), name)
+        entry = ModelEntry(name, path, agent, _signature(path), self.stats_window)
+        with self._lock:
+            replaced = self.models.get(entry.name)
+            self.models[entry.name] = entry
+            if self.active is not None and self.active.name == entry.name:
+                self.active = entry
+            if self.candidate is not None and self.candidate.name == entry.name:
+                self.candidate = entry
+            if replaced is not None:
+                self._retire(replaced)
+            self._evict()
+        return entry
+
+    def set_active(self, name):
+        """Makes the loaded model `name` the active one. Raises KeyError if it isn't loaded."""
+        with self._lock:
+            entry = self.models[name]
+            if self.candidate is entry:
+                self.candidate = None
+            self.active = entry
+            self.swaps += 1
+        print(f"Active Q-network is now {entry.name} ({entry.path}).")
+
+    def set_candidate(self, name, mode=None, percent=None):
+        """
+        Routes `percent` of the traffic to the loaded model `name` ("ab") or shadows it
+        ("shadow"). `name=None` removes the candidate. Raises KeyError / ValueError.
+        """
+        mode = mode or self.candidate_mode
+        if mode not in ("ab", "shadow"):
+            raise ValueError(f"Unknown candidate mode: {mode}")
+        percent = self.candidate_percent if percent is None else percent
+        if not 0 <= percent <= 100:
+            raise ValueError("Candidate percent must be between 0 and 100.")
+        with self._lock:
+            self.candidate = self.models[name] if name is not None else None
+            self.candidate_mode = mode
+            self.candidate_percent = percent
+        if name is not None:
+            print(f"Candidate Q-network is now {name} ({mode}, {percent:g}% of traffic).")
+
+    def _retire(self, entry):
+        if entry.agent.pool is not None:
+            self._retired.append((time.monotonic(), entry))
+
+    def _evict(self):
+        # Drop the oldest models that are neither active nor candidate
+        spare = sorted(
+            (entry for entry in self.models.values() if entry is not self.active and entry is not self.candidate),
+            key=lambda entry: entry.loaded_at,
+        )
+        while len(self.models) > self.max_models and spare:
+            entry = spare.pop(0)
+            del self.models[entry.name]
+            self._retire(entry)
+
+    def _close_retired(self, grace=30.0):
+        cutoff = time.monotonic() - grace
+        while self._retired and self._retired[0][0] < cutoff:
+            self._retired.pop(0)[1].agent.pool.close()
+
+    # --- Watching ---
+    def _scan(self, seen, settling):
+        for path in sorted(glob.glob(os.path.join(self.watch_dir, "*.onnx"))):
+            if path.endswith(QUANTIZED_SUFFIXES + (OPTIMIZED_SUFFIX,)):
+                continue  # derived from a model we already load (AGENT_QUANTIZE, optimized-model cache)
+            signature = _signature(path)
+            if signature is None or seen.get(path) == signature:
+                continue
+            # Wait for the file to stop changing, so a half-copied model is never loaded
+            if settling.get(path) != signature:
+                settling[path] = signature
+                continue
+            del settling[path]
+            seen[path] = signature
+            try:
+                entry = self.load(path, require_model=True)
+            except Exception as e:
+                entry = None
+                print(f"Error loading Q-network {path}: {e}")
+            if entry is None:
+                self.failed_loads += 1
+                print(f"Skipping Q-network {path}: it could not be loaded.")
+                continue
+            # Replacing the active or candidate file in place already swapped it in load()
+            if entry is self.active or entry is self.candidate:
+                self.swaps += 1
+                print(f"Reloaded Q-network {entry.name} from {path}.")
+            elif self.promote == "candidate":
+                self.set_candidate(entry.name)
+            else:
+                self.set_active(entry.name)
+
+    def _watch(self):
+        # Files already present aren't new models
+        seen = {path: _signature(path) for path in glob.glob(os.path.join(self.watch_dir, "*.onnx"))}
+        settling = {}
+        while not self._stop.wait(self.watch_interval):
+            try:
+                self._scan(seen, settling)
+                self._close_retired()
+            except Exception as e:
+                print(f"Error watching {self.watch_dir} for Q-networks: {e}")
+
+    def start(self, report=None):
+        """
+        Starts loading the initial model in the background (with `background_load`) and
+        watching `watch_dir` for new models. `report` (a startup.StartupReport) records
+        the load as its "model_load" phase.
+        """
+        if not self.ready.is_set() and self._loader is None:
+            run = report.run if report is not None else (lambda phase, fn: fn())
+            self._loader = threading.Thread(target=run, args=("model_load", self._load_in_background),
+                                            name="model-loader", daemon=True)
+            self._loader.start()
+        if self.watch_dir and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._watcher.start()
+            print(f"Watching {self.watch_dir} for new Q-networks every {self.watch_interval:g}s.")
+
+    def _load_in_background(self):
+        try:
+            entry = self.load_initial()
+            if entry.agent.has_model():
+                print(f"Q-network {entry.name} is loaded and warmed up; serving with it.")
+            elif not self.ready_without_model:
+                print("No Q-network could be loaded: serving random actions and reporting not ready "
+                      "(set AGENT_READY_WITHOUT_MODEL=1 to accept that).")
+        except Exception as e:
+            # Keep serving random actions rather than failing the process
+            print(f"Error loading the initial Q-network: {e}")
+            self.ready.set()
+
+    def model_status(self):
+        """
+        "loading" until the initial load finished, then "ready" when the active model has
+        a Q-network, else "no_model" ("ready" too with `ready_without_model`).
+        """
+        if not self.ready.is_set():
+            return "loading"
+        if self.active.agent.has_model() or self.ready_without_model:
+            return "ready"
+        return "no_model"
+
+    def close(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        self._shadow.shutdown(wait=False, cancel_futures=True)
+
+    # --- Routing ---
+    def _take(self, percent):
+        # Deterministic split: exactly `percent` of every 100 consecutive calls
+        n = next(self._requests)
+        return int((n + 1) * percent / 100) > int(n * percent / 100)
+
+    def choose_action(self, state):
+        return self.choose_actions([state])[0]
+
+    def choose_actions(self, states):
+        """Chooses actions with the active model, or the candidate for its share of A/B traffic."""
+        active, candidate = self.active, self.candidate
+        entry, shadow = active, None
+        if candidate is not None and self._take(self.candidate_percent):
+            if self.candidate_mode == "ab":
+                entry = candidate
+            elif self.shadow_submitted - self.shadow_finished < self.max_shadow_backlog:
+                shadow = candidate
+            else:
+                self.shadow_dropped += 1
+
+        preparer = entry.agent if entry.agent.has_model() or shadow is None else shadow.agent
+        action_lists, batch = preparer.prepare(states)
+        shadow_batch = batch.copy() if shadow is not None and batch is not None else None
+
+        started = time.perf_counter()
+        chosen = entry.agent.choose_prepared(action_lists, batch)
+        entry.latency.record(time.perf_counter() - started, len(states))
+
+        if shadow is not None:
+            self.shadow_submitted += 1
+            self._shadow.submit(self._run_shadow, shadow, action_lists, shadow_batch, chosen)
+        return chosen
+
+    def _run_shadow(self, entry, action_lists, batch, chosen):
+        try:
+            started = time.perf_counter()
+            shadow_chosen = entry.agent.choose_prepared(action_lists, batch)
+            entry.shadow_latency.record(time.perf_counter() - started, len(action_lists))
+            entry.shadow_compared += len(chosen)
+            entry.shadow_agreed += sum(a == b for a, b in zip(chosen, shadow_chosen))
+        except Exception as e:
+            print(f"Error running shadow Q-network {entry.name}: {e}")
+        finally:
+            self.shadow_finished += 1
+
+    def stats(self):
+        return {
+            "ready": self.ready.is_set(),
+            "model_status": self.model_status(),
+            "active": self.active.name,
+            "candidate": self.candidate.name if self.candidate else None,
+            "candidate_mode": self.candidate_mode,
+            "candidate_percent": self.candidate_percent,
+            "swaps": self.swaps,
+            "failed_loads": self.failed_loads,
+            "shadow_backlog": self.shadow_submitted - self.shadow_finished,
+            "shadow_dropped": self.shadow_dropped,
+            "models": {name: entry.summary() for name, entry in self.models.items()},
+        }
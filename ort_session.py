@@ -0,0 +1,167 @@
+import hashlib
+import os
+import time
+import numpy as np
+from quantize import ensure_quantized
+
+# Session settings, their environment variables and how to parse them.
+# Explicit arguments win over the environment; unset settings keep ONNX Runtime defaults.
+SESSION_ENV_VARS = {
+    "intra_op_threads": ("AGENT_ORT_INTRA_OP_THREADS", int),
+    "inter_op_threads": ("AGENT_ORT_INTER_OP_THREADS", int),
+    "execution_mode": ("AGENT_ORT_EXECUTION_MODE", str),
+    "graph_optimization_level": ("AGENT_ORT_GRAPH_OPT_LEVEL", str),
+    "optimized_model_path": ("AGENT_ORT_OPTIMIZED_MODEL_PATH", str),
+    "enable_mem_arena": ("AGENT_ORT_MEM_ARENA", lambda v: v.strip().lower() in ("1", "true", "yes", "on")),
+    "enable_mem_pattern": ("AGENT_ORT_MEM_PATTERN", lambda v: v.strip().lower() in ("1", "true", "yes", "on")),
+    "allow_spinning": ("AGENT_ORT_ALLOW_SPINNING", lambda v: v.strip().lower() in ("1", "true", "yes", "on")),
+    "warmup_batch_size": ("AGENT_WARMUP_BATCH_SIZE", int),
+    "quantize": ("AGENT_QUANTIZE", str),
+}
+
+# Suffix of the cached graph-optimized models, so the model registry doesn't mistake them for new models
+OPTIMIZED_SUFFIX = ".opt.onnx"
+
+# onnxruntime is imported on first use (it takes a while), so these map to its enum member names
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def resolve_session_config(overrides=None):
+    """
+    Merges explicit session settings with the AGENT_ORT_* environment variables.
+    Settings that are set nowhere are left out, so ONNX Runtime keeps its defaults.
+    """
+    config = {}
+    for key, (env_var, parse) in SESSION_ENV_VARS.items():
+        value = os.getenv(env_var)
+        if value not in (None, ""):
+            try:
+                config[key] = parse(value)
+            except ValueError:
+                print(f"Ignoring invalid {env_var}={value!r}.")
+    for key, value in (overrides or {}).items():
+        if key not in SESSION_ENV_VARS:
+            raise ValueError(f"Unknown ONNX session setting: {key}")
+        if value is not None:
+            config[key] = value
+    return config
+
+
+def build_session_options(config):
+    """
+    Builds `ort.SessionOptions` from a resolved session config.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    if "intra_op_threads" in config:
+        options.intra_op_num_threads = config["intra_op_threads"]
+    if "inter_op_threads" in config:
+        options.inter_op_num_threads = config["inter_op_threads"]
+    if "execution_mode" in config:
+        mode = str(config["execution_mode"]).lower()
+        if mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode '{mode}', expected one of {sorted(EXECUTION_MODES)}")
+        options.execution_mode = getattr(ort.ExecutionMode, EXECUTION_MODES[mode])
+    if "graph_optimization_level" in config:
+        level = str(config["graph_optimization_level"]).lower()
+        if level not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level '{level}', expected one of {sorted(GRAPH_OPTIMIZATION_LEVELS)}")
+        options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[level])
+    if "enable_mem_arena" in config:
+        options.enable_cpu_mem_arena = bool(config["enable_mem_arena"])
+    if "enable_mem_pattern" in config:
+        options.enable_mem_pattern = bool(config["enable_mem_pattern"])
+    if "allow_spinning" in config:
+        # Spinning threads burn idle CPU; turn it off when several workers share the cores
+        flag = "1" if config["allow_spinning"] else "0"
+        options.add_session_config_entry("session.intra_op.allow_spinning", flag)
+        options.add_session_config_entry("session.inter_op.allow_spinning", flag)
+    return options
+
+
+def optimized_cache_path(base_path, model_path, variant=None):
+    """
+    Where the graph-optimized copy of `model_path` is cached: next to `base_path`, as
+    `<base>.<name>.<key>.opt.onnx`, keyed on the source path and precision variant so
+    different models (or AGENT_QUANTIZE settings) never share a cache file.
+    """
+    root, _ = os.path.splitext(os.path.expanduser(base_path))
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    key = hashlib.sha1(f"{os.path.abspath(model_path)}|{variant or 'float32'}".encode()).hexdigest()[:12]
+    return f"{root}.{name}.{key}{OPTIMIZED_SUFFIX}"
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns} {stat.st_size}"
+
+
+def create_session(model_path, config=None):
+    """
+    Creates an InferenceSession for `model_path` using a resolved session config.
+
+    With `optimized_model_path` set, the graph-optimized model is saved on the first load
+    (at `optimized_cache_path`, with the source model's mtime and size in a `.source` file
+    beside it), and later loads use that file directly (skipping graph optimization) as
+    long as the source model is unchanged.
+
+    With `quantize` set to "int8" or "fp16", the reduced-precision variant of the model
+    (see quantize.py) is created next to it if needed and loaded instead. If quantizing
+    fails, the float32 model is loaded.
+    """
+    import onnxruntime as ort
+
+    config = dict(config or {})
+    variant = None
+    if config.get("quantize"):
+        try:
+            model_path = ensure_quantized(model_path, config["quantize"])
+            variant = config["quantize"]
+        except Exception as e:
+            print(f"Could not quantize {model_path} ({config['quantize']}): {e}. Loading the float32 model.")
+    optimized_path = signature = None
+    if config.get("optimized_model_path") and os.path.exists(model_path):
+        optimized_path = optimized_cache_path(config["optimized_model_path"], model_path, variant)
+        signature = _source_signature(model_path)
+        try:
+            with open(optimized_path + ".source") as f:
+                cached = f.read().strip()
+        except OSError:
+            cached = None
+        if cached == signature and os.path.exists(optimized_path):
+            config["graph_optimization_level"] = "disable"
+            print(f"Loading cached optimized ONNX model from: {optimized_path}")
+            return ort.InferenceSession(optimized_path, sess_options=build_session_options(config))
+
+    options = build_session_options(config)
+    if optimized_path:
+        os.makedirs(os.path.dirname(os.path.abspath(optimized_path)), exist_ok=True)
+        options.optimized_model_filepath = optimized_path
+    session = ort.InferenceSession(model_path, sess_options=options)
+    if optimized_path and os.path.exists(optimized_path):
+        with open(optimized_path + ".source", "w") as f:
+            f.write(signature)
+    return session
+
+
+def warm_up(run_batch, state_size, batch_sizes):
+    """
+    Runs dummy zero batches of each size through `run_batch` so lazy initialization
+    (allocations, kernel selection) happens before the first real request.
+    Returns the warm-up time in seconds.
+    """
+    started = time.perf_counter()
+    for size in batch_sizes:
+        run_batch(np.zeros((size, state_size), dtype=np.float32))
+    return time.perf_counter() - started
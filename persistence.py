@@ -0,0 +1,234 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from state_store import NetworkState
+from simulation import apply_action, apply_updates
+
+
+def connect(path, synchronous="NORMAL"):
+    """Opens the state database in WAL mode, so readers in other processes never block the writer."""
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    return conn
+
+
+def load_snapshot(conn):
+    """Returns the latest snapshot as a `NetworkState` at its version, or None if there is none."""
+    row = conn.execute("SELECT version, state FROM snapshots ORDER BY version DESC LIMIT 1").fetchone()
+    if not row:
+        return None
+    state = NetworkState.from_dict(json.loads(row[1]))
+    state.version = row[0]
+    return state
+
+
+def read_log(conn, after_version):
+    """Returns the (version, kind, payload) log entries after `after_version`, oldest first."""
+    return [(version, kind, json.loads(payload)) for version, kind, payload in conn.execute(
+        "SELECT version, kind, payload FROM log WHERE version > ? ORDER BY version", (after_version,))]
+
+
+def replay_entry(state, kind, payload):
+    """Re-applies one logged operation. Each operation commits exactly one version."""
+    if kind == "action":
+        apply_action(state, payload)
+    elif kind == "updates":
+        apply_updates(state, payload)
+    else:
+        raise ValueError(f"Unknown state log entry kind: {kind}")
+
+
+def replay_log(state, entries):
+    """
+    Replays log entries onto `state`. Returns the number replayed, stopping early
+    (with a warning) if the entries don't continue from the state's version.
+    """
+    replayed = 0
+    for version, kind, payload in entries:
+        if version != state.version + 1:
+            print(f"State log has a gap before version {version}; stopping replay at version {state.version}.")
+            break
+        replay_entry(state, kind, payload)
+        replayed += 1
+    return replayed
+
+
+class StatePersistence:
+    """
+    Crash-safe persistence for a `NetworkState`: a write-ahead log of every applied
+    operation plus periodic compact snapshots, in one SQLite database in WAL mode.
+
+    Appends are queued and written by a background thread with group commit (one
+    transaction per batch of up to `max_batch` records or `commit_interval` seconds),
+    so the request path never waits on the disk. On startup, `recover()` loads the
+    latest snapshot and replays the log entries after it.
+    """
+    def __init__(self, path, snapshot_every=1000, commit_interval=0.05, max_batch=1024,
+                 synchronous="NORMAL", keep_snapshots=2):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.commit_interval = commit_interval
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        self.keep_snapshots = keep_snapshots
+
+        self.appended = 0
+        self.committed = 0
+        self.commits = 0
+        self.snapshots = 0
+
+        with closing(self._connect()) as conn, conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS log (version INTEGER PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS snapshots (version INTEGER PRIMARY KEY, state TEXT NOT NULL, created REAL NOT NULL)")
+
+        self._queue = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="state-persistence", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        return connect(self.path, self.synchronous)
+
+    # --- Recovery ---
+    def recover(self, initial_state):
+        """
+        Rebuilds the state: latest snapshot (or `initial_state`, a `network_state`-shaped
+        dict, when there is none) plus a replay of the log entries after it.
+        """
+        with closing(self._connect()) as conn:
+            state = load_snapshot(conn)
+            snapshot_version = state.version if state else None
+            if state is None:
+                state = NetworkState.from_dict(initial_state)
+            replayed = replay_log(state, read_log(conn, state.version))
+
+        # Replayed changes are already known to everyone who could ask for them
+        state.history.clear()
+        if snapshot_version is None:
+            # Readers in other processes (shared_state.py) start from a snapshot, not their own initial state
+            self.snapshot(state)
+        print(f"Recovered network state at version {state.version} "
+              f"({'initial state' if snapshot_version is None else f'snapshot {snapshot_version}'} + {replayed} logged operations).")
+        return state
+
+    # --- Appending ---
+    def append(self, version, kind, payload):
+        """Queues one log entry (the operation that produced `version`) for the next group commit."""
+        self.appended += 1
+        self._queue.put(("log", (version, kind, json.dumps(payload))))
+
+    def record(self, state, kind, payload):
+        """
+        Logs an operation just applied to `state` (see `replay_entry` for the kinds),
+        and queues a snapshot every `snapshot_every` versions.
+        """
+        self.append(state.version, kind, payload)
+        if self.snapshot_every and state.version % self.snapshot_every == 0:
+            self.snapshot(state)
+
+    def record_action(self, state, action):
+        """Logs an action just applied with `apply_action`."""
+        self.record(state, "action", action)
+
+    def record_updates(self, state, updates):
+        """Logs missions and data havens just added with `apply_updates`."""
+        self.record(state, "updates", updates)
+
+    def snapshot(self, state):
+        """
+        Queues a snapshot of `state` at its current version. The state is copied here
+        (on the caller's thread); encoding and writing happen on the writer thread.
+        Log entries and snapshots older than the kept snapshots are pruned.
+        """
+        snapshot = state.to_dict()
+        snapshot["agents"] = [dict(agent) for agent in snapshot["agents"]]
+        snapshot["log"] = list(snapshot["log"])
+        self._queue.put(("snapshot", (state.version, snapshot)))
+
+    def flush(self, timeout=None):
+        """Blocks until everything queued so far has been committed."""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Commits everything still queued and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(("stop", None))
+        self._writer.join()
+
+    # --- Writer thread ---
+    def _write_loop(self):
+        conn = self._connect()
+        try:
+            running = True
+            while running:
+                batch = [self._queue.get()]
+                deadline = time.monotonic() + self.commit_interval
+                while len(batch) < self.max_batch:
+                    timeout = deadline - time.monotonic()
+                    try:
+                        if timeout > 0:
+                            batch.append(self._queue.get(timeout=timeout))
+                        else:
+                            batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                running = self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        running = True
+        waiters = []
+        log_rows = []
+        try:
+            with conn:
+                for kind, item in batch:
+                    if kind == "log":
+                        log_rows.append(item)
+                    elif kind == "snapshot":
+                        # Log entries up to the snapshot must land before pruning them
+                        if log_rows:
+                            conn.executemany("INSERT OR REPLACE INTO log VALUES (?, ?, ?)", log_rows)
+                            self.committed += len(log_rows)
+                            log_rows = []
+                        self._write_snapshot(conn, *item)
+                    elif kind == "flush":
+                        waiters.append(item)
+                    elif kind == "stop":
+                        running = False
+                if log_rows:
+                    conn.executemany("INSERT OR REPLACE INTO log VALUES (?, ?, ?)", log_rows)
+                    self.committed += len(log_rows)
+            self.commits += 1
+        except sqlite3.Error as e:
+            print(f"Error persisting network state: {e}")
+        for waiter in waiters:
+            waiter.set()
+        return running
+
+    def _write_snapshot(self, conn, version, snapshot):
+        conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)", (version, json.dumps(snapshot), time.time()))
+        self.snapshots += 1
+        kept = [row[0] for row in conn.execute(
+            "SELECT version FROM snapshots ORDER BY version DESC LIMIT ?", (self.keep_snapshots,))]
+        oldest_kept = kept[-1]
+        conn.execute("DELETE FROM snapshots WHERE version < ?", (oldest_kept,))
+        conn.execute("DELETE FROM log WHERE version <= ?", (oldest_kept,))
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "appended": self.appended,
+            "committed": self.committed,
+            "pending": self._queue.qsize(),
+            "commits": self.commits,
+            "snapshots": self.snapshots,
+        }
@@ -0,0 +1,231 @@
+import json
+import numpy as np
+
+# Rough size of a token for English text and JSON; good enough for budgeting
+CHARS_PER_TOKEN = 4
+INDENT = "\n        "  # matches the indentation of the chat prompt template
+
+
+def estimate_tokens(text_or_length):
+    """Estimated token count of a string (or of a string of the given length)."""
+    length = text_or_length if isinstance(text_or_length, int) else len(text_or_length)
+    return -(-length // CHARS_PER_TOKEN)
+
+
+class PromptContextBuilder:
+    """
+    Builds the "Current Network State" section of the chat prompt as a compact summary
+    that stays within `budget_tokens`, however large the world gets: resources and mission
+    counts by status, then (as far as the budget allows) the top `top_k` available missions
+    by reward and by cost, in-progress missions, the most valuable unanalyzed data havens,
+    agents and the last `log_lines` log lines.
+
+    Counts come straight from the state's per-status indices. The summary is built once
+    per state version, and only from what changed: the top-K lists and the size of the
+    old full JSON dump of the state (tracked to report the tokens saved) are updated
+    from the state's deltas, so a new version costs time proportional to its changes.
+    """
+    def __init__(self, budget_tokens=600, top_k=5, log_lines=5):
+        self.budget_tokens = budget_tokens
+        self.top_k = top_k
+        self.log_lines = log_lines
+        self.version = None
+        self.text = ""
+        self.tokens = 0
+        self.full_tokens = 0
+
+        self.builds = 0
+        self.uses = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+        # Serialized length of every entity in the full dump, kept up to date from deltas
+        self._state = None  # the state object the cached data belongs to
+        self._mission_lengths = {}
+        self._haven_lengths = {}
+        self._mission_total = 0
+        self._haven_total = 0
+        self._tops = {}  # section name -> top-K indices, kept up to date from deltas
+
+    def refresh(self, state):
+        """
+        Brings the summary up to date with the state's current version (rebuilt only when
+        the version has moved) and returns it, without counting it as a prompt sent.
+        """
+        if self.version == state.version and self._state is state:
+            return self.text
+        changes = self._changes(state)
+        self._update_lengths(state, changes)
+        self._update_tops(state, changes)
+        self.text = self._build(state)
+        self.tokens = estimate_tokens(self.text)
+        self.full_tokens = estimate_tokens(self._full_length(state))
+        self._state = state
+        self.version = state.version
+        self.builds += 1
+        return self.text
+
+    def context(self, state):
+        """The summary for the state's current version, counted as sent in a prompt."""
+        text = self.refresh(state)
+        self.uses += 1
+        self.tokens_sent += self.tokens
+        self.tokens_saved += max(self.full_tokens - self.tokens, 0)
+        return text
+
+    def _changes(self, state):
+        """
+        The mission and data haven indices changed since the last build, from the state's
+        deltas: {"missions": set, "data_havens": set}, or None when everything has to be
+        recomputed (first build, another state object, or history no longer reaching back).
+        """
+        if self._state is not state or self.version is None:
+            return None
+        deltas = state.deltas_since(self.version)
+        if deltas is None:
+            return None
+        changes = {"missions": set(), "data_havens": set()}
+        for delta in deltas:
+            changes["missions"].update(state.mission_index[mission_id] for mission_id in delta.get("missions", ()))
+            changes["data_havens"].update(state.haven_index[haven_id] for haven_id in delta.get("data_havens", ()))
+        return changes
+
+    # --- Summary ---
+    def _mission_line(self, state, i):
+        return (f'{state.mission_ids[i]} "{state.mission_titles[i]}" '
+                f"(reward {state.mission_reward_of(i)}, cost {state.mission_cost_of(i)})")
+
+    def _haven_line(self, state, i):
+        return f'{state.haven_ids[i]} "{state.haven_names[i]}" (value {state.haven_value_of(i)})'
+
+    def _top(self, indices, keys):
+        """
+        The `top_k` of `indices` ordered by `keys` ((column, sign) pairs, most significant
+        first; sign -1 sorts descending), ties by index.
+        """
+        indices = np.fromiter(indices, dtype=np.intp, count=len(indices))
+        order = np.lexsort([indices] + [sign * column[indices] for column, sign in reversed(keys)])
+        return indices[order[:self.top_k]]
+
+    def _sections(self, state):
+        """Top-K section name -> (entity kind, the index set it ranks, sort keys)."""
+        reward, cost = state.mission_reward, state.mission_cost
+
+        def missions(status):
+            code = state.status_codes.get(status)
+            return state.missions_by_status[code] if code is not None else set()
+
+        return {
+            "in_progress": ("missions", missions("in_progress"), ((reward, -1),)),
+            "by_reward": ("missions", missions("available"), ((reward, -1), (cost, 1))),
+            "by_cost": ("missions", missions("available"), ((cost, 1), (reward, -1))),
+            "havens": ("data_havens", state.unanalyzed_havens, ((state.haven_value, -1),)),
+        }
+
+    def _update_tops(self, state, changes):
+        """
+        Keeps each section's top-K up to date. When no current top entry changed, the new
+        top-K is the best of the old one and the changed entities now in the section, so
+        only those are ranked; otherwise (or without deltas) the section is re-ranked.
+        """
+        for name, (kind, indices, keys) in self._sections(state).items():
+            top = self._tops.get(name)
+            changed = None if changes is None else changes[kind]
+            if top is None or changed is None or any(i in changed for i in top.tolist()):
+                self._tops[name] = self._top(indices, keys)
+            elif changed:
+                candidates = set(top.tolist())
+                candidates.update(i for i in changed if i in indices)
+                self._tops[name] = self._top(candidates, keys)
+
+    def _build(self, state):
+        def count(status):
+            return len(state.missions_by_status.get(state.status_codes.get(status), ()))
+
+        counts = ", ".join(
+            f"{len(state.missions_by_status[code])} {state.status_names[code].replace('_', ' ')}"
+            for code in range(len(state.status_names))
+        )
+        lines = [
+            f"- Resources: {state.resources}",
+            f"- Missions: {counts} ({len(state.mission_ids)} total)",
+        ]
+        budget = self.budget_tokens - estimate_tokens(len(INDENT.join(lines)))
+
+        tops = self._tops
+        sections = [
+            ("Recent Log", [json.dumps(line) for line in state.log[:self.log_lines]], len(state.log)),
+            ("In-progress missions", [self._mission_line(state, i) for i in tops["in_progress"]],
+             count("in_progress")),
+            ("Top available missions by reward", [self._mission_line(state, i) for i in tops["by_reward"]],
+             count("available")),
+            ("Cheapest available missions", [self._mission_line(state, i) for i in tops["by_cost"]],
+             count("available")),
+            ("Unanalyzed data havens by value", [self._haven_line(state, i) for i in tops["havens"]],
+             len(state.unanalyzed_havens)),
+            ("Agents", [f"{agent.get('name', agent.get('id'))} ({agent.get('status')})"
+                        for agent in state.agents[:self.top_k]], len(state.agents)),
+        ]
+        for title, items, total in sections:
+            if not items:
+                continue
+            # Add items while they fit; always say how many were left out
+            line = f"- {title}:"
+            shown = 0
+            for item in items:
+                candidate = f"{line}{';' if shown else ''} {item}"
+                if estimate_tokens(len(INDENT) + len(candidate) + 16) > budget:
+                    break
+                line = candidate
+                shown += 1
+            if not shown:
+                continue
+            if total > shown:
+                line += f" (+{total - shown} more)"
+            lines.append(line)
+            budget -= estimate_tokens(len(INDENT) + len(line))
+        return INDENT.join(lines)
+
+    # --- Savings accounting ---
+    def _update_lengths(self, state, changes):
+        """Keeps the serialized length of every entity in the full dump up to date."""
+        if changes is None:
+            self._mission_lengths = {i: len(json.dumps(state.mission_dict(i))) for i in range(len(state.mission_ids))}
+            self._haven_lengths = {i: len(json.dumps(state.data_haven_dict(i))) for i in range(len(state.haven_ids))}
+            self._mission_total = sum(self._mission_lengths.values())
+            self._haven_total = sum(self._haven_lengths.values())
+            return
+        for i in changes["missions"]:
+            length = len(json.dumps(state.mission_dict(i)))
+            self._mission_total += length - self._mission_lengths.get(i, 0)
+            self._mission_lengths[i] = length
+        for i in changes["data_havens"]:
+            length = len(json.dumps(state.data_haven_dict(i)))
+            self._haven_total += length - self._haven_lengths.get(i, 0)
+            self._haven_lengths[i] = length
+
+    def _full_length(self, state):
+        """Length of the full JSON dump the prompt used to inline (see `_update_lengths`)."""
+        def list_length(total, count):
+            return 2 + total + 2 * max(count - 1, 0)
+
+        return (
+            len(f"- Resources: {state.resources}")
+            + len("- Missions: ") + list_length(self._mission_total, len(self._mission_lengths))
+            + len("- Data Havens: ") + list_length(self._haven_total, len(self._haven_lengths))
+            + len("- Agents: ") + len(json.dumps(state.agents))
+            + len("- Recent Log: ") + len(json.dumps(state.log))
+            + 4 * len(INDENT)
+        )
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "budget_tokens": self.budget_tokens,
+            "tokens": self.tokens,
+            "full_dump_tokens": self.full_tokens,
+            "builds": self.builds,
+            "uses": self.uses,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+        }
@@ -0,0 +1,91 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def state_key(row):
+    """A 16-byte digest of a featurized state row (its raw float32 bytes)."""
+    return hashlib.blake2b(row, digest_size=16).digest()
+
+
+class QValueCache:
+    """
+    Bounded LRU cache of Q-network outputs, keyed on a hash of the featurized state.
+
+    The Q-values depend only on the (N, 128) feature rows, and many states (repeated polls
+    of the same world, worlds differing only in completed missions or resources) featurize
+    identically. `lookup()` serves the rows it has seen, runs the model once on the distinct
+    rows it hasn't, and stores those. Entries belong to the model they were computed with:
+    passing a different `model` object to `lookup()` empties the cache first.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> Q-value row, least recently used first
+        self._model = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batch_duplicates = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, batch, compute, model=None):
+        """
+        Returns the (N, K) Q-values for `batch`, calling `compute(rows)` once with only
+        the distinct rows that aren't cached (or not at all when every row is).
+        """
+        batch = np.ascontiguousarray(batch)
+        keys = [state_key(row) for row in batch]
+        rows = [None] * len(keys)
+        missing = {}  # key -> positions in the batch
+        with self._lock:
+            if model is not self._model:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._model = model
+            for i, key in enumerate(keys):
+                q_values = self._entries.get(key)
+                if q_values is not None:
+                    self._entries.move_to_end(key)
+                    rows[i] = q_values
+                    self.hits += 1
+                elif key in missing:
+                    missing[key].append(i)
+                    self.batch_duplicates += 1
+                else:
+                    missing[key] = [i]
+                    self.misses += 1
+
+        if missing:
+            computed = compute(batch[[positions[0] for positions in missing.values()]])
+            with self._lock:
+                for (key, positions), q_values in zip(missing.items(), computed):
+                    # Copied: the model output can be a reused (e.g. shared-memory) buffer
+                    q_values = q_values.copy()
+                    for i in positions:
+                        rows[i] = q_values
+                    if model is self._model:
+                        self._entries[key] = q_values
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return np.stack(rows)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.batch_duplicates + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "batch_duplicates": self.batch_duplicates,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.batch_duplicates) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
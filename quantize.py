@@ -0,0 +1,84 @@
+import os
+import numpy as np
+
+QUANTIZE_MODES = ("int8", "fp16")
+# Suffixes of the derived model files, so the model registry doesn't mistake them for new models
+QUANTIZED_SUFFIXES = tuple(f".{mode}.onnx" for mode in QUANTIZE_MODES)
+
+
+def quantized_model_path(model_path, mode):
+    """Where the `mode` variant of `model_path` is kept: next to it, as `<name>.<mode>.onnx`."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}.{mode}.onnx"
+
+
+def _fp16_weights(model_path, output_path, min_elements=16):
+    """
+    Stores the float32 weights of a model as float16, with a Cast back to float32 in
+    front of the graph, so the model file is about half the size while every op still
+    computes in float32. Session memory doesn't shrink: ONNX Runtime constant-folds the
+    Casts back into float32 weights when it loads the model.
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    model = onnx.load(model_path)
+    graph = model.graph
+    initializers, casts, converted = [], [], set()
+    for initializer in graph.initializer:
+        if initializer.data_type == TensorProto.FLOAT and int(np.prod(initializer.dims)) >= min_elements:
+            half = numpy_helper.from_array(numpy_helper.to_array(initializer).astype(np.float16), f"{initializer.name}_fp16")
+            initializers.append(half)
+            casts.append(helper.make_node("Cast", [half.name], [initializer.name], to=TensorProto.FLOAT,
+                                          name=f"{initializer.name}_to_fp32"))
+            converted.add(initializer.name)
+        else:
+            initializers.append(initializer)
+
+    # Older exporters also list initializers as graph inputs
+    inputs = [graph_input for graph_input in graph.input if graph_input.name not in converted]
+    nodes = casts + list(graph.node)
+    del graph.initializer[:]
+    graph.initializer.extend(initializers)
+    del graph.input[:]
+    graph.input.extend(inputs)
+    del graph.node[:]
+    graph.node.extend(nodes)
+    onnx.save(model, output_path)
+
+
+def quantize_model(model_path, output_path=None, mode="int8"):
+    """
+    Writes a reduced-precision variant of an ONNX model and returns its path:
+    "int8" applies ONNX Runtime's dynamic quantization (int8 weights, activations
+    quantized on the fly), "fp16" stores the weights as float16 (see `_fp16_weights`).
+    The file is written under a temporary name and moved into place, so concurrent
+    loaders (e.g. inference workers) never read a partial model.
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode} (expected one of {', '.join(QUANTIZE_MODES)})")
+    output_path = output_path or quantized_model_path(model_path, mode)
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        if mode == "int8":
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            quantize_dynamic(model_path, temp_path, weight_type=QuantType.QInt8)
+        else:
+            _fp16_weights(model_path, temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return output_path
+
+
+def ensure_quantized(model_path, mode):
+    """
+    Returns the path of the `mode` variant of `model_path`, quantizing it first unless
+    a variant newer than the source model already exists.
+    """
+    output_path = quantized_model_path(model_path, mode)
+    if os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(model_path):
+        return output_path
+    print(f"Quantizing ONNX model {model_path} ({mode}) to: {output_path}")
+    return quantize_model(model_path, output_path, mode)
@@ -1,8 +1,26 @@
-from fastapi import FastAPI, Request
+# Created before the other imports, so the startup report (GET /readyz) includes their cost
+from startup import StartupReport
+startup_report = StartupReport()
+
+import os
+from fastapi import FastAPI, Request, Query, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from agent import Agent
+from state_store import NetworkState
+from simulation import SimulationEngine, apply_action, apply_updates
+from state_stream import StateBroadcaster
+from state_cache import EncodedStateCache
+from persistence import StatePersistence
+from model_registry import ModelRegistry
+from webhook_ingest import WebhookPipeline, WebhookQueueFull, webhook_updates
+from session_worlds import WorldShards
+from trajectory import TrajectoryRecorder
+import metrics
+from metrics import MetricsMiddleware, timed
+startup_report.mark("imports")
 
 # --- App Setup ---
 app = FastAPI()
@@ -12,10 +30,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Per-route latency histograms for /metrics (see metrics.py)
+app.add_middleware(MetricsMiddleware)
 
 # --- Agent and Environment Setup ---
-agent = Agent()
-network_state = {
+# The registry loads the Q-network(s) and routes each cycle to the active model
+# (or a candidate, see AGENT_CANDIDATE_*), with the same choose_action interface as Agent.
+# With AGENT_BACKGROUND_LOAD (the default), the model loads after startup while cycles
+# use random actions; GET /readyz reports when it is warmed up.
+models = ModelRegistry.from_env(Agent)
+startup_report.mark("model_registry")
+INITIAL_STATE = {
     "missions": [
         {"id": "m1", "title": "Corporate Espionage", "status": "available", "reward": 5000, "cost": 1000},
         {"id": "m2", "title": "Data Heist", "status": "available", "reward": 3500, "cost": 500},
@@ -34,78 +59,264 @@ network_state = {
     "resources": 10000,
 }
 
+# Optional crash-safe persistence: set DEADLOCK_STATE_DB to a SQLite file path to keep
+# a write-ahead action log and snapshots, and recover the state from them on startup.
+persistence = None
+if os.getenv("DEADLOCK_STATE_DB"):
+    persistence = StatePersistence(
+        os.getenv("DEADLOCK_STATE_DB"),
+        snapshot_every=int(os.getenv("DEADLOCK_SNAPSHOT_EVERY", "1000")),
+    )
+    network_state = persistence.recover(INITIAL_STATE)
+else:
+    network_state = NetworkState.from_dict(INITIAL_STATE)
+
+# Opt-in (DEADLOCK_TRAJECTORY_DIR): every agent cycle is recorded as a (state, action,
+# reward, next state, done) transition for retraining the Q-network (see trajectory.py)
+trajectories = TrajectoryRecorder.from_env()
+
+startup_report.mark("state")
+
+# Per-operator worlds: requests with a session id (X-Session-Id header, or a session_id /
+# wallet query parameter) get their own world, created from INITIAL_STATE on first use,
+# sharded across DEADLOCK_SESSION_WORKERS processes and evicted to DEADLOCK_SESSION_DIR when idle.
+# Requests without one keep using the shared network_state.
+sessions = WorldShards.from_env(INITIAL_STATE, models, recorder=trajectories)
+
+def session_id_of(request):
+    return (request.headers.get("x-session-id") or request.query_params.get("session_id")
+            or request.query_params.get("wallet"))
+
+# Pushes per-cycle state deltas to /api/stream subscribers
+state_stream = StateBroadcaster(network_state)
+# Encoded /api/state body, reused until the state version moves
+state_cache = EncodedStateCache()
+
 # --- Webhook Endpoint ---
+def apply_webhooks(payloads):
+    """Applies a batch of webhook payloads as one state update (new missions and data havens)."""
+    updates = webhook_updates(payloads)
+    if not updates:
+        return
+    log_message = apply_updates(network_state, updates)
+    if log_message is None:
+        return  # every entity was already known: no new version to log or push
+    print(log_message)
+    if persistence:
+        persistence.record_updates(network_state, updates)
+    state_stream.notify()
+
+# Webhooks are acknowledged right away and applied in batches by a background task
+webhooks = WebhookPipeline(
+    apply_webhooks,
+    max_queue=int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000")),
+    batch_size=int(os.getenv("WEBHOOK_BATCH_SIZE", "256")),
+)
+
 @app.post("/webhook")
 async def receive_webhook(request: Request):
     """
-    Accepts and logs incoming webhook payloads.
+    Accepts incoming webhook payloads. The body is queued for batch processing and
+    acknowledged with 202; a repeated `Idempotency-Key` is acknowledged without being
+    queued again, and a full queue answers 429.
     """
-    payload = await request.json()
-    print("--- INCOMING WEBHOOK ---")
-    print(payload)
-    print("------------------------")
-    return {"status": "success", "received_data": payload}
+    body = await request.body()
+    try:
+        queued = webhooks.submit(body, request.headers.get("idempotency-key"))
+    except WebhookQueueFull as e:
+        return JSONResponse(status_code=429, content={"status": "rejected", "detail": str(e)}, headers={"Retry-After": "1"})
+    if not queued:
+        return {"status": "duplicate"}
+    return JSONResponse(status_code=202, content={"status": "accepted"})
+
+@app.get("/webhook/stats")
+async def webhook_stats():
+    """Queue depth, throughput and dedupe counters of the webhook pipeline."""
+    return webhooks.stats()
 
 # --- Agent System API ---
 @app.get("/api/state")
-async def get_state():
-    """Returns the current state of the DEADLOCK NETWORK."""
-    return network_state
+async def get_state(request: Request, since: int = None):
+    """
+    Returns the current state of the DEADLOCK NETWORK.
+    The body is cached per state version and served with an ETag, so unchanged polls
+    with `If-None-Match` get a 304. With `?since=<version>`, returns only the deltas
+    after that version (`{"version", "deltas"}`), or `{"version", "state"}` if it's too old.
+    With a session id, returns that operator's world instead.
+    """
+    session_id = session_id_of(request)
+    if session_id:
+        return (await run_in_threadpool(sessions.snapshot, session_id))["state"]
+    if since is not None:
+        deltas = network_state.deltas_since(since)
+        if deltas is None:
+            return network_state.snapshot()
+        return {"version": network_state.version, "deltas": deltas}
+    with timed("serialize"):
+        return state_cache.response(request, network_state.version, network_state.to_dict)
+
+@app.get("/api/stream")
+async def stream_state(request: Request, since: int = None):
+    """
+    Server-Sent Events stream of state changes. Sends a full `snapshot` event first
+    (unless `since` / `Last-Event-ID` names a version still in the history), then one
+    `delta` event per committed cycle with only the changed fields, resources and new log lines.
+    """
+    if since is None and request.headers.get("last-event-id", "").isdigit():
+        since = int(request.headers["last-event-id"])
+    return StreamingResponse(
+        state_stream.stream(since, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.post("/api/run_agent_cycle")
-async def run_agent_cycle():
-    """Runs one cycle of the agent's decision-making process."""
+async def run_agent_cycle(request: Request):
+    """
+    Runs one cycle of the agent's decision-making process. With a session id, the cycle
+    runs on that operator's world (on its shard) and returns it.
+    """
     global network_state
+    session_id = session_id_of(request)
+    if session_id:
+        try:
+            return (await run_in_threadpool(sessions.run_cycle, session_id))["state"]
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"detail": f"Internal server error in agent cycle: {e}"})
     try:
         # 1. Agent chooses an action based on the current state
-        action = agent.choose_action(network_state)
-        action_type = action.get("action")
-        
-        log_message = f"Agent action: {action_type}"
-        
-        # 2. Update state based on the chosen action
-        if action_type == "accept_mission":
-            mission_id = action.get("mission_id")
-            for m in network_state["missions"]:
-                if m["id"] == mission_id and m["status"] == "available":
-                    if network_state["resources"] >= m["cost"]:
-                        m["status"] = "in_progress"
-                        network_state["resources"] -= m["cost"]
-                        log_message += f" - Mission '{m['title']}' accepted. Cost: {m['cost']}"
-                    else:
-                        log_message += f" - Failed to accept '{m['title']}'. Insufficient resources."
-                    break
-        elif action_type == "complete_mission":
-            mission_id = action.get("mission_id")
-            for m in network_state["missions"]:
-                if m["id"] == mission_id and m["status"] == "in_progress":
-                    m["status"] = "completed"
-                    network_state["resources"] += m["reward"]
-                    log_message += f" - Mission '{m['title']}' completed. Reward: {m['reward']}"
-                    break
-        elif action_type == "analyze_data":
-            data_id = action.get("data_id")
-            for d in network_state["data_havens"]:
-                if d["id"] == data_id and not d["analyzed"]:
-                    d["analyzed"] = True
-                    network_state["resources"] += d["value"]
-                    log_message += f" - Data '{d['name']}' analyzed. Value: {d['value']}"
-                    break
-        else: # idle
-            log_message = "Agent is idle. No available actions."
-
-        network_state["log"].insert(0, log_message)
-        if len(network_state["log"]) > 10: # Keep log from growing too large
-            network_state["log"].pop()
-
-        return network_state
+        action = models.choose_action(network_state)
+
+        # 2. Update state based on the chosen action (see simulation.apply_action)
+        with timed("transition"):
+            if trajectories:
+                trajectories.record_step(network_state, action, apply_action)
+            else:
+                apply_action(network_state, action)
+        if persistence:
+            with timed("persist"):
+                persistence.record_action(network_state, action)
+        state_stream.notify()
+
+        # Encoded through the state cache, so the next /api/state poll reuses the body
+        with timed("serialize"):
+            return state_cache.response(request, network_state.version, network_state.to_dict)
     except Exception as e:
         import traceback
         traceback.print_exc() # Print full traceback to console
         # Return a 500 Internal Server Error
-        from fastapi.responses import JSONResponse
         return JSONResponse(status_code=500, content={"detail": f"Internal server error in agent cycle: {e}"})
 
+@app.post("/api/run_agent_cycles")
+async def run_agent_cycles(
+    n: int = Query(100, ge=1, le=1_000_000, description="Cycles to run"),
+    worlds: int = Query(1, ge=1, le=100_000, description="Independent copies of the current world"),
+):
+    """
+    Runs `n` headless agent cycles on `worlds` independent copies of the current state,
+    batching inference across worlds at every step. The live network state is not modified.
+    Returns throughput (steps/sec) and the resulting resource distribution.
+    """
+    if n * worlds > 100_000_000:
+        return JSONResponse(status_code=400, content={"detail": "n * worlds must not exceed 100,000,000 steps."})
+    # Copy the template on the event loop, then simulate off it (always with the active model)
+    engine = SimulationEngine(models.active.agent, network_state, n_worlds=worlds)
+    return await run_in_threadpool(engine.run, n)
+
+@app.get("/api/sessions/stats")
+async def session_stats():
+    """Loaded, created, reloaded and evicted session worlds per shard."""
+    return await run_in_threadpool(sessions.stats)
+
+@app.get("/api/trajectories/stats")
+async def trajectory_stats():
+    """Recorded, written and dropped transitions of the trajectory recorder (empty when it is off)."""
+    return trajectories.stats() if trajectories else {}
+
+@app.get("/api/models")
+async def list_models():
+    """Loaded Q-networks, the active one and the candidate, with per-model latency stats."""
+    return models.stats()
+
+@app.post("/api/models/activate")
+async def activate_model(name: str):
+    """Makes an already loaded model the active one."""
+    try:
+        models.set_active(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model {name} is not loaded.")
+    return models.stats()
+
+@app.post("/api/models/candidate")
+async def set_candidate_model(name: str = None, mode: str = None, percent: float = None):
+    """Routes `percent` of agent cycles to a loaded model ("ab") or shadows it ("shadow"); no name clears it."""
+    try:
+        models.set_candidate(name, mode, percent)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model {name} is not loaded.")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return models.stats()
+
+@app.on_event("startup")
+async def startup_event():
+    webhooks.start()
+    if trajectories:
+        trajectories.start()
+    if not models.ready.is_set():
+        startup_report.expect("model_load")
+    models.start(startup_report)
+    if sessions.n_workers:
+        # Shard processes load their own model; requests for a session wait until they are up
+        startup_report.expect("session_shards")
+        startup_report.run_in_background("session_shards", sessions.start)
+    startup_report.serving()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Apply what is still queued before the final snapshot
+    await webhooks.stop()
+    models.close()
+    sessions.close()
+    if trajectories:
+        trajectories.close()
+    if persistence:
+        # Snapshot on the way out so the next start has nothing to replay
+        persistence.snapshot(network_state)
+        persistence.close()
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Stage and route latency histograms in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/slow")
+async def slow_requests():
+    """The slowest requests with their stage breakdown (set DEADLOCK_SLOW_REQUESTS=N to collect them)."""
+    return metrics.slow_requests()
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: 200 once the Q-network (and any session shards) finished loading, 503
+    before, and 503 with status "no_model" if no Q-network could be loaded (unless
+    AGENT_READY_WITHOUT_MODEL=1). Agent cycles are served meanwhile, with random actions.
+    """
+    model_status = models.model_status()
+    ready = startup_report.ready.is_set() and model_status == "ready"
+    body = {
+        "ready": ready,
+        "status": "ready" if ready else ("no_model" if model_status == "no_model" else "starting"),
+        "model": models.active.name,
+        "model_loaded": models.active.agent.has_model(),
+        "startup": startup_report.summary(),
+    }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
 
 @app.get("/api/hello")
 async def hello_world():
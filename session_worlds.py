@@ -0,0 +1,470 @@
+import atexit
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import OrderedDict
+from state_store import NetworkState
+from simulation import apply_action
+from trajectory import TrajectoryRecorder
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def shard_for(session_id, n_shards):
+    """
+    The shard that owns `session_id`, by rendezvous (highest random weight) hashing:
+    stable across processes and restarts, and changing the shard count only moves the
+    sessions of the shards that were added or removed.
+    """
+    return max(range(n_shards),
+               key=lambda shard: hashlib.blake2b(f"{shard}:{session_id}".encode(), digest_size=8).digest())
+
+
+class SessionWorlds:
+    """
+    The per-session worlds of one shard. A world is created from `template` on first use
+    (or loaded from `directory` if it was evicted earlier), kept in memory while in use,
+    and written back to `directory` and dropped once idle for `idle_timeout` seconds or
+    when more than `max_worlds` are loaded (least recently used first).
+
+    Session ids come from clients, so saved worlds are bounded too: files not written
+    for `saved_ttl` seconds are deleted, as are the oldest beyond `max_saved` (0 turns
+    either limit off). Reading an unknown session doesn't create a world.
+    """
+    def __init__(self, template, directory="session_worlds", idle_timeout=600.0, max_worlds=1000,
+                 saved_ttl=7 * 86400.0, max_saved=100000, prune_interval=60.0):
+        self.template = template
+        self.directory = directory
+        self.idle_timeout = idle_timeout
+        # The world in use always stays loaded, so at least one
+        self.max_worlds = max(max_worlds, 1)
+        self.saved_ttl = saved_ttl
+        self.max_saved = max_saved
+        self.prune_interval = prune_interval
+        self._worlds = OrderedDict()  # session id -> [NetworkState, last used], least recently used first
+        self._template_snapshot = None
+        self._last_prune = 0.0
+
+        self.created = 0
+        self.loaded = 0
+        self.evicted = 0
+        self.pruned = 0
+        self.cycles = 0
+
+    def _path(self, session_id):
+        # Session ids are client-supplied: hash them instead of using them as file names
+        name = hashlib.blake2b(session_id.encode(), digest_size=16).hexdigest()
+        return os.path.join(self.directory, f"{name}.json")
+
+    def get(self, session_id):
+        """The session's world, loaded or created if it isn't in memory."""
+        entry = self._worlds.get(session_id)
+        if entry is None:
+            path = self._path(session_id)
+            if os.path.exists(path):
+                with open(path) as f:
+                    saved = json.load(f)
+                state = NetworkState.from_dict(saved["state"])
+                state.version = saved["version"]
+                self.loaded += 1
+            else:
+                state = NetworkState.from_dict(self.template)
+                self.created += 1
+            while len(self._worlds) >= self.max_worlds:
+                self.evict(next(iter(self._worlds)))
+            entry = self._worlds[session_id] = [state, 0.0]
+        self._worlds.move_to_end(session_id)
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    def save(self, session_id):
+        state = self._worlds[session_id][0]
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(session_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"session_id": session_id, **state.snapshot()}, f)
+        os.replace(temp_path, path)
+
+    def evict(self, session_id):
+        """Writes the session's world to disk and drops it from memory."""
+        if session_id in self._worlds:
+            self.save(session_id)
+            del self._worlds[session_id]
+            self.evicted += 1
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [session_id for session_id, (_, last_used) in self._worlds.items() if last_used < cutoff]
+        for session_id in idle:
+            self.evict(session_id)
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune_saved()
+            self._last_prune = time.monotonic()
+        return len(idle)
+
+    def prune_saved(self):
+        """Deletes saved worlds older than `saved_ttl` and the oldest beyond `max_saved`."""
+        if not self.saved_ttl and not self.max_saved:
+            return 0
+        try:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in os.scandir(self.directory)
+                       if entry.name.endswith(".json")]
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            print(f"Error listing saved session worlds in {self.directory}: {e}")
+            return 0
+        entries.sort()
+        cutoff = time.time() - self.saved_ttl if self.saved_ttl else None
+        excess = len(entries) - self.max_saved if self.max_saved else 0
+        pruned = 0
+        for position, (mtime, path) in enumerate(entries):
+            if position >= excess and (cutoff is None or mtime >= cutoff):
+                break  # oldest first: everything after this one is kept too
+            try:
+                os.remove(path)
+                pruned += 1
+            except FileNotFoundError:
+                pass  # another shard pruned it first
+        self.pruned += pruned
+        return pruned
+
+    def flush(self):
+        """Writes every loaded world to disk (they stay loaded)."""
+        for session_id in self._worlds:
+            self.save(session_id)
+
+    def run_cycle(self, agent, session_id, recorder=None):
+        """
+        One agent cycle on the session's world; returns the action and the new state snapshot.
+        With a `recorder` (trajectory.TrajectoryRecorder), the transition is recorded.
+        """
+        state = self.get(session_id)
+        action = agent.choose_action(state)
+        if recorder is not None:
+            recorder.record_step(state, action, apply_action)
+        else:
+            apply_action(state, action)
+        self.cycles += 1
+        return {"session_id": session_id, "action": action, **state.snapshot()}
+
+    def snapshot(self, session_id):
+        """
+        The session's world. An unknown session gets the template at version 0, without
+        creating a world for it (only cycles do that).
+        """
+        if session_id not in self._worlds and not os.path.exists(self._path(session_id)):
+            if self._template_snapshot is None:
+                self._template_snapshot = NetworkState.from_dict(self.template).snapshot()
+            return {"session_id": session_id, **self._template_snapshot}
+        return {"session_id": session_id, **self.get(session_id).snapshot()}
+
+    def stats(self):
+        return {
+            "worlds": len(self._worlds),
+            "created": self.created,
+            "loaded": self.loaded,
+            "evicted": self.evicted,
+            "pruned": self.pruned,
+            "cycles": self.cycles,
+        }
+
+
+def _shard_main(conn, template, world_config, model_path, session_config, slot=0):
+    """
+    Shard process: loads its own Agent, then serves cycle / state requests for the
+    sessions routed to it, evicting idle worlds between requests. A "model" request
+    swaps in another model (the parent sends one when the server's active model changes);
+    if it fails to load, the current one is kept. With recording on, transitions go
+    to the `shard-<slot>` subdirectory of DEADLOCK_TRAJECTORY_DIR.
+    """
+    from agent import Agent
+
+    def model_info():
+        return {"model_path": agent.model_path, "model_loaded": agent.has_model()}
+
+    recorder = None
+    try:
+        agent = Agent(model_path, session_config=session_config, inference_workers=0)
+        worlds = SessionWorlds(template, **world_config)
+        recorder = TrajectoryRecorder.from_env(f"shard-{slot}")
+        if recorder:
+            recorder.start()
+        conn.send(("ready", model_info()))
+        check_every = min(max(worlds.idle_timeout / 4, 0.05), 30.0)
+        last_check = time.monotonic()
+        while True:
+            if conn.poll(check_every):
+                message = conn.recv()
+                command = message[0]
+                try:
+                    if command == "cycle":
+                        conn.send(("done", worlds.run_cycle(agent, message[1], recorder)))
+                    elif command == "state":
+                        conn.send(("done", worlds.snapshot(message[1])))
+                    elif command == "stats":
+                        conn.send(("done", {**worlds.stats(), **model_info()}))
+                    elif command == "model":
+                        candidate = Agent(message[1], session_config=session_config, inference_workers=0)
+                        if candidate.has_model() or not agent.has_model():
+                            agent = candidate
+                        conn.send(("done", model_info()))
+                    elif command == "stop":
+                        worlds.flush()
+                        if recorder:
+                            recorder.close()
+                        conn.send(("done", None))
+                        return
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+            if time.monotonic() - last_check >= check_every:
+                worlds.evict_idle()
+                last_check = time.monotonic()
+    except (EOFError, KeyboardInterrupt):
+        if recorder:
+            recorder.close()
+        return
+
+
+class _Shard:
+    """Parent-side handle of one shard process."""
+    def __init__(self, slot):
+        self.slot = slot
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()  # one request at a time per shard
+        self.restarts = 0
+        self.requests = 0
+        self.model_key = None  # the parent's active model the shard was last given
+        self.model = {}  # {"model_path", "model_loaded"} as reported by the shard
+
+
+class WorldShards:
+    """
+    Session-scoped worlds (one per operator: wallet or session id), hash-sharded across
+    `n_workers` processes with `shard_for`, so cycles of sessions on different shards
+    run in parallel on separate cores. Each shard process loads its own Agent and keeps
+    its sessions' worlds (see `SessionWorlds`); all shards share `directory` for evicted
+    worlds, so a session can move to another shard when the worker count changes.
+
+    With `n_workers=0` there is a single in-process shard that uses `agent` (e.g. the
+    server's model registry) and records its cycles with `recorder`, if given; shard
+    processes record to their own recorder (see `_shard_main`). Calls block and are
+    meant to run in a threadpool.
+
+    Shard processes run the active model of `agent` when it is a ModelRegistry (else
+    `model_path`): when it changes (activation, hot swap, background load), each shard
+    is sent the new model before its next request. Candidate routing (A/B, shadow)
+    only applies in-process.
+    """
+    def __init__(self, template, agent=None, n_workers=0, directory="session_worlds", idle_timeout=600.0,
+                 max_worlds=1000, model_path=None, session_config=None, start_timeout=120.0, request_timeout=30.0,
+                 recorder=None, saved_ttl=7 * 86400.0, max_saved=100000):
+        self.template = template
+        self.agent = agent
+        self.recorder = recorder
+        self.n_workers = n_workers
+        self.directory = directory
+        self.idle_timeout = idle_timeout
+        self.max_worlds = max_worlds
+        self.saved_ttl = saved_ttl
+        self.max_saved = max_saved
+        self.model_path = model_path
+        self.session_config = dict(session_config or {})
+        # One intra-op thread per shard unless told otherwise, so N shards don't oversubscribe the cores
+        self.session_config.setdefault("intra_op_threads", 1)
+        self.start_timeout = start_timeout
+        self.request_timeout = request_timeout
+        self._context = mp.get_context("spawn")
+        self._shards = [_Shard(slot) for slot in range(n_workers)]
+        self._local = None
+        self._local_lock = threading.Lock()
+        self._last_idle_check = time.monotonic()
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    @classmethod
+    def from_env(cls, template, agent=None, recorder=None):
+        """Configured by DEADLOCK_SESSION_WORKERS / _DIR / _IDLE_TIMEOUT / _MAX_WORLDS / _SAVED_TTL / _MAX_SAVED."""
+        from ort_session import resolve_session_config
+
+        return cls(
+            template,
+            agent,
+            recorder=recorder,
+            n_workers=int(os.getenv("DEADLOCK_SESSION_WORKERS", "0")),
+            directory=os.getenv("DEADLOCK_SESSION_DIR", "session_worlds"),
+            idle_timeout=float(os.getenv("DEADLOCK_SESSION_IDLE_TIMEOUT", "600")),
+            max_worlds=int(os.getenv("DEADLOCK_SESSION_MAX_WORLDS", "1000")),
+            saved_ttl=float(os.getenv("DEADLOCK_SESSION_SAVED_TTL", str(7 * 86400))),
+            max_saved=int(os.getenv("DEADLOCK_SESSION_MAX_SAVED", "100000")),
+            session_config=resolve_session_config(),
+        )
+
+    # --- Lifecycle ---
+    def start(self):
+        """Creates the in-process shard or starts the shard processes (blocking; concurrent callers wait)."""
+        with self._start_lock:
+            if self._started:
+                return
+            if not self.n_workers:
+                self._local = SessionWorlds(self.template, **self._world_config())
+            else:
+                for shard in self._shards:
+                    self._start(shard)
+                print(f"Started {self.n_workers} session world shards (worlds in {self.directory}).")
+                atexit.register(self.close)
+            self._started = True
+
+    def _world_config(self):
+        return {"directory": self.directory, "idle_timeout": self.idle_timeout, "max_worlds": self.max_worlds,
+                "saved_ttl": self.saved_ttl, "max_saved": self.max_saved}
+
+    def _active_model(self):
+        """
+        (key, path) of the model the shard processes should run: the registry's active
+        model, or `model_path`. The key changes when the model does, including a file
+        reloaded in place.
+        """
+        active = getattr(self.agent, "active", None)
+        if active is None:
+            return self.model_path, self.model_path
+        path = active.agent.model_path
+        # The background-load stand-in has no signature yet; the file's matches the loaded entry's
+        return (path, active.signature or _file_signature(path)), path
+
+    def _start(self, shard):
+        parent_conn, child_conn = self._context.Pipe()
+        shard.conn = parent_conn
+        key, path = self._active_model()
+        shard.process = self._context.Process(
+            target=_shard_main,
+            args=(child_conn, self.template, self._world_config(), path, self.session_config, shard.slot),
+            name=f"world-shard-{shard.slot}",
+            daemon=True,
+        )
+        shard.process.start()
+        child_conn.close()
+        if not parent_conn.poll(self.start_timeout):
+            self._kill(shard)
+            raise RuntimeError(f"World shard {shard.slot} did not start within {self.start_timeout}s")
+        message = parent_conn.recv()
+        if message[0] != "ready":
+            self._kill(shard)
+            raise RuntimeError(f"World shard {shard.slot} failed to start: {message[1]}")
+        shard.model_key, shard.model = key, message[1]
+
+    def _kill(self, shard):
+        if shard.process is not None:
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.process.join(timeout=5)
+        if shard.conn is not None:
+            shard.conn.close()
+        shard.process = None
+        shard.conn = None
+
+    def close(self):
+        """Writes every loaded world to disk and stops the shard processes."""
+        if self._local is not None:
+            with self._local_lock:
+                self._local.flush()
+        for shard in self._shards:
+            with shard.lock:
+                if shard.conn is None:
+                    continue
+                try:
+                    shard.conn.send(("stop",))
+                    shard.conn.poll(self.request_timeout)
+                except (EOFError, OSError):
+                    pass
+                self._kill(shard)
+
+    # --- Requests ---
+    def _request(self, shard, message):
+        """Sends one request to `shard`; a dead or hung shard is restarted (its unsaved worlds are lost)."""
+        with shard.lock:
+            for attempt in (0, 1):
+                try:
+                    if shard.conn is None:
+                        raise OSError(f"World shard {shard.slot} is not running")
+                    self._sync_model(shard)
+                    reply = self._exchange(shard, message, self.request_timeout)
+                    break
+                except (EOFError, OSError, TimeoutError):
+                    if attempt:
+                        raise
+                    print(f"Restarting world shard {shard.slot}.")
+                    self._kill(shard)
+                    shard.restarts += 1
+                    self._start(shard)
+            shard.requests += 1
+        if reply[0] != "done":
+            raise RuntimeError(f"World shard {shard.slot} failed: {reply[1]}")
+        return reply[1]
+
+    def _exchange(self, shard, message, timeout):
+        shard.conn.send(message)
+        if not shard.conn.poll(timeout):
+            raise TimeoutError(f"World shard {shard.slot} timed out")
+        return shard.conn.recv()
+
+    def _sync_model(self, shard):
+        """Sends the shard the active model if it changed since the shard got its last one."""
+        key, path = self._active_model()
+        if key == shard.model_key:
+            return
+        # Loading and warming up takes as long as at startup
+        reply = self._exchange(shard, ("model", path), self.start_timeout)
+        # Not retried on failure: the shard keeps its model until the active one changes again
+        shard.model_key = key
+        if reply[0] == "done":
+            shard.model = reply[1]
+        else:
+            print(f"World shard {shard.slot} could not load {path}: {reply[1]}")
+
+    def _call_local(self, method, *args):
+        with self._local_lock:
+            if time.monotonic() - self._last_idle_check >= min(self.idle_timeout / 4, 30.0):
+                self._local.evict_idle()
+                self._last_idle_check = time.monotonic()
+            return method(*args)
+
+    def shard_of(self, session_id):
+        return shard_for(session_id, self.n_workers) if self.n_workers else 0
+
+    def run_cycle(self, session_id):
+        """Runs one agent cycle on the session's world; returns {"session_id", "action", "version", "state"}."""
+        self.start()
+        if self._local is not None:
+            return self._call_local(self._local.run_cycle, self.agent, session_id, self.recorder)
+        return self._request(self._shards[self.shard_of(session_id)], ("cycle", session_id))
+
+    def snapshot(self, session_id):
+        """The session's world with its version (the template at version 0 for an unknown session)."""
+        self.start()
+        if self._local is not None:
+            return self._call_local(self._local.snapshot, session_id)
+        return self._request(self._shards[self.shard_of(session_id)], ("state", session_id))
+
+    def stats(self):
+        """Per-shard world counters, and the model each shard process runs."""
+        active_path = self._active_model()[1]
+        if self._local is not None:
+            return {"workers": 0, "model_path": active_path, "shards": [self._local.stats()]}
+        shards = []
+        for shard in self._shards:
+            stats = self._request(shard, ("stats",)) if shard.conn is not None else dict(shard.model)
+            stats.update(restarts=shard.restarts, requests=shard.requests)
+            shards.append(stats)
+        return {"workers": self.n_workers, "model_path": active_path, "shards": shards}
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+from state_store import NetworkState
+from persistence import connect, load_snapshot, read_log, replay_log
+
+
+class SharedStateReader:
+    """
+    Follows the network state that server.py persists (see persistence.py) from
+    another process, such as chat_server.py.
+
+    The reader keeps its own `NetworkState` and brings it forward by replaying only
+    the logged operations it hasn't seen, so a request reads a consistent, versioned
+    state without copying the world. It reloads from the latest snapshot only when it
+    has fallen behind the pruned log. Listeners registered with `subscribe()` are
+    called with the new version whenever it moves.
+    """
+    def __init__(self, path, initial_state, poll_interval=0.25):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.initial_state = initial_state
+        self.state = self._initial()
+        self._conn = connect(path)
+        self._data_version = None
+        self._listeners = []
+        self._task = None
+
+    def _initial(self):
+        # Deltas are kept (track_changes stays on) so the chat prompt context can follow
+        # the changes instead of rescanning the world on every version
+        return NetworkState.from_dict(self.initial_state)
+
+    def subscribe(self, callback):
+        """Registers `callback(version)`, called after the state version moves."""
+        self._listeners.append(callback)
+
+    def _fetch(self, version):
+        """
+        Reads what is needed to move on from `version`, in one read transaction.
+        Returns None when nothing was committed since the last check, otherwise
+        (snapshot or None, log entries after it).
+        """
+        # data_version changes only when another connection has committed
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return None
+        try:
+            self._conn.execute("BEGIN")
+            try:
+                entries = read_log(self._conn, version)
+                log_head = self._conn.execute("SELECT MAX(version) FROM log").fetchone()[0] or 0
+                snapshot_head = self._conn.execute("SELECT MAX(version) FROM snapshots").fetchone()[0] or 0
+                # Reload when the log no longer continues from our version (we fell behind
+                # the pruning) or everything is older than us (the writer started over)
+                behind = (entries and entries[0][0] != version + 1) or (not entries and snapshot_head > version)
+                restarted = max(log_head, snapshot_head) < version
+                snapshot = None
+                if behind or restarted:
+                    snapshot = load_snapshot(self._conn) or self._initial()
+                    entries = read_log(self._conn, snapshot.version)
+            finally:
+                self._conn.rollback()
+        except sqlite3.OperationalError:
+            # server.py hasn't created the database yet
+            return None
+        self._data_version = data_version
+        return snapshot, entries
+
+    def _apply(self, fetched):
+        if fetched is None:
+            return False
+        snapshot, entries = fetched
+        version = self.state.version
+        if snapshot is not None:
+            self.state = snapshot
+        replay_log(self.state, entries)
+        if self.state.version == version and snapshot is None:
+            return False
+        for callback in self._listeners:
+            callback(self.state.version)
+        return True
+
+    def refresh(self):
+        """Catches up with the writer synchronously. Returns True if the version moved."""
+        return self._apply(self._fetch(self.state.version))
+
+    async def watch(self):
+        """Polls for new commits every `poll_interval` seconds, reading the database off the event loop."""
+        while True:
+            try:
+                fetched = await asyncio.to_thread(self._fetch, self.state.version)
+                # Applied on the event loop, so request handlers never see a half-replayed state
+                self._apply(fetched)
+            except Exception as e:
+                print(f"Error following shared network state: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """Starts `watch()` on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._conn.close()
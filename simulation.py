@@ -0,0 +1,162 @@
+import math
+import time
+
+
+def apply_action(state, action):
+    """
+    Applies an agent action to a `NetworkState` (accept / complete / analyze / idle),
+    adds the resulting line to the state's log, commits the change set and returns the line.
+    """
+    action_type = action.get("action")
+    log_message = f"Agent action: {action_type}"
+
+    if action_type == "accept_mission":
+        i = state.mission_index.get(action.get("mission_id"))
+        if i is not None and state.mission_status_of(i) == "available":
+            title = state.mission_titles[i]
+            cost = state.mission_cost_of(i)
+            if state.resources >= cost:
+                state.set_mission_status(i, "in_progress")
+                state.resources -= cost
+                log_message += f" - Mission '{title}' accepted. Cost: {cost}"
+            else:
+                log_message += f" - Failed to accept '{title}'. Insufficient resources."
+    elif action_type == "complete_mission":
+        i = state.mission_index.get(action.get("mission_id"))
+        if i is not None and state.mission_status_of(i) == "in_progress":
+            reward = state.mission_reward_of(i)
+            state.set_mission_status(i, "completed")
+            state.resources += reward
+            log_message += f" - Mission '{state.mission_titles[i]}' completed. Reward: {reward}"
+    elif action_type == "analyze_data":
+        i = state.haven_index.get(action.get("data_id"))
+        if i is not None and not state.haven_analyzed[i]:
+            value = state.haven_value_of(i)
+            state.set_analyzed(i)
+            state.resources += value
+            log_message += f" - Data '{state.haven_names[i]}' analyzed. Value: {value}"
+    else: # idle
+        log_message = "Agent is idle. No available actions."
+
+    state.push_log(log_message)
+    state.commit()
+    return log_message
+
+
+# Field types of webhook-delivered entities: everything but "id" is optional
+ENTITY_FIELDS = {
+    "missions": {"title": str, "status": str, "reward": float, "cost": float},
+    "data_havens": {"name": str, "analyzed": bool, "value": float},
+}
+
+
+def valid_entity(entry, kind):
+    """
+    True if `entry` is a well-formed "missions" / "data_havens" entity: a string id,
+    string names and statuses, a bool `analyzed` and finite numbers (bools aren't numbers).
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get("id"), str):
+        return False
+    for field, expected in ENTITY_FIELDS[kind].items():
+        if field not in entry:
+            continue
+        value = entry[field]
+        if expected is float:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                return False
+        elif not isinstance(value, expected):
+            return False
+    return True
+
+
+def apply_updates(state, updates):
+    """
+    Adds the new missions and data havens in `updates` (a dict with "missions" and/or
+    "data_havens" lists, as delivered by webhooks) to a `NetworkState`. Ids already in the
+    state (or earlier in `updates`) are skipped. Logs one summary line, commits one version
+    and returns the line; returns None without touching the state when nothing is new.
+    Raises ValueError before changing anything if any entry is malformed (see `valid_entity`).
+    """
+    new = {}
+    for kind, index in (("missions", state.mission_index), ("data_havens", state.haven_index)):
+        entries = {}
+        for entry in updates.get(kind, ()):
+            if not valid_entity(entry, kind):
+                raise ValueError(f"Malformed {kind} entry: {entry!r}")
+            if entry["id"] not in index:
+                entries.setdefault(entry["id"], entry)
+        new[kind] = list(entries.values())
+    if not new["missions"] and not new["data_havens"]:
+        return None
+
+    for mission in new["missions"]:
+        state.add_mission(mission)
+    for haven in new["data_havens"]:
+        state.add_data_haven(haven)
+
+    log_message = f"Network update: {len(new['missions'])} new missions, {len(new['data_havens'])} new data havens."
+    state.push_log(log_message)
+    state.commit()
+    return log_message
+
+
+class SimulationEngine:
+    """
+    Runs agent cycles headless over many independent worlds in-process.
+
+    Every world starts as a copy of `template` (a `NetworkState`). Each step makes one
+    batched `agent.choose_actions` call across all worlds that still have work to do,
+    then applies the chosen actions with `apply_action`.
+    """
+    def __init__(self, agent, template, n_worlds=1):
+        self.agent = agent
+        self.worlds = [template.copy() for _ in range(n_worlds)]
+        for world in self.worlds:
+            # Nobody streams simulated worlds, so skip recording their deltas
+            world.track_changes = False
+        self.idle = [False] * n_worlds
+        self.steps = 0
+
+    def step(self):
+        """Advances every non-idle world by one cycle. Returns the number of world steps taken."""
+        active = [i for i, idle in enumerate(self.idle) if not idle]
+        if not active:
+            return 0
+        actions = self.agent.choose_actions([self.worlds[i] for i in active])
+        for i, action in zip(active, actions):
+            apply_action(self.worlds[i], action)
+            if action.get("action") == "idle":
+                self.idle[i] = True
+        self.steps += len(active)
+        return len(active)
+
+    def run(self, n_cycles, stop_when_idle=True):
+        """
+        Runs up to `n_cycles` cycles and returns a report with throughput
+        (world steps per second) and the resulting resource distribution.
+        """
+        started = time.perf_counter()
+        cycles = 0
+        steps = 0
+        for _ in range(n_cycles):
+            taken = self.step()
+            if taken == 0 and stop_when_idle:
+                break
+            cycles += 1
+            steps += taken
+        elapsed = time.perf_counter() - started
+
+        resources = [world.resources for world in self.worlds]
+        return {
+            "worlds": len(self.worlds),
+            "cycles": cycles,
+            "steps": steps,
+            "seconds": elapsed,
+            "steps_per_sec": steps / elapsed if elapsed > 0 else 0.0,
+            "idle_worlds": sum(self.idle),
+            "resources": {
+                "min": min(resources) if resources else 0,
+                "mean": sum(resources) / len(resources) if resources else 0,
+                "max": max(resources) if resources else 0,
+            },
+        }
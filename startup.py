@@ -0,0 +1,76 @@
+import threading
+import time
+
+
+class StartupReport:
+    """
+    Where a server's boot time goes: named phases (imports, state setup, model load,
+    LLM client, ...) in milliseconds, measured from when the report was created (first
+    thing in the server module), plus when the server started serving and became ready.
+    Phases can run in background threads; `ready` is set once all of `required` are done.
+    """
+    def __init__(self, required=()):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.required = set(required)
+        self.serving_ms = None
+        self.ready_ms = None
+        self.ready = threading.Event()
+        self._last = self.started
+        self._lock = threading.Lock()
+
+    def _elapsed_ms(self, since=None):
+        return (time.perf_counter() - (self.started if since is None else since)) * 1000
+
+    def expect(self, phase):
+        """Adds `phase` to the phases that have to finish before the server is ready."""
+        with self._lock:
+            if phase not in self.phases:
+                self.required.add(phase)
+
+    def mark(self, phase):
+        """Records the time since the previous mark as `phase` (for sequential module-level setup)."""
+        now = time.perf_counter()
+        with self._lock:
+            self.phases[phase] = (now - self._last) * 1000
+            self._last = now
+
+    def run(self, phase, fn, *args):
+        """Runs `fn(*args)` and records its duration as `phase`; the phase counts as done even if it fails."""
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.phases[phase] = self._elapsed_ms(started)
+            self.done(phase)
+
+    def run_in_background(self, phase, fn, *args):
+        thread = threading.Thread(target=self.run, args=(phase, fn) + args, name=f"startup-{phase}", daemon=True)
+        thread.start()
+        return thread
+
+    def serving(self):
+        """Called once the server accepts requests."""
+        self.serving_ms = self._elapsed_ms()
+        self.done(None)
+
+    def done(self, phase):
+        with self._lock:
+            self.required.discard(phase)
+            if self.required or self.serving_ms is None or self.ready.is_set():
+                return
+            self.ready_ms = self._elapsed_ms()
+            self.ready.set()
+        print(f"Startup: serving after {self.serving_ms:.0f} ms, ready after {self.ready_ms:.0f} ms ("
+              + ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.phases.items()) + ").")
+
+    def summary(self):
+        with self._lock:
+            return {
+                "ready": self.ready.is_set(),
+                "pending": sorted(self.required),
+                "serving_ms": self.serving_ms,
+                "ready_ms": self.ready_ms,
+                "phases_ms": dict(self.phases),
+            }
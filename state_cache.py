@@ -0,0 +1,98 @@
+import gzip
+import json
+import uuid
+from fastapi import Response
+
+# Optional faster encoders; the standard library is used when they aren't installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Distinguishes versions across restarts, since versions start again at 0
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def dumps(obj):
+    """Encodes `obj` to compact JSON bytes, with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+class EncodedStateCache:
+    """
+    Caches the encoded JSON body of a versioned state, so polls that find the version
+    unchanged reuse the same bytes instead of re-serializing.
+
+    `response()` answers `If-None-Match` with 304 Not Modified, and serves a gzip or
+    brotli body (compressed once per version) when the client accepts it and the body
+    is at least `min_compress_size` bytes.
+    """
+    def __init__(self, min_compress_size=1024, compress_level=6):
+        self.min_compress_size = min_compress_size
+        self.compress_level = compress_level
+        self.version = None
+        self.etag = None
+        self.bodies = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _load(self, version, build):
+        if version != self.version:
+            self.misses += 1
+            self.bodies = {"identity": dumps(build())}
+            self.version = version
+            self.etag = f'W/"{BOOT_ID}-{version}"'
+        else:
+            self.hits += 1
+
+    def _body(self, encoding):
+        body = self.bodies.get(encoding)
+        if body is None:
+            raw = self.bodies["identity"]
+            if encoding == "br":
+                body = brotli.compress(raw, quality=min(self.compress_level, 11))
+            else:
+                body = gzip.compress(raw, compresslevel=self.compress_level)
+            self.bodies[encoding] = body
+        return body
+
+    def _pick_encoding(self, accept_encoding):
+        if len(self.bodies["identity"]) < self.min_compress_size:
+            return "identity"
+        accepted = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return "identity"
+
+    def response(self, request, version, build):
+        """
+        Returns the response for `version`, calling `build()` for the payload only
+        when that version hasn't been encoded yet.
+        """
+        self._load(version, build)
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            if "*" in tags or self.etag in tags or self.etag[2:] in tags:
+                self.not_modified += 1
+                return Response(status_code=304, headers=headers)
+
+        encoding = self._pick_encoding(request.headers.get("accept-encoding", ""))
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=self._body(encoding), media_type="application/json", headers=headers)
+
+    def stats(self):
+        return {"version": self.version, "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified}
@@ -0,0 +1,464 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+import math
+import numpy as np
+
+MISSION_FIELDS = ("id", "title", "status", "reward", "cost")
+DATA_HAVEN_FIELDS = ("id", "name", "analyzed", "value")
+LOG_LIMIT = 10
+HISTORY_LIMIT = 256  # deltas kept for clients resuming from an older version
+FEATURE_SCAN_BLOCK = 1024  # missions checked at a time by feature_texts()
+
+
+def _json_number(value):
+    """Converts a column value back to a plain int (or float) for JSON."""
+    value = value.item()
+    return int(value) if value.is_integer() else value
+
+
+class ActionIndex:
+    """
+    The agent's available actions, kept up to date transition by transition instead of
+    being recomputed from the mission and data haven lists on every cycle.
+
+    Each action group is a sorted index list with the action dicts alongside it, so a
+    transition is one bisect and one insert/delete. Available missions are also kept
+    sorted by (cost, index): the affordable ones are the prefix up to a bisect on the
+    resources, and a resource change only moves the missions whose cost it crosses.
+    The order is the one the Q-network output slots map to: complete in-progress missions,
+    accept affordable available missions, analyze data, each in list (index) order.
+    """
+    def __init__(self):
+        self.in_progress, self.complete_actions = [], []
+        self.affordable, self.accept_actions = [], []
+        self.unanalyzed, self.analyze_actions = [], []
+        self.available = []  # (cost, mission index), ascending
+        self.resources = 0  # the level `affordable` currently reflects
+        self._affordable_count = 0  # available[:_affordable_count] are the affordable missions
+        self._mission_ids = {}  # available mission index -> id, for missions becoming affordable
+
+    def copy(self):
+        clone = ActionIndex()
+        for name in ("in_progress", "complete_actions", "affordable", "accept_actions",
+                     "unanalyzed", "analyze_actions", "available"):
+            setattr(clone, name, list(getattr(self, name)))
+        clone.resources = self.resources
+        clone._affordable_count = self._affordable_count
+        clone._mission_ids = dict(self._mission_ids)
+        return clone
+
+    @staticmethod
+    def _insert(indices, actions, index, action):
+        i = bisect_left(indices, index)
+        if i == len(indices) or indices[i] != index:
+            indices.insert(i, index)
+            actions.insert(i, action)
+
+    @staticmethod
+    def _delete(indices, actions, index):
+        i = bisect_left(indices, index)
+        if i < len(indices) and indices[i] == index:
+            del indices[i]
+            del actions[i]
+
+    def mission_moved(self, index, mission_id, cost, old_status, new_status):
+        """Moves mission `index` from `old_status` (None for a new mission) to `new_status`."""
+        cost = float(cost) if cost == cost else math.inf  # a NaN cost is never affordable
+        if old_status == "in_progress":
+            self._delete(self.in_progress, self.complete_actions, index)
+        elif old_status == "available":
+            i = bisect_left(self.available, (cost, index))
+            if i < len(self.available) and self.available[i] == (cost, index):
+                del self.available[i]
+                del self._mission_ids[index]
+                if i < self._affordable_count:
+                    self._affordable_count -= 1
+                    self._delete(self.affordable, self.accept_actions, index)
+        if new_status == "in_progress":
+            self._insert(self.in_progress, self.complete_actions, index,
+                         {"action": "complete_mission", "mission_id": mission_id})
+        elif new_status == "available":
+            insort(self.available, (cost, index))
+            self._mission_ids[index] = mission_id
+            if cost <= self.resources:
+                self._affordable_count += 1
+                self._insert(self.affordable, self.accept_actions, index,
+                             {"action": "accept_mission", "mission_id": mission_id})
+
+    def haven_moved(self, index, haven_id, analyzed):
+        if analyzed:
+            self._delete(self.unanalyzed, self.analyze_actions, index)
+        else:
+            self._insert(self.unanalyzed, self.analyze_actions, index, {"action": "analyze_data", "data_id": haven_id})
+
+    def set_resources(self, resources):
+        """Moves the missions whose cost lies between the old and new level in or out of `affordable`."""
+        if resources == self.resources:
+            return
+        count = bisect_right(self.available, (resources, math.inf))
+        if abs(count - self._affordable_count) > len(self.affordable) // 8 + 64:
+            # Large swings (e.g. the first call on a freshly built store): re-sort the prefix once
+            self.affordable = sorted(index for _, index in self.available[:count])
+            self.accept_actions = [{"action": "accept_mission", "mission_id": self._mission_ids[index]}
+                                   for index in self.affordable]
+        else:
+            for _, index in self.available[self._affordable_count:count]:
+                self._insert(self.affordable, self.accept_actions, index,
+                             {"action": "accept_mission", "mission_id": self._mission_ids[index]})
+            for _, index in self.available[count:self._affordable_count]:
+                self._delete(self.affordable, self.accept_actions, index)
+        self._affordable_count = count
+        self.resources = resources
+
+    def actions(self, resources):
+        """The action list at `resources`; the dicts are shared, so treat them as read-only."""
+        self.set_resources(resources)
+        return self.complete_actions + self.accept_actions + self.analyze_actions
+
+    def count(self, resources):
+        """The number of available actions at `resources`, without building the list."""
+        self.set_resources(resources)
+        return len(self.in_progress) + len(self.affordable) + len(self.unanalyzed)
+
+    def position(self, action_type, index, resources):
+        """The slot in `actions(resources)` of the `action_type` action on entity `index`, or None."""
+        self.set_resources(resources)
+        offset = 0
+        for name, indices in (("complete_mission", self.in_progress), ("accept_mission", self.affordable),
+                              ("analyze_data", self.unanalyzed)):
+            if name == action_type:
+                i = bisect_left(indices, index)
+                return offset + i if i < len(indices) and indices[i] == index else None
+            offset += len(indices)
+        return None
+
+
+class NetworkState:
+    """
+    Indexed, structure-of-arrays store for the DEADLOCK NETWORK state.
+
+    Missions and data havens are kept as column arrays (status, cost, reward, value,
+    analyzed) with id -> index maps, so looking up an entity is O(1). Per-status index
+    sets ("in_progress missions", "unanalyzed havens", ...) and the `ActionIndex` are
+    updated on every transition, so the available actions never require rescanning every list.
+    `to_dict()` serializes back to the same JSON shape as the original `network_state` dict.
+
+    Every `commit()` bumps a monotonic `version` and, when `track_changes` is on, records
+    what changed since the previous commit (entity fields, resources, new log lines)
+    as a delta, so clients can follow the state without re-fetching all of it.
+    """
+    def __init__(self, capacity=16):
+        # --- Missions ---
+        self.mission_ids = []
+        self.mission_titles = []
+        self.mission_status = np.zeros(capacity, dtype=np.int16)
+        self.mission_cost = np.zeros(capacity, dtype=np.float64)
+        self.mission_reward = np.zeros(capacity, dtype=np.float64)
+        self.mission_extra = {}  # index -> fields outside MISSION_FIELDS
+        self.mission_index = {}
+        self.status_names = []
+        self.status_codes = {}
+        self.missions_by_status = {}
+
+        # --- Data havens ---
+        self.haven_ids = []
+        self.haven_names = []
+        self.haven_analyzed = np.zeros(capacity, dtype=bool)
+        self.haven_value = np.zeros(capacity, dtype=np.float64)
+        self.haven_extra = {}
+        self.haven_index = {}
+        self.unanalyzed_havens = set()
+        self.action_index = ActionIndex()
+
+        self.agents = []
+        self.log = []
+        self.resources = 0
+
+        # --- Versioning / change tracking ---
+        self.version = 0
+        self.track_changes = True
+        self.history = deque(maxlen=HISTORY_LIMIT)
+        self._changes = {}
+        self._committed_resources = 0
+
+        for status in ("available", "in_progress", "completed"):
+            self.status_code(status)
+
+    @classmethod
+    def from_dict(cls, state):
+        """Builds a store from a `network_state`-shaped dict."""
+        missions = state.get("missions", [])
+        havens = state.get("data_havens", [])
+        store = cls(capacity=max(len(missions), len(havens), 16))
+        for mission in missions:
+            store.add_mission(mission)
+        for haven in havens:
+            store.add_data_haven(haven)
+        store.agents = [dict(agent) for agent in state.get("agents", [])]
+        store.log = list(state.get("log", []))
+        store.resources = state.get("resources", 0)
+        # Building the store isn't a change clients need to replay
+        store._changes = {}
+        store._committed_resources = store.resources
+        return store
+
+    def copy(self):
+        """Returns an independent copy of the store (columns, indices, log and agents)."""
+        clone = NetworkState.__new__(NetworkState)
+        clone.mission_ids = list(self.mission_ids)
+        clone.mission_titles = list(self.mission_titles)
+        clone.mission_status = self.mission_status.copy()
+        clone.mission_cost = self.mission_cost.copy()
+        clone.mission_reward = self.mission_reward.copy()
+        clone.mission_extra = {i: dict(extra) for i, extra in self.mission_extra.items()}
+        clone.mission_index = dict(self.mission_index)
+        clone.status_names = list(self.status_names)
+        clone.status_codes = dict(self.status_codes)
+        clone.missions_by_status = {code: set(indices) for code, indices in self.missions_by_status.items()}
+        clone.haven_ids = list(self.haven_ids)
+        clone.haven_names = list(self.haven_names)
+        clone.haven_analyzed = self.haven_analyzed.copy()
+        clone.haven_value = self.haven_value.copy()
+        clone.haven_extra = {i: dict(extra) for i, extra in self.haven_extra.items()}
+        clone.haven_index = dict(self.haven_index)
+        clone.unanalyzed_havens = set(self.unanalyzed_havens)
+        clone.action_index = self.action_index.copy()
+        clone.agents = [dict(agent) for agent in self.agents]
+        clone.log = list(self.log)
+        clone.resources = self.resources
+        clone.version = self.version
+        clone.track_changes = self.track_changes
+        clone.history = deque(maxlen=HISTORY_LIMIT)
+        clone._changes = {}
+        clone._committed_resources = self.resources
+        return clone
+
+    # --- Building ---
+    def status_code(self, status):
+        """Returns the integer code for a mission status, registering new statuses on first use."""
+        code = self.status_codes.get(status)
+        if code is None:
+            code = len(self.status_names)
+            self.status_names.append(status)
+            self.status_codes[status] = code
+            self.missions_by_status[code] = set()
+        return code
+
+    @staticmethod
+    def _grow(column, size):
+        if size <= len(column):
+            return column
+        grown = np.zeros(max(size, 2 * len(column)), dtype=column.dtype)
+        grown[:len(column)] = column
+        return grown
+
+    def add_mission(self, mission):
+        """Appends a mission dict. Raises ValueError if its id is already present."""
+        mission_id = mission["id"]
+        if mission_id in self.mission_index:
+            raise ValueError(f"Duplicate mission id: {mission_id}")
+        index = len(self.mission_ids)
+        self.mission_status = self._grow(self.mission_status, index + 1)
+        self.mission_cost = self._grow(self.mission_cost, index + 1)
+        self.mission_reward = self._grow(self.mission_reward, index + 1)
+
+        code = self.status_code(mission.get("status", "available"))
+        self.mission_ids.append(mission_id)
+        self.mission_titles.append(mission.get("title", ""))
+        self.mission_status[index] = code
+        self.mission_cost[index] = mission.get("cost", 0)
+        self.mission_reward[index] = mission.get("reward", 0)
+        extra = {k: v for k, v in mission.items() if k not in MISSION_FIELDS}
+        if extra:
+            self.mission_extra[index] = extra
+        self.mission_index[mission_id] = index
+        self.missions_by_status[code].add(index)
+        self.action_index.mission_moved(index, mission_id, self.mission_cost[index], None, self.status_names[code])
+        if self.track_changes:
+            self._record("missions", mission_id, self.mission_dict(index))
+        return index
+
+    def add_data_haven(self, haven):
+        """Appends a data haven dict. Raises ValueError if its id is already present."""
+        haven_id = haven["id"]
+        if haven_id in self.haven_index:
+            raise ValueError(f"Duplicate data haven id: {haven_id}")
+        index = len(self.haven_ids)
+        self.haven_analyzed = self._grow(self.haven_analyzed, index + 1)
+        self.haven_value = self._grow(self.haven_value, index + 1)
+
+        self.haven_ids.append(haven_id)
+        self.haven_names.append(haven.get("name", ""))
+        self.haven_analyzed[index] = bool(haven.get("analyzed", False))
+        self.haven_value[index] = haven.get("value", 0)
+        extra = {k: v for k, v in haven.items() if k not in DATA_HAVEN_FIELDS}
+        if extra:
+            self.haven_extra[index] = extra
+        self.haven_index[haven_id] = index
+        if not self.haven_analyzed[index]:
+            self.unanalyzed_havens.add(index)
+            self.action_index.haven_moved(index, haven_id, False)
+        if self.track_changes:
+            self._record("data_havens", haven_id, self.data_haven_dict(index))
+        return index
+
+    # --- Lookups ---
+    def mission_status_of(self, index):
+        return self.status_names[self.mission_status[index]]
+
+    def mission_cost_of(self, index):
+        return _json_number(self.mission_cost[index])
+
+    def mission_reward_of(self, index):
+        return _json_number(self.mission_reward[index])
+
+    def haven_value_of(self, index):
+        return _json_number(self.haven_value[index])
+
+    def missions_with_status(self, status):
+        """Sorted indices of the missions currently in `status`."""
+        code = self.status_codes.get(status)
+        return sorted(self.missions_by_status[code]) if code is not None else []
+
+    # --- Transitions ---
+    def set_mission_status(self, index, status):
+        code = self.status_code(status)
+        old = self.mission_status[index]
+        if old != code:
+            self.missions_by_status[old].discard(index)
+            self.missions_by_status[code].add(index)
+            self.mission_status[index] = code
+            self.action_index.mission_moved(index, self.mission_ids[index], self.mission_cost[index],
+                                            self.status_names[old], status)
+            if self.track_changes:
+                self._record("missions", self.mission_ids[index], {"status": status})
+
+    def set_analyzed(self, index, analyzed=True):
+        self.haven_analyzed[index] = analyzed
+        if analyzed:
+            self.unanalyzed_havens.discard(index)
+        else:
+            self.unanalyzed_havens.add(index)
+        self.action_index.haven_moved(index, self.haven_ids[index], analyzed)
+        if self.track_changes:
+            self._record("data_havens", self.haven_ids[index], {"analyzed": bool(analyzed)})
+
+    def push_log(self, message):
+        """Adds a log line at the top, keeping the log from growing too large."""
+        self.log.insert(0, message)
+        if len(self.log) > LOG_LIMIT:
+            self.log.pop()
+        if self.track_changes:
+            self._changes.setdefault("log", []).append(message)
+
+    # --- Versioning ---
+    def _record(self, kind, entity_id, fields):
+        self._changes.setdefault(kind, {}).setdefault(entity_id, {}).update(fields)
+
+    def commit(self):
+        """
+        Closes the current change set: bumps `version` and, when tracking changes,
+        appends the delta to `history`. Returns the delta (None when not tracking).
+        """
+        self.version += 1
+        delta = None
+        if self.track_changes:
+            delta = {"version": self.version}
+            delta.update(self._changes)
+            if self.resources != self._committed_resources:
+                delta["resources"] = self.resources
+                delta["resources_delta"] = self.resources - self._committed_resources
+            self.history.append(delta)
+        self._changes = {}
+        self._committed_resources = self.resources
+        return delta
+
+    def deltas_since(self, version):
+        """
+        Deltas needed to bring a client at `version` up to date, oldest first,
+        or None if that version is no longer in `history` (the client needs a snapshot).
+        """
+        if version == self.version:
+            return []
+        if version > self.version or not self.history or version < self.history[0]["version"] - 1:
+            return None
+        start = version - (self.history[0]["version"] - 1)
+        return list(self.history)[start:]
+
+    def snapshot(self):
+        """The full state together with the version it corresponds to."""
+        return {"version": self.version, "state": self.to_dict()}
+
+    # --- Agent views ---
+    def available_actions(self):
+        """
+        Same actions, in the same order, as `Agent.get_available_actions` on the dict form:
+        complete in-progress missions, accept affordable available missions, analyze data.
+        Served from the incrementally maintained `action_index`.
+        """
+        return self.action_index.actions(self.resources)
+
+    def action_position(self, action):
+        """
+        The position of `action` in `available_actions()` (the Q-network output slot it
+        was chosen from), or None for idle and unavailable actions. O(log n).
+        """
+        action_type = action.get("action")
+        if action_type == "analyze_data":
+            index = self.haven_index.get(action.get("data_id"))
+        else:
+            index = self.mission_index.get(action.get("mission_id"))
+        if index is None:
+            return None
+        return self.action_index.position(action_type, index, self.resources)
+
+    def action_count(self):
+        return self.action_index.count(self.resources)
+
+    def feature_texts(self):
+        """
+        Yields the entity names the featurizer encodes: available/in-progress mission
+        titles, then unanalyzed data haven names, in list order.
+        """
+        count = len(self.mission_ids)
+        available, in_progress = self.status_codes["available"], self.status_codes["in_progress"]
+        # Scanned in blocks: the featurizer stops once its vector is full, usually within the first one
+        for start in range(0, count, FEATURE_SCAN_BLOCK):
+            block = self.mission_status[start:min(start + FEATURE_SCAN_BLOCK, count)]
+            for i in np.flatnonzero((block == available) | (block == in_progress)):
+                yield self.mission_titles[start + i]
+        # The action index keeps the unanalyzed havens sorted already
+        for i in self.action_index.unanalyzed:
+            yield self.haven_names[i]
+
+    # --- Serialization ---
+    def mission_dict(self, index):
+        mission = {
+            "id": self.mission_ids[index],
+            "title": self.mission_titles[index],
+            "status": self.mission_status_of(index),
+            "reward": self.mission_reward_of(index),
+            "cost": self.mission_cost_of(index),
+        }
+        mission.update(self.mission_extra.get(index, ()))
+        return mission
+
+    def data_haven_dict(self, index):
+        haven = {
+            "id": self.haven_ids[index],
+            "name": self.haven_names[index],
+            "analyzed": bool(self.haven_analyzed[index]),
+            "value": self.haven_value_of(index),
+        }
+        haven.update(self.haven_extra.get(index, ()))
+        return haven
+
+    def to_dict(self):
+        """Serializes to the original `network_state` JSON shape."""
+        return {
+            "missions": [self.mission_dict(i) for i in range(len(self.mission_ids))],
+            "data_havens": [self.data_haven_dict(i) for i in range(len(self.haven_ids))],
+            "agents": self.agents,
+            "log": self.log,
+            "resources": self.resources,
+        }
@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+
+def format_sse(event, data, event_id=None):
+    """Formats one Server-Sent Events message."""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {data}\n\n"
+
+
+class StateBroadcaster:
+    """
+    Pushes `NetworkState` changes to Server-Sent Events subscribers.
+
+    A subscriber starting from a version still in the state's history gets only the
+    deltas after it; anyone else (new clients, clients that fell too far behind)
+    gets one full snapshot first. Each message carries the state version as its SSE id,
+    so a reconnecting EventSource resumes from `Last-Event-ID` automatically.
+    Encoded deltas are shared between subscribers, so each is serialized once.
+    """
+    def __init__(self, state, keepalive=15.0):
+        self.state = state
+        self.keepalive = keepalive
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._encoded = {}  # version -> encoded delta
+
+    def notify(self):
+        """Wakes every subscriber after the state has been committed. Call on the event loop."""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _encode_delta(self, delta):
+        version = delta["version"]
+        encoded = self._encoded.get(version)
+        if encoded is None:
+            encoded = format_sse("delta", json.dumps(delta), version)
+            if len(self._encoded) >= self.state.history.maxlen:
+                # Deltas older than the history window are never requested again
+                oldest = self.state.history[0]["version"]
+                self._encoded = {v: e for v, e in self._encoded.items() if v >= oldest}
+            self._encoded[version] = encoded
+        return encoded
+
+    def _catch_up(self, version):
+        """Messages that bring a subscriber at `version` to the current version."""
+        deltas = self.state.deltas_since(version) if version is not None else None
+        if deltas is None:
+            snapshot = self.state.snapshot()
+            return [format_sse("snapshot", json.dumps(snapshot), snapshot["version"])]
+        return [self._encode_delta(delta) for delta in deltas]
+
+    async def stream(self, since=None, is_disconnected=None):
+        """
+        Async generator of SSE messages for one subscriber, starting after version `since`.
+        Stops when `is_disconnected()` (e.g. `request.is_disconnected`) returns True.
+        """
+        self.subscribers += 1
+        try:
+            version = since
+            while True:
+                changed = self._changed
+                if version != self.state.version:
+                    for message in self._catch_up(version):
+                        yield message
+                    version = self.state.version
+                    continue
+                try:
+                    await asyncio.wait_for(changed.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+                    yield ": keepalive\n\n"
+        finally:
+            self.subscribers -= 1
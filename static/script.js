@@ -220,7 +220,8 @@ document.addEventListener('DOMContentLoaded', () => {
             runAgentCycleBtn.disabled = true;
             runAgentCycleBtn.textContent = 'Running...';
             const newState = await API.runAgentCycle();
-            updateUI(newState);
+            // With an open stream, the cycle's delta arrives through it instead
+            if (!(stateStream && stateStream.readyState === EventSource.OPEN)) updateUI(newState);
         } catch (error) {
             console.error('Error running agent cycle:', error);
             logOutput.innerHTML = `<p class="error">Error running agent cycle: ${error.message}</p>`;
@@ -274,6 +275,52 @@ document.addEventListener('DOMContentLoaded', () => {
 
     initialize();
 
+    // --- Live State Stream ---
+    // Subscribes to /api/stream (Server-Sent Events): one snapshot, then per-cycle deltas
+    // with only the changed fields. EventSource resumes from the last version on reconnect.
+    let stateStream = null;
+    let currentState = null;
+
+    function applyDelta(state, delta) {
+        ['missions', 'data_havens'].forEach(kind => {
+            const changes = delta[kind];
+            if (!changes) return;
+            Object.entries(changes).forEach(([id, fields]) => {
+                const entity = state[kind].find(e => e.id === id);
+                if (entity) {
+                    Object.assign(entity, fields);
+                } else {
+                    state[kind].push({ id, ...fields });
+                }
+            });
+        });
+        if (delta.resources !== undefined) state.resources = delta.resources;
+        if (delta.log) {
+            // Delta log lines are oldest first; the log shows newest first
+            state.log = delta.log.slice().reverse().concat(state.log).slice(0, 10);
+        }
+    }
+
+    function subscribeToState() {
+        if (!window.EventSource) return;
+        stateStream = new EventSource(`${BASE_AGENT_API_URL}/api/stream`);
+        stateStream.addEventListener('snapshot', (event) => {
+            currentState = JSON.parse(event.data).state;
+            updateUI(currentState);
+        });
+        stateStream.addEventListener('delta', (event) => {
+            if (!currentState) return;
+            applyDelta(currentState, JSON.parse(event.data));
+            updateUI(currentState);
+        });
+        stateStream.onerror = () => {
+            // Servers without /api/stream: go back to request/response updates
+            if (stateStream.readyState === EventSource.CLOSED) stateStream = null;
+        };
+    }
+
+    subscribeToState();
+
     // --- Matrix Effect ---
     const canvas = document.getElementById('matrixCanvas');
     const ctx = canvas.getContext('2d');
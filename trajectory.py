@@ -0,0 +1,364 @@
+"""
+Recording of agent transitions for retraining the Q-network on production behavior.
+
+`TrajectoryRecorder` appends (featurized state, action index, reward, next state, done)
+rows to column files on disk. Each chunk directory holds one preallocated `.npy` file
+per column, written through a memory map, and a `meta.json` with the number of valid
+rows. A full chunk is closed and the next one started. The request path only copies
+a row into an in-memory staging buffer. A background thread moves the staged rows into
+the memory maps, syncs them and then updates `meta.json`, so readers never see rows
+that aren't on disk.
+
+`TrajectoryReader` opens the chunks read-only as memory maps. `iter_batches()` yields
+views into them without copying. `sample()` gathers random rows for replay-buffer
+training, reading only the sampled rows.
+
+The layout of one chunk (`<directory>/chunk-000000/`):
+    state.npy       float32 (rows, state_size)  featurized state the action was chosen in
+    action.npy      int32 (rows,)               output slot of the chosen action (-1: idle)
+    reward.npy      float32 (rows,)             change in resources
+    next_state.npy  float32 (rows, state_size)  featurized state after the transition
+    done.npy        bool (rows,)                no actions were available afterwards
+    meta.json       {"rows", "capacity", "state_size", "complete"}
+"""
+import atexit
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from featurizer import StateFeaturizer
+
+CHUNK_PREFIX = "chunk-"
+COLUMNS = ("state", "action", "reward", "next_state", "done")
+
+
+def column_specs(state_size):
+    """Column name -> (dtype, per-row shape)."""
+    return {
+        "state": (np.float32, (state_size,)),
+        "action": (np.int32, ()),
+        "reward": (np.float32, ()),
+        "next_state": (np.float32, (state_size,)),
+        "done": (np.bool_, ()),
+    }
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _chunk_dirs(directory):
+    """The chunk directories directly in `directory`, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.startswith(CHUNK_PREFIX))
+
+
+class _Chunk:
+    """One chunk being written: its column memory maps and valid row count."""
+    def __init__(self, path, capacity, state_size, rows=0, create=True):
+        self.path = path
+        self.capacity = capacity
+        self.state_size = state_size
+        self.rows = rows
+        mode = "w+" if create else "r+"
+        if create:
+            os.makedirs(path, exist_ok=True)
+        self.columns = {
+            name: np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode=mode, dtype=dtype,
+                                            shape=(capacity,) + shape if create else None)
+            for name, (dtype, shape) in column_specs(state_size).items()
+        }
+        if create:
+            self.sync()
+
+    @property
+    def full(self):
+        return self.rows >= self.capacity
+
+    def write(self, buffers, start, count):
+        """Copies rows `start:start + count` of the staging `buffers`; returns how many fit."""
+        count = min(count, self.capacity - self.rows)
+        for name, column in self.columns.items():
+            column[self.rows:self.rows + count] = buffers[name][start:start + count]
+        self.rows += count
+        return count
+
+    def sync(self):
+        """Flushes the columns to disk, then publishes the row count."""
+        for column in self.columns.values():
+            column.flush()
+        meta = {"rows": self.rows, "capacity": self.capacity, "state_size": self.state_size, "complete": self.full}
+        temp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(self.path, "meta.json"))
+
+    def close(self):
+        self.sync()
+        self.columns = {}
+
+
+class TrajectoryRecorder:
+    """
+    Opt-in recorder of agent transitions into chunked, memory-mapped column files (see
+    the module docstring for the layout). `record()` / `record_step()` only copy into
+    a staging buffer of `buffer_size` rows. A background thread writes the buffer out
+    every `flush_interval` seconds, or sooner once it is half full. Rows recorded while
+    the buffer is full are dropped and counted, rather than making the request wait.
+    Chunks hold `chunk_size` rows. With `max_chunks`, the oldest chunks are deleted
+    beyond that many. An interrupted chunk is resumed on the next start.
+    """
+    def __init__(self, directory, state_size=128, chunk_size=65536, buffer_size=4096,
+                 flush_interval=1.0, max_chunks=0):
+        self.directory = directory
+        self.state_size = state_size
+        self.chunk_size = chunk_size
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_chunks = max_chunks
+        self.featurizer = StateFeaturizer(state_size)
+        # Two staging buffers: requests fill one while the flusher writes out the other
+        self._staging = [self._new_buffers(), self._new_buffers()]
+        self._active = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._thread = None
+        self._chunk = None
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.chunks_completed = 0
+
+    @classmethod
+    def from_env(cls, subdirectory=None):
+        """
+        A recorder writing to DEADLOCK_TRAJECTORY_DIR (in `subdirectory` of it, if given),
+        configured by DEADLOCK_TRAJECTORY_CHUNK_ROWS / _BUFFER_ROWS / _FLUSH_INTERVAL /
+        _MAX_CHUNKS; None when recording is off (the default).
+        """
+        directory = os.getenv("DEADLOCK_TRAJECTORY_DIR")
+        if not directory:
+            return None
+        if subdirectory:
+            directory = os.path.join(directory, subdirectory)
+        return cls(
+            directory,
+            chunk_size=int(os.getenv("DEADLOCK_TRAJECTORY_CHUNK_ROWS", "65536")),
+            buffer_size=int(os.getenv("DEADLOCK_TRAJECTORY_BUFFER_ROWS", "4096")),
+            flush_interval=float(os.getenv("DEADLOCK_TRAJECTORY_FLUSH_INTERVAL", "1")),
+            max_chunks=int(os.getenv("DEADLOCK_TRAJECTORY_MAX_CHUNKS", "0")),
+        )
+
+    def _new_buffers(self):
+        return {name: np.zeros((self.buffer_size,) + shape, dtype=dtype)
+                for name, (dtype, shape) in column_specs(self.state_size).items()}
+
+    # --- Lifecycle ---
+    def start(self):
+        """Opens (or resumes) the current chunk and starts the background flusher."""
+        if self._thread is not None:
+            return
+        self._chunk = self._open_chunk()
+        self._thread = threading.Thread(target=self._run, name="trajectory-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        print(f"Recording agent transitions to {self.directory} (chunk {os.path.basename(self._chunk.path)}, "
+              f"row {self._chunk.rows}).")
+
+    def _open_chunk(self):
+        paths = _chunk_dirs(self.directory)
+        if paths:
+            meta = _read_meta(paths[-1])
+            if meta and not meta["complete"] and meta["state_size"] == self.state_size:
+                return _Chunk(paths[-1], meta["capacity"], self.state_size, rows=meta["rows"], create=False)
+            number = int(os.path.basename(paths[-1])[len(CHUNK_PREFIX):]) + 1
+        else:
+            number = 0
+        chunk = _Chunk(os.path.join(self.directory, f"{CHUNK_PREFIX}{number:06d}"), self.chunk_size, self.state_size)
+        self._prune()
+        return chunk
+
+    def _prune(self):
+        if self.max_chunks <= 0:
+            return
+        for path in _chunk_dirs(self.directory)[:-self.max_chunks]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def close(self):
+        """Stops the flusher and writes out everything recorded so far."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        self._chunk.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error writing agent transitions to {self.directory}: {e}")
+
+    # --- Recording ---
+    def record(self, state, action, reward, next_state, done):
+        """
+        Stages one transition: `state` / `next_state` are featurized (state_size,) rows,
+        `action` the chosen output slot (-1 for idle). Returns False if it was dropped.
+        """
+        with self._lock:
+            if self._count >= self.buffer_size:
+                self.dropped += 1
+                return False
+            buffers = self._staging[self._active]
+            row = self._count
+            buffers["state"][row] = state
+            buffers["action"][row] = action
+            buffers["reward"][row] = reward
+            buffers["next_state"][row] = next_state
+            buffers["done"][row] = done
+            self._count += 1
+            self.recorded += 1
+            if self._count * 2 >= self.buffer_size:
+                self._wake.set()
+        return True
+
+    def record_step(self, state, action, transition):
+        """
+        Applies `action` to the `NetworkState` with `transition(state, action)` (e.g.
+        simulation.apply_action), records the transition and returns the result.
+        """
+        rows = getattr(self._local, "rows", None)
+        if rows is None:
+            rows = self._local.rows = np.zeros((2, self.state_size), dtype=np.float32)
+        self.featurizer.fill(state, rows[0])
+        position = state.action_position(action)
+        resources = state.resources
+        result = transition(state, action)
+        self.featurizer.fill(state, rows[1])
+        self.record(rows[0], -1 if position is None else position, state.resources - resources,
+                    rows[1], state.action_count() == 0)
+        return result
+
+    def flush(self):
+        """Writes the staged rows to the chunk files (rolling over to new chunks) and syncs them."""
+        with self._flush_lock:
+            if self._chunk is None:
+                return 0
+            with self._lock:
+                buffers, count = self._staging[self._active], self._count
+                self._active = 1 - self._active
+                self._count = 0
+            if not count:
+                return 0
+            written = 0
+            while written < count:
+                written += self._chunk.write(buffers, written, count - written)
+                if self._chunk.full:
+                    self._chunk.close()
+                    self.chunks_completed += 1
+                    self._chunk = self._open_chunk()
+            self._chunk.sync()
+            self.written += count
+            return count
+
+    def stats(self):
+        return {
+            "directory": self.directory,
+            "recorded": self.recorded,
+            "written": self.written,
+            "dropped": self.dropped,
+            "staged": self._count,
+            "chunks_completed": self.chunks_completed,
+            "chunk": os.path.basename(self._chunk.path) if self._chunk else None,
+        }
+
+
+class TrajectoryReader:
+    """
+    Read-only access to the transitions under `directory` (including the per-shard
+    subdirectories of session workers), as memory-mapped columns. Call `refresh()`
+    to pick up rows written since it was opened.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._maps = {}  # chunk path -> {column: memmap}
+        self.chunks = []  # [(path, rows)]
+        self.refresh()
+
+    def refresh(self):
+        chunks = []
+        for root, dirs, _ in os.walk(self.directory):
+            dirs.sort()
+            for name in dirs:
+                if name.startswith(CHUNK_PREFIX):
+                    meta = _read_meta(os.path.join(root, name))
+                    if meta and meta["rows"]:
+                        chunks.append((os.path.join(root, name), meta["rows"]))
+        self.chunks = chunks
+        self._offsets = np.cumsum([0] + [rows for _, rows in chunks])
+        return self
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def chunk(self, i):
+        """The columns of chunk `i`, as memory-mapped views of its valid rows."""
+        path, rows = self.chunks[i]
+        maps = self._maps.get(path)
+        if maps is None:
+            maps = self._maps[path] = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                                       for name in COLUMNS}
+        return {name: column[:rows] for name, column in maps.items()}
+
+    def iter_batches(self, batch_size):
+        """
+        Yields every transition in order, as dicts of column views of up to `batch_size`
+        rows (no copies; batches don't span chunks, so a chunk's last one can be smaller).
+        """
+        for i in range(len(self.chunks)):
+            columns = self.chunk(i)
+            rows = len(columns["action"])
+            for start in range(0, rows, batch_size):
+                yield {name: column[start:start + batch_size] for name, column in columns.items()}
+
+    def sample(self, batch_size, rng=None, out=None):
+        """
+        A minibatch of `batch_size` transitions drawn uniformly with replacement. Only the
+        sampled rows are read from the memory maps; pass a previous result as `out` to
+        gather into its arrays instead of allocating new ones.
+        """
+        if not len(self):
+            raise ValueError(f"No transitions recorded in {self.directory}")
+        rng = rng if rng is not None else np.random.default_rng()
+        indices = np.sort(rng.integers(0, len(self), size=batch_size))
+        if out is None:
+            out = {name: np.empty((batch_size,) + column.shape[1:], dtype=column.dtype)
+                   for name, column in self.chunk(0).items()}
+        # Sorted indices group by chunk: gather each chunk's rows in one take
+        bounds = np.searchsorted(indices, self._offsets)
+        for i in range(len(self.chunks)):
+            lo, hi = bounds[i], bounds[i + 1]
+            if lo == hi:
+                continue
+            local = indices[lo:hi] - self._offsets[i]
+            for name, column in self.chunk(i).items():
+                np.take(column, local, axis=0, out=out[name][lo:hi])
+        return out
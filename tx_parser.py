@@ -0,0 +1,72 @@
+import json
+
+
+class TxExtractor:
+    """
+    Incremental parser for the transaction JSON the chat LLM embeds in its reply,
+    e.g. `{ "tx": { "to": "<recipient_pubkey>", "amount": 0.01 } }`.
+
+    Feed it the reply chunk by chunk with `feed()`; it tracks brace depth (skipping
+    braces inside JSON strings) and returns the object as soon as its closing brace
+    arrives, without waiting for the rest of the reply. The first object that parses
+    and has a "tx" key is returned, looking inside objects that don't; other braces are skipped.
+    """
+    def __init__(self):
+        self.tx = None
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        """Consumes `chunk`. Returns the transaction object if it completed in this chunk, else None."""
+        if self.tx is not None:
+            return None
+        pending, i = chunk, 0
+        while i < len(pending):
+            ch = pending[i]
+            i += 1
+            if self._depth == 0:
+                if ch == "{":
+                    self._buffer = [ch]
+                    self._depth = 1
+                    self._in_string = False
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    text = "".join(self._buffer)
+                    self._buffer = []
+                    candidate = self._parse(text)
+                    if candidate is not None:
+                        self.tx = candidate
+                        return candidate
+                    # Not the transaction itself; it may still be nested inside
+                    pending, i = text[1:] + pending[i:], 0
+        return None
+
+    @staticmethod
+    def _parse(text):
+        try:
+            obj = json.loads(text)
+        except ValueError:
+            return None
+        return obj if isinstance(obj, dict) and "tx" in obj else None
+
+
+def extract_tx(text):
+    """Returns the transaction object embedded in a complete reply, or None."""
+    return TxExtractor().feed(text)
@@ -0,0 +1,192 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+from simulation import valid_entity
+
+
+class WebhookQueueFull(Exception):
+    """Raised by `WebhookPipeline.submit` when the queue is full; the sender should retry later."""
+
+
+def webhook_updates(payloads):
+    """
+    Collects the new entities from a batch of webhook payloads into one updates dict
+    for `simulation.apply_updates`. A payload can carry "missions" / "data_havens"
+    lists (the `network_state` shape) or a single "mission" / "data_haven" object.
+    Malformed entries (see `simulation.valid_entity`) are dropped; within a batch the
+    first entry per id wins.
+    """
+    updates = {"missions": {}, "data_havens": {}}
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            continue
+        for kind, single in (("missions", "mission"), ("data_havens", "data_haven")):
+            entries = payload.get(kind)
+            entries = list(entries) if isinstance(entries, list) else []
+            if isinstance(payload.get(single), dict):
+                entries.append(payload[single])
+            for entry in entries:
+                if valid_entity(entry, kind):
+                    updates[kind].setdefault(entry["id"], entry)
+    return {kind: list(entries.values()) for kind, entries in updates.items() if entries}
+
+
+class WebhookPipeline:
+    """
+    Asynchronous ingestion for `/webhook`: the endpoint only queues the raw body and
+    acknowledges, and a background task drains the queue in batches of up to `batch_size`
+    (waiting at most `batch_interval` seconds to fill one), parses them and hands the
+    payloads to `handler(payloads)` on the event loop.
+
+    The queue holds at most `max_queue` deliveries; past that `submit()` raises
+    `WebhookQueueFull`, so senders get backpressure instead of unbounded memory use.
+    Deliveries with an idempotency key (the `Idempotency-Key` header, or an
+    "idempotency_key" field in the payload) seen among the last `dedupe_size` keys are dropped.
+    """
+    def __init__(self, handler, max_queue=10000, batch_size=256, batch_interval=0.05,
+                 dedupe_size=100000, rate_window=10.0):
+        self.handler = handler
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.dedupe_size = dedupe_size
+        self.rate_window = rate_window
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._seen = OrderedDict()  # recent idempotency keys, oldest first
+        self._recent = deque()  # (time, payloads processed) per batch, for the throughput rate
+        self._task = None
+        self._batch = []  # taken off the queue, not yet processed
+
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.invalid = 0
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.drained = 0
+        self.max_depth = 0
+        self.total_lag = 0.0
+
+    def _remember(self, key):
+        """Records `key`; returns False if it was already seen."""
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            return False
+        self._seen[key] = None
+        if len(self._seen) > self.dedupe_size:
+            self._seen.popitem(last=False)
+        return True
+
+    def submit(self, body, key=None):
+        """
+        Queues a raw webhook body. Returns False if `key` is a duplicate (nothing queued),
+        True otherwise. Raises `WebhookQueueFull` when the queue is full.
+        """
+        if key is not None and key in self._seen:
+            self.duplicates += 1
+            return False
+        try:
+            self._queue.put_nowait((time.monotonic(), body))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise WebhookQueueFull(f"Webhook queue is full ({self.max_queue} pending).")
+        if key is not None:
+            self._remember(key)
+        self.accepted += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    # --- Draining ---
+    async def _next_batch(self):
+        batch = self._batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.batch_interval
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _process(self, batch):
+        payloads = []
+        now = time.monotonic()
+        self.drained += len(batch)
+        for received, body in batch:
+            self.total_lag += now - received
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                self.invalid += 1
+                continue
+            # Keys that only appear inside the body are checked here, off the request path
+            key = payload.get("idempotency_key") if isinstance(payload, dict) else None
+            if key is not None and not self._remember(key):
+                self.duplicates += 1
+                continue
+            payloads.append(payload)
+
+        self.batches += 1
+        if not payloads:
+            return
+        try:
+            self.handler(payloads)
+            self.processed += len(payloads)
+            self._recent.append((now, len(payloads)))
+        except Exception as e:
+            self.failed += len(payloads)
+            print(f"Error processing {len(payloads)} webhook payloads: {e}")
+
+    async def run(self):
+        while True:
+            batch = await self._next_batch()
+            self._batch = []
+            self._process(batch)
+
+    def start(self):
+        """Starts draining on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        """Stops the drain task, then processes whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._process(batch)
+        while not self._queue.empty():
+            batch = [self._queue.get_nowait() for _ in range(min(self.batch_size, self._queue.qsize()))]
+            self._process(batch)
+
+    def stats(self):
+        cutoff = time.monotonic() - self.rate_window
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "max_depth": self.max_depth,
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "invalid": self.invalid,
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "mean_batch_size": self.drained / self.batches if self.batches else 0.0,
+            "mean_lag_seconds": self.total_lag / self.drained if self.drained else 0.0,
+            "processed_per_sec": sum(count for _, count in self._recent) / self.rate_window,
+        }